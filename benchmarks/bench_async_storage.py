@@ -0,0 +1,115 @@
+"""
+Mixed-load latency benchmark for the async storage layer.
+
+Boots the FastAPI app in-process against a temporary data directory and fires
+an open-loop (Poisson) stream of campaign reads, journal appends and settings
+reads. Latency is measured from each request's scheduled arrival time, so time
+spent waiting for a stalled event loop is included. A configurable delay is
+injected into every JSON file read to simulate a slow or contended disk.
+
+`--mode sync` reproduces the old behaviour by running storage calls inline on
+the event loop; `--mode async` (default) uses the storage thread pool.
+
+    python -m benchmarks.bench_async_storage --mode sync
+    python -m benchmarks.bench_async_storage --mode async
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from server.core import config, storage
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from server.main import app
+
+    if args.mode == "sync":
+        async def inline(func, *a, **kw):
+            return func(*a, **kw)
+        storage.run_blocking = inline
+
+    original_read_json = storage.read_json
+
+    def slow_read_json(path):
+        time.sleep(args.disk_delay_ms / 1000)
+        return original_read_json(path)
+
+    storage.read_json = slow_read_json
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        r = await client.post("/api/auth/register", json={"email": "bench@example.com", "password": "pw", "username": "bench"})
+        headers = {"X-User-Code": r.json()["user_code"]}
+        campaign = (await client.post("/api/campaigns", json={"name": "Bench"}, headers=headers)).json()
+        for i in range(args.journal_entries):
+            await client.post(f"/api/campaigns/{campaign['id']}/journal",
+                              json={"message": {"role": "user", "content": f"seed {i}"}}, headers=headers)
+
+        latencies = {"details": [], "append": [], "settings": []}
+        rng = random.Random(42)
+
+        async def request(kind, scheduled):
+            if kind == "details":
+                await client.get(f"/api/campaigns/{campaign['id']}", headers=headers)
+            elif kind == "append":
+                await client.post(f"/api/campaigns/{campaign['id']}/journal",
+                                  json={"message": {"role": "user", "content": "bench"}}, headers=headers)
+            else:
+                await client.get("/api/users/settings", headers=headers)
+            latencies[kind].append((time.perf_counter() - scheduled) * 1000)
+
+        tasks = []
+        wall = time.perf_counter()
+        next_arrival = wall
+        for _ in range(args.requests):
+            next_arrival += rng.expovariate(args.rate)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = rng.choices(["details", "append", "settings"], weights=[2, 1, 3])[0]
+            tasks.append(asyncio.create_task(request(kind, next_arrival)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - wall
+
+    everything = [v for values in latencies.values() for v in values]
+    print(f"mode={args.mode} rate={args.rate}/s disk_delay={args.disk_delay_ms}ms "
+          f"requests={len(everything)} throughput={len(everything) / wall:.0f} req/s")
+    for kind, values in list(latencies.items()) + [("all", everything)]:
+        print(f"  {kind:<9} p50={statistics.median(values):7.1f}ms  "
+              f"p95={percentile(values, 95):7.1f}ms  p99={percentile(values, 99):7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sync", "async"], default="async")
+    parser.add_argument("--rate", type=float, default=100.0, help="Request arrivals per second")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--disk-delay-ms", type=float, default=5.0)
+    parser.add_argument("--journal-entries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
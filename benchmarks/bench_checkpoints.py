@@ -0,0 +1,109 @@
+"""
+Checkpoint size and restore time on a long campaign.
+
+Builds a journal of N entries, checkpointing every K entries, and reports:
+  disk     - total checkpoint bytes: the old full-copy format vs incremental
+  save     - mean time to take one checkpoint
+  restore  - rolling back to the middle checkpoint:
+               truncate - the normal path (journal cut back in place)
+               rebuild  - journal lost, reassembled from the checkpoint chain
+               legacy   - parse a full-copy checkpoint and rewrite the journal
+
+    python -m benchmarks.bench_checkpoints --entries 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.core import checkpoints, config, storage
+from server.core.storage_sqlite import SqliteBackend
+
+USER_CODE = "11111111-1111-1111-1111-111111111111"
+CAMPAIGN_ID = "22222222-2222-2222-2222-222222222222"
+
+
+WORDS = ("the party presses on through dark forest goblin torch sword whisper ancient door "
+         "gold cursed river tavern dragon shadow spell rolls attack wounded laughs").split()
+
+
+def make_entry(i: int) -> dict:
+    rng = random.Random(i)
+    return {"role": "assistant" if i % 2 else "user",
+            "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 120))),
+            "timestamp": f"2024-01-01T00:00:{i % 60:02d}"}
+
+
+def legacy_checkpoint(backend, meta, length) -> str:
+    """The old format: meta plus the whole journal, pretty-printed."""
+    entries = backend.read_journal(USER_CODE, CAMPAIGN_ID, 0, length)
+    return json.dumps({"meta": meta, "journal": {"entries": entries}}, indent=2, default=str)
+
+
+def run(label, backend, args):
+    meta = {"id": CAMPAIGN_ID, "name": "Bench", "status": "active", "created_at": "2024-01-01T00:00:00"}
+    backend.save_campaign_meta(USER_CODE, meta)
+    backend.create_journal(USER_CODE, CAMPAIGN_ID)
+
+    legacy_bytes = incremental_bytes = 0
+    save_times = []
+    now = datetime(2024, 1, 1)
+    for i in range(args.entries):
+        backend.append_journal_entry(USER_CODE, CAMPAIGN_ID, make_entry(i))
+        if (i + 1) % args.every == 0:
+            now += timedelta(hours=1)
+            start = time.perf_counter()
+            info, _ = checkpoints.create_checkpoint(backend, USER_CODE, CAMPAIGN_ID, now=now)
+            save_times.append(time.perf_counter() - start)
+            incremental_bytes += info["bytes"]
+
+            legacy_bytes += len(legacy_checkpoint(backend, meta, i + 1))
+
+    records = backend.list_checkpoints(USER_CODE, CAMPAIGN_ID)
+    target = next(r for r in records if r["seq"] >= args.entries // 2)
+    legacy = legacy_checkpoint(backend, meta, target["seq"])
+
+    start = time.perf_counter()
+    checkpoints.restore_checkpoint(backend, USER_CODE, CAMPAIGN_ID, target["name"])
+    truncate = time.perf_counter() - start
+
+    backend.truncate_journal(USER_CODE, CAMPAIGN_ID, 0)
+    start = time.perf_counter()
+    checkpoints.restore_checkpoint(backend, USER_CODE, CAMPAIGN_ID, target["name"])
+    rebuild = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = json.loads(legacy)
+    backend.replace_journal(USER_CODE, CAMPAIGN_ID, data["journal"]["entries"])
+    backend.save_campaign_meta(USER_CODE, data["meta"])
+    legacy = time.perf_counter() - start
+
+    assert backend.journal_length(USER_CODE, CAMPAIGN_ID) == target["seq"]
+    print(f"{label}: {args.entries} entries, checkpoint every {args.every}, {len(records)} kept")
+    print(f"  disk     legacy {legacy_bytes / 1e6:8.1f} MB   incremental {incremental_bytes / 1e6:8.2f} MB")
+    print(f"  save     {sum(save_times) / len(save_times) * 1000:8.2f} ms/checkpoint")
+    print(f"  restore  truncate {truncate * 1000:7.1f} ms   rebuild {rebuild * 1000:7.1f} ms   "
+          f"legacy {legacy * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--every", type=int, default=500, help="Take a checkpoint every N entries.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        run("json", storage.JsonFileBackend(), args)
+        run("sqlite", SqliteBackend(Path(tmp) / "bench.sqlite3"), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Throughput of the multi-worker mode as the number of workers grows.
+
+For each worker count in --workers (default: 1, 2, 4, ... up to the CPU
+count), starts `python -m server.core.cluster` on a free local port against
+a temporary data directory, seeds --campaigns campaigns (each with a
+journal and a room playing it), then runs --loaders client processes, each
+keeping --concurrency requests in flight for --seconds. The load is a mix
+of what a table generates, spread over all campaigns:
+
+  - GET /api/campaigns/{id}        (campaign details)
+  - GET /api/campaigns/{id}/journal
+  - POST /api/campaigns/{id}/journal (appending a turn)
+  - POST /api/dice/bulk with campaign_id (rolls shown to the room)
+  - GET /api/rooms/{code}
+
+Reports requests per second, latency (p50/p99) and the speedup and
+efficiency against one worker. Roughly a 1/N share of requests are
+accepted by their owner; the rest take one extra hop over a Unix socket.
+The loaders use CPU too, so scaling is only meaningful on a machine with
+more cores than workers + loaders (or with the load coming from another
+machine, via --url).
+
+    python -m benchmarks.bench_cluster --workers 1 2 4 8 --loaders 4 --seconds 15
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base: str, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(base + "/api/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("The cluster didn't start")
+
+
+def seed(base: str, campaigns: int):
+    """A host and `campaigns` campaigns with a few journal entries and a room each."""
+    with httpx.Client(base_url=base, timeout=60) as http:
+        user = http.post("/api/auth/register", json={
+            "email": "host@bench.local", "password": "pw", "username": "host"}).json()["user_code"]
+        headers = {"X-User-Code": user}
+        tables = []
+        for i in range(campaigns):
+            campaign_id = http.post("/api/campaigns", json={"name": f"Campaign {i}"}, headers=headers).json()["id"]
+            for turn in range(10):
+                http.post(f"/api/campaigns/{campaign_id}/journal", headers=headers,
+                          json={"message": {"role": "user", "content": f"Turn {turn} of campaign {i}"}})
+            room_code = http.post("/api/rooms", json={"is_public": False, "campaign_id": campaign_id},
+                                  headers=headers).json()["room_code"]
+            tables.append((campaign_id, room_code))
+    return user, tables
+
+
+async def load(base: str, user: str, tables, concurrency: int, seconds: float):
+    headers = {"X-User-Code": user}
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, headers=headers, limits=limits, timeout=60) as http:
+        deadline = time.perf_counter() + seconds
+
+        def request():
+            campaign_id, room_code = random.choice(tables)
+            kind = random.random()
+            if kind < 0.3:
+                return http.get(f"/api/campaigns/{campaign_id}")
+            if kind < 0.5:
+                return http.get(f"/api/campaigns/{campaign_id}/journal")
+            if kind < 0.6:
+                return http.post(f"/api/campaigns/{campaign_id}/journal",
+                                 json={"message": {"role": "user", "content": "I search the room."}})
+            if kind < 0.8:
+                return http.post("/api/dice/bulk", json={
+                    "rolls": [{"expression": "1d20+5"}, {"expression": "2d6+3"}], "campaign_id": campaign_id})
+            return http.get(f"/api/rooms/{room_code}")
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await request()
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def loader(base, user, tables, concurrency, seconds, results):
+    results.put(asyncio.run(load(base, user, tables, concurrency, seconds)))
+
+
+def run(args, workers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        base = args.url or f"http://127.0.0.1:{port}"
+        cluster = None
+        if not args.url:
+            cluster = subprocess.Popen(
+                [sys.executable, "-m", "server.core.cluster", "--workers", str(workers), "--host", "127.0.0.1",
+                 "--port", str(port), "--internal-port", str(free_port()), "--data-dir", tmp,
+                 "--log-level", "warning"],
+                cwd=ROOT, stdout=subprocess.DEVNULL)
+        try:
+            wait_until_up(base)
+            user, tables = seed(base, args.campaigns)
+            results = multiprocessing.Queue()
+            loaders = [multiprocessing.Process(target=loader, args=(base, user, tables, args.concurrency,
+                                                                    args.seconds, results))
+                       for _ in range(args.loaders)]
+            for process in loaders:
+                process.start()
+            outcomes = [results.get() for _ in loaders]
+            for process in loaders:
+                process.join()
+        finally:
+            if cluster is not None:
+                cluster.terminate()
+                cluster.wait()
+    latencies = [l * 1000 for outcome in outcomes for l in outcome[0]]
+    return len(latencies) / args.seconds, latencies, sum(outcome[1] for outcome in outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", help="Worker counts to compare (default: powers of 2 up to the CPU count)")
+    parser.add_argument("--loaders", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Client processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight per loader")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--campaigns", type=int, default=64)
+    parser.add_argument("--url", help="Load an already running server instead (one run, --workers is a label)")
+    args = parser.parse_args()
+
+    if not args.workers:
+        args.workers = [1]
+        while args.workers[-1] * 2 <= (os.cpu_count() or 1):
+            args.workers.append(args.workers[-1] * 2)
+
+    print(f"{os.cpu_count()} CPUs; {args.loaders} loaders x {args.concurrency} in flight; "
+          f"{args.campaigns} campaigns; {args.seconds:.0f}s per run")
+    print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'speedup':>8} {'efficiency':>11}")
+    baseline = None
+    for workers in args.workers:
+        rate, latencies, errors = run(args, workers)
+        baseline = baseline or rate / workers
+        speedup = rate / baseline
+        print(f"{workers:>8} {rate:>9,.0f} {percentile(latencies, 50):>8.2f} {percentile(latencies, 99):>8.2f} "
+              f"{errors:>7} {speedup:>7.2f}x {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Dice rolling throughput: one die per call vs vectorized expressions.
+
+  loop        - dice.roll(sides) once per die, summed in Python (what clients
+                had to do through POST /dice/roll, minus the round trips)
+  loop+seed   - the same with seed=..., which builds a random.Random per die
+  vectorized  - dice_notation.roll(expression, times), all dice in one call
+
+for a few common expressions, each rolled --times times.
+
+Then replaying a log of --replays campaign rolls (8d6 each) from their roll
+numbers (rng.generator per roll) against regenerating them from per-die
+seeds with dice.roll(seed=...).
+
+    python -m benchmarks.bench_dice --times 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from server.game_logic import dice, dice_notation, rng as rng_streams
+
+# (expression, the same roll with dice.roll)
+CASES = [
+    ("8d6", lambda roll: sum(roll(6) for _ in range(8))),
+    ("4d6kh3", lambda roll: sum(sorted(roll(6) for _ in range(4))[1:])),
+    ("d20adv+5", lambda roll: max(roll(20), roll(20)) + 5),
+    ("20d8+10", lambda roll: sum(roll(8) for _ in range(20)) + 10),
+]
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--times", type=int, default=10_000, help="Rolls of each expression")
+    parser.add_argument("--replays", type=int, default=10_000, help="Logged rolls to replay")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    seeds = random.Random(1)
+    rng = np.random.default_rng(1)
+    print(f"{args.times} rolls per expression, best of {args.repeat} (ms)")
+    print(f"  {'expression':<10} {'dice':>8} {'loop':>10} {'loop+seed':>10} {'vectorized':>11} {'speedup':>8}")
+    for notation, by_hand in CASES:
+        expression = dice_notation.parse(notation)
+        loop = best_of(lambda: [by_hand(dice.roll) for _ in range(args.times)], args.repeat)
+        seeded = best_of(lambda: [by_hand(lambda sides: dice.roll(sides, seed=seeds.random()))
+                                  for _ in range(args.times)], args.repeat)
+        vectorized = best_of(lambda: dice_notation.roll(expression, args.times, rng), args.repeat)
+        print(f"  {notation:<10} {expression.dice_count * args.times:>8} {loop:>10.1f} {seeded:>10.1f} "
+              f"{vectorized:>11.2f} {loop / vectorized:>7.0f}x")
+
+    fireball = dice_notation.parse("8d6")
+    key = rng_streams.new_key()
+    streams = best_of(lambda: [dice_notation.roll(fireball, 1, rng_streams.generator(key, n))
+                               for n in range(args.replays)], args.repeat)
+    seeded = best_of(lambda: [sum(dice.roll(6, seed=n * 8 + d) for d in range(8))
+                              for n in range(args.replays)], args.repeat)
+    print(f"replay {args.replays} logged 8d6 rolls (ms): streams {streams:.1f}, per-die seeds {seeded:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Offline end-to-end benchmark of the whole API.
+
+Boots the FastAPI app from server/main.py in-process (with its lifespan)
+against a temporary data directory, with the fake LLM in place of Gemini.
+Seeds synthetic users, campaigns and long journals, then drives each endpoint
+with a fixed number of concurrent clients and reports throughput and
+p50/p95/p99 latency per endpoint:
+
+  register, login, campaign list, campaign details, journal append,
+  dice roll, AI complete
+
+Results are written as JSON (with the git commit, settings and environment),
+so runs can be compared between commits:
+
+    python -m benchmarks.bench_e2e --output before.json
+    git checkout <other commit>
+    python -m benchmarks.bench_e2e --output after.json --compare before.json
+
+The fake model's latency and reply size are tunable (--llm-latency-ms,
+--llm-reply-chars), as are the seeded journal length and concurrency.
+"""
+import argparse
+import asyncio
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from server.core import config, serialization, storage
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    from server.core.ai_client import FakeModel, client as ai_client
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+WORDS = ("the party presses on through dark forest goblin torch sword whisper ancient door "
+         "gold cursed river tavern dragon shadow spell rolls attack wounded laughs").split()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_reply(chars: int) -> str:
+    """A DM reply of about `chars` characters of narrative, plus the metadata block."""
+    words, size, i = [], 0, 0
+    while size < chars:
+        word = WORDS[i % len(WORDS)]
+        words.append(word)
+        size += len(word) + 1
+        i += 1
+    return " ".join(words).capitalize() + ".\n\n```json\n{\"mood\": \"tense\", \"hp_change\": -2}\n```"
+
+
+def make_entry(i: int) -> dict:
+    content = " ".join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(10 + i % 60))
+    return {"role": "assistant" if i % 2 else "user", "content": content,
+            "timestamp": f"2024-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}"}
+
+
+async def seed(client, args):
+    """Registers users and gives each campaigns with long journals. Returns [(email, headers, [campaign ids])]."""
+    users = []
+    backend = storage.get_backend()
+    for u in range(args.users):
+        email = f"seed{u}@example.com"
+        r = await client.post("/api/auth/register", json={"email": email, "password": "pw", "username": f"seed{u}"})
+        headers = {"Authorization": f"Bearer {r.json()['session_token']}"}
+        campaign_ids = []
+        for c in range(args.campaigns):
+            campaign = (await client.post("/api/campaigns", json={"name": f"Campaign {c}"}, headers=headers)).json()
+            # Long journals are bulk-loaded through the backend; appending them one by one is what
+            # the journal_append phase measures.
+            await storage.run_blocking(backend.replace_journal, r.json()["user_code"], campaign["id"],
+                                       [make_entry(i) for i in range(args.journal_entries)])
+            campaign_ids.append(campaign["id"])
+        users.append((email, headers, campaign_ids))
+    return users
+
+
+def build_phases(users, args):
+    """Each phase maps a request index to an awaitable factory taking the client."""
+    def pick(i):
+        return users[i % len(users)]
+
+    def register(i):
+        return lambda c: c.post("/api/auth/register", json={"email": f"bench{i}@example.com", "password": "pw",
+                                                            "username": f"bench{i}"})
+
+    def login(i):
+        return lambda c: c.post("/api/auth/login", json={"email": pick(i)[0], "password": "pw"})
+
+    def campaign_list(i):
+        return lambda c: c.get("/api/campaigns", headers=pick(i)[1])
+
+    def campaign_details(i):
+        _, headers, campaigns = pick(i)
+        return lambda c: c.get(f"/api/campaigns/{campaigns[i % len(campaigns)]}", headers=headers)
+
+    def journal_append(i):
+        _, headers, campaigns = pick(i)
+        return lambda c: c.post(f"/api/campaigns/{campaigns[i % len(campaigns)]}/journal", headers=headers,
+                                json={"message": {"role": "user", "content": f"bench entry {i}"}})
+
+    def dice(i):
+        return lambda c: c.post("/api/dice/roll", json={"sides": 20}, headers=pick(i)[1])
+
+    def ai_complete(i):
+        _, headers, campaigns = pick(i)
+        # Distinct actions, so no request is coalesced with another.
+        return lambda c: c.post("/api/ai/complete", headers=headers, json={
+            "campaign_id": campaigns[i % len(campaigns)], "messages": [{"role": "user", "content": f"I act ({i})."}]})
+
+    return {
+        "register": (register, args.requests),
+        "login": (login, args.requests),
+        "campaign_list": (campaign_list, args.requests),
+        "campaign_details": (campaign_details, args.requests),
+        "journal_append": (journal_append, args.requests),
+        "dice": (dice, args.requests),
+        "ai_complete": (ai_complete, args.ai_requests),
+    }
+
+
+async def run_phase(client, factory, requests, concurrency):
+    """Closed loop: `concurrency` workers issue `requests` requests between them."""
+    latencies, statuses, counter = [], {}, iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            call = factory(i)
+            start = time.perf_counter()
+            response = await call(client)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall
+    return {
+        "requests": requests,
+        "errors": sum(count for code, count in statuses.items() if code >= 400),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "throughput_rps": round(requests / wall, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+    }
+
+
+async def run(args):
+    from server.main import app
+
+    ai_client.use_model(FakeModel(reply=make_reply(args.llm_reply_chars),
+                                  first_token_delay=args.llm_latency_ms / 1000))
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            start = time.perf_counter()
+            users = await seed(client, args)
+            print(f"seeded {args.users} users x {args.campaigns} campaigns x {args.journal_entries} entries "
+                  f"in {time.perf_counter() - start:.1f}s")
+            for name, (factory, requests) in build_phases(users, args).items():
+                if args.only and name not in args.only:
+                    continue
+                results[name] = await run_phase(client, factory, requests, args.concurrency)
+                r = results[name]
+                print(f"  {name:<17} {r['throughput_rps']:8.1f} req/s  p50={r['p50_ms']:7.2f}ms  "
+                      f"p95={r['p95_ms']:7.2f}ms  p99={r['p99_ms']:7.2f}ms  statuses={r['statuses']}")
+    return results
+
+
+def compare(results, baseline_path: Path):
+    baseline = serialization.loads(baseline_path.read_bytes())
+    print(f"vs {baseline_path} (commit {baseline.get('commit')}):")
+    for name, r in results.items():
+        old = baseline["endpoints"].get(name)
+        if old:
+            print(f"  {name:<17} throughput x{r['throughput_rps'] / old['throughput_rps']:5.2f}   "
+                  f"p50 x{r['p50_ms'] / old['p50_ms']:5.2f}   p99 x{r['p99_ms'] / old['p99_ms']:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--campaigns", type=int, default=3, help="Campaigns per seeded user")
+    parser.add_argument("--journal-entries", type=int, default=2000, help="Entries per seeded journal")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--ai-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-reply-chars", type=int, default=800)
+    parser.add_argument("--only", nargs="*", help="Run only these endpoints")
+    parser.add_argument("--output", type=Path, help=f"Results file (default: {RESULTS_DIR}/e2e-<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="A previous results file to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        config.STORAGE_BACKEND = args.backend
+        storage.set_backend(None)
+        print(f"commit {commit}, backend {args.backend}, concurrency {args.concurrency}, "
+              f"fake LLM {args.llm_latency_ms}ms / {args.llm_reply_chars} chars")
+        results = asyncio.run(run(args))
+
+    output = args.output or RESULTS_DIR / f"e2e-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    settings = {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()
+                if k not in ("output", "compare")}
+    output.write_bytes(serialization.dumps({
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "endpoints": results,
+    }, pretty=True))
+    print(f"results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Load test for the LLM dispatcher with a fake, fixed-latency model.
+
+Boots the FastAPI app in-process against a temporary data directory. U users
+fire an open-loop (Poisson) stream of /ai/complete calls, while a probe hits
+/api/health every 50 ms. Reports completed/shed counts, completion latency,
+probe latency (how responsive the worker stays) and the dispatcher's queue
+depth and wait times.
+
+`--mode inline` reproduces the old behaviour, with the blocking model call made
+directly on the event loop. `--mode dispatch` (default) goes through the
+dispatcher.
+
+    python -m benchmarks.bench_llm_dispatch --mode inline
+    python -m benchmarks.bench_llm_dispatch --mode dispatch --rate 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from server.core import config, llm_dispatch
+from server.core.ai_client import FakeModel, client as ai_client
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+async def run(args):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from server.main import app
+
+    ai_client.use_model(FakeModel(first_token_delay=args.latency_ms / 1000))
+    dispatcher = llm_dispatch.LLMDispatcher(max_concurrency=args.concurrency, max_per_user=args.per_user,
+                                            queue_size=args.queue_size, queue_timeout=args.queue_timeout)
+    llm_dispatch.dispatcher = dispatcher
+    if args.mode == "inline":
+        async def inline(user_code, func, *a, **kw):
+            return func(*a, **kw)
+        dispatcher.run = inline
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        users = []
+        for i in range(args.users):
+            r = await client.post("/api/auth/register",
+                                  json={"email": f"u{i}@example.com", "password": "pw", "username": f"u{i}"})
+            headers = {"X-User-Code": r.json()["user_code"]}
+            campaign = (await client.post("/api/campaigns", json={"name": f"c{i}"}, headers=headers)).json()
+            users.append((headers, campaign["id"]))
+
+        latencies, statuses, probes, depths = [], {}, [], []
+        rng = random.Random(42)
+        done = asyncio.Event()
+
+        async def request(headers, campaign_id, scheduled):
+            r = await client.post("/api/ai/complete", headers=headers, json={
+                "campaign_id": campaign_id, "messages": [{"role": "user", "content": "I open the door."}]})
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            if r.status_code == 200:
+                latencies.append((time.perf_counter() - scheduled) * 1000)
+
+        async def probe():
+            # Measured from when the probe was due, so time the event loop spent blocked counts.
+            while not done.is_set():
+                due = time.perf_counter() + 0.05
+                await asyncio.sleep(0.05)
+                await client.get("/api/health")
+                probes.append((time.perf_counter() - due) * 1000)
+                depths.append(dispatcher.stats()["queue_depth"])
+
+        prober = asyncio.create_task(probe())
+        tasks = []
+        wall = time.perf_counter()
+        next_arrival = wall
+        for _ in range(args.requests):
+            next_arrival += rng.expovariate(args.rate)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            headers, campaign_id = rng.choice(users)
+            tasks.append(asyncio.create_task(request(headers, campaign_id, next_arrival)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - wall
+        done.set()
+        await prober
+
+    stats = dispatcher.stats()
+    print(f"mode={args.mode} rate={args.rate}/s latency={args.latency_ms}ms concurrency={args.concurrency} "
+          f"users={args.users} requests={args.requests} wall={wall:.1f}s")
+    print(f"  statuses   {dict(sorted(statuses.items()))}   completed/s={statuses.get(200, 0) / wall:.1f}")
+    if latencies:
+        print(f"  complete   p50={statistics.median(latencies):7.1f}ms  p95={percentile(latencies, 95):7.1f}ms  "
+              f"p99={percentile(latencies, 99):7.1f}ms")
+    print(f"  health     p50={statistics.median(probes):7.1f}ms  p95={percentile(probes, 95):7.1f}ms  "
+          f"max={max(probes):7.1f}ms")
+    if args.mode == "dispatch":
+        print(f"  queue      max depth={max(depths)}  wait p50={stats['wait_ms']['p50']}ms  "
+              f"p95={stats['wait_ms']['p95']}ms  shed: full={stats['rejected_queue_full']} "
+              f"user={stats['rejected_user_limit']} timeout={stats['timeouts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inline", "dispatch"], default="dispatch")
+    parser.add_argument("--rate", type=float, default=20.0, help="Request arrivals per second")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Fake model latency per call")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-user", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--queue-timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Overhead of the metrics layer (server/core/metrics.py).
+
+Boots the app in-process (with its lifespan) against a temporary data
+directory and reports:
+
+  - primitives: the cost of Counter.inc and Histogram.observe, with
+    METRICS_ENABLED on and off, and of rendering /api/metrics
+  - storage.read_json: a cache hit (the most frequent storage call) with
+    metrics on and off
+  - requests: throughput and latency of GET /api/health and of GET
+    /api/campaigns/{id} (auth, storage reads, routing) with metrics on and
+    off. The two settings alternate over --rounds rounds, so drift in the
+    machine's speed affects both; throughput is the median over rounds.
+    The middleware's own cost is also measured around a no-op app, which
+    is far more stable than the difference of two noisy request timings.
+
+    python -m benchmarks.bench_metrics --requests 5000 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from server.core import config, metrics, storage
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def per_call_ns(func, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def primitives(calls: int):
+    counter = metrics.Counter("bench_total", "Benchmark counter.", ("route", "status"))
+    histogram = metrics.Histogram("bench_seconds", "Benchmark histogram.", ("route",))
+    labels = ("/api/campaigns/{campaign_id}", "200")
+    print(f"{'primitive':<28} {'on ns':>8} {'off ns':>8}")
+    for name, func in (("Counter.inc", lambda: counter.inc(labels=labels)),
+                       ("Histogram.observe", lambda: histogram.observe(0.0042, labels[:1]))):
+        config.METRICS_ENABLED = True
+        enabled = per_call_ns(func, calls)
+        config.METRICS_ENABLED = False
+        disabled = per_call_ns(func, calls)
+        print(f"{name:<28} {enabled:>8.0f} {disabled:>8.0f}")
+    config.METRICS_ENABLED = True
+
+    # The middleware alone, around an app that does nothing.
+    from server.api.metrics import MetricsMiddleware
+
+    async def noop_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def noop_send(message):
+        pass
+
+    async def middleware_calls(app, count):
+        scope = {"type": "http", "method": "GET", "path": "/api/health"}
+        start = time.perf_counter()
+        for _ in range(count):
+            await app(dict(scope), None, noop_send)
+        return (time.perf_counter() - start) / count * 1e9
+
+    wrapped = MetricsMiddleware(noop_app)
+    config.METRICS_ENABLED = True
+    enabled = asyncio.run(middleware_calls(wrapped, calls // 4))
+    config.METRICS_ENABLED = False
+    disabled = asyncio.run(middleware_calls(wrapped, calls // 4))
+    bare = asyncio.run(middleware_calls(noop_app, calls // 4))
+    config.METRICS_ENABLED = True
+    print(f"{'MetricsMiddleware':<28} {enabled - bare:>8.0f} {disabled - bare:>8.0f}  (on top of the app)")
+
+    start = time.perf_counter()
+    text = metrics.render(metrics.snapshot())
+    print(f"render /api/metrics: {(time.perf_counter() - start) * 1000:.2f} ms for {len(text.splitlines())} lines")
+
+
+def read_json_hits(data_dir: Path, calls: int):
+    path = data_dir / "bench.json"
+    storage.write_json(path, {"name": "Campaign", "tags": list(range(50))})
+    storage.read_json(path)
+    results = {}
+    for enabled in (True, False):
+        config.METRICS_ENABLED = enabled
+        results[enabled] = per_call_ns(lambda: storage.read_json(path), calls)
+    config.METRICS_ENABLED = True
+    print(f"\nstorage.read_json (cache hit): {results[True] / 1000:.2f} us with metrics, "
+          f"{results[False] / 1000:.2f} us without (+{(results[True] - results[False]) / 1000:.2f} us)")
+
+
+async def requests(args):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from server.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            user = (await client.post("/api/auth/register", json={
+                "email": "bench@bench.local", "password": "pw", "username": "bench"})).json()["user_code"]
+            headers = {"X-User-Code": user}
+            campaign_id = (await client.post("/api/campaigns", json={"name": "Bench"}, headers=headers)).json()["id"]
+
+            async def run(path: str, count: int):
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(count):
+                    sent = time.perf_counter()
+                    response = await client.get(path, headers=headers)
+                    latencies.append(time.perf_counter() - sent)
+                    assert response.status_code == 200
+                return count / (time.perf_counter() - start), latencies
+
+            print(f"\n{'endpoint':<28} {'metrics':>8} {'req/s':>9} {'p50 us':>8} {'p99 us':>8}")
+            for label, path in (("GET /api/health", "/api/health"),
+                                ("GET /api/campaigns/{id}", f"/api/campaigns/{campaign_id}")):
+                await run(path, 200) # Warm up
+                rates = {True: [], False: []}
+                latencies = {True: [], False: []}
+                for _ in range(args.rounds):
+                    for enabled in (True, False):
+                        config.METRICS_ENABLED = enabled
+                        rate, observed = await run(path, args.requests // args.rounds)
+                        rates[enabled].append(rate)
+                        latencies[enabled].extend(observed)
+                config.METRICS_ENABLED = True
+                for enabled in (True, False):
+                    values = latencies[enabled]
+                    print(f"{label:<28} {'on' if enabled else 'off':>8} {statistics.median(rates[enabled]):>9,.0f} "
+                          f"{percentile(values, 50) * 1e6:>8.0f} {percentile(values, 99) * 1e6:>8.0f}")
+                on, off = statistics.median(rates[True]), statistics.median(rates[False])
+                print(f"{'':<28} throughput with metrics: {on / off - 1:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200_000, help="Calls per primitive measurement")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per endpoint and setting")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        storage.set_backend(None)
+        primitives(args.calls)
+        read_json_hits(Path(tmp), args.calls // 4)
+        asyncio.run(requests(args))
+
+
+if __name__ == "__main__":
+    main()
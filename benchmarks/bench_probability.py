@@ -0,0 +1,74 @@
+"""
+Success odds against the difficulty classes: exact distributions vs Monte Carlo.
+
+For each expression, the chance of meeting every DC in rules.DIFFICULTY_CLASSES:
+
+  exact (cold)    - probability.distribution with empty caches, then success_chances
+  exact (warm)    - the same once memoized
+  naive MC        - --samples totals rolled one die at a time with dice.roll
+  vectorized MC   - --samples totals from dice_notation.roll
+
+"max err" is the largest absolute error of a Monte Carlo estimate over the
+DCs, against the exact answer.
+
+    python -m benchmarks.bench_probability --samples 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from server.game_logic import dice, dice_notation, probability, rules
+
+# (expression, modifier, one total rolled with dice.roll)
+CASES = [
+    ("d20", 5, lambda: dice.roll(20)),
+    ("d20adv", 5, lambda: max(dice.roll(20), dice.roll(20))),
+    ("4d6kh3", 3, lambda: sum(sorted(dice.roll(6) for _ in range(4))[1:])),
+    ("8d6", 0, lambda: sum(dice.roll(6) for _ in range(8))),
+]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def mc_chances(totals, modifier):
+    totals = np.asarray(totals) + modifier
+    return {name: float((totals >= dc).mean()) for name, dc in rules.DIFFICULTY_CLASSES.items()}
+
+
+def max_error(estimate, exact):
+    return max(abs(estimate[name] - exact[name]["probability"]) for name in exact)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    print(f"Monte Carlo with {args.samples} samples; times in ms")
+    print(f"  {'expression':<10} {'exact cold':>10} {'warm':>8} {'naive MC':>10} {'max err':>8} "
+          f"{'vector MC':>10} {'max err':>8}")
+    for notation, modifier, by_hand in CASES:
+        expression = dice_notation.parse(notation)
+        probability._terms.clear()
+        probability._expressions.clear()
+        exact, cold = timed(lambda: probability.success_chances(probability.distribution(expression), modifier))
+        _, warm = timed(lambda: probability.success_chances(probability.distribution(expression), modifier))
+        naive, naive_ms = timed(lambda: mc_chances([by_hand() for _ in range(args.samples)], modifier))
+        vector, vector_ms = timed(lambda: mc_chances(dice_notation.roll(expression, args.samples, rng)["totals"],
+                                                     modifier))
+        print(f"  {notation:<10} {cold:>10.3f} {warm:>8.3f} {naive_ms:>10.1f} {max_error(naive, exact):>8.4f} "
+              f"{vector_ms:>10.1f} {max_error(vector, exact):>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Load test of a room's WebSocket events.
+
+Starts the API under uvicorn on a free local port, in a child process,
+against a temporary data directory. Registers a host and --clients
+players, creates a room playing the host's campaign and joins everyone to
+it; the host then appends journal entries over HTTP, which the room's
+members get over /api/rooms/{code}/ws. Reports:
+
+  - slow consumers: --slow members connect and never read while --flood
+    large entries are appended; how many of them the server disconnected
+    (each reads what reached it afterwards, then the close code) rather
+    than buffering for them. Besides the send queue, the socket buffers
+    hold several MB, so the flood has to be bigger than both.
+  - fan-out: the other members connect and --events entries are appended
+    at --rate per second; publish-to-receive latency (p50/p95/p99/max)
+    over every delivery to every client, and deliveries per second
+  - resume: --resumers clients disconnect, --missed more entries are
+    appended, and they reconnect with since_seq; the time until each has
+    caught up, and whether any event was lost or duplicated
+
+All clients run in this process, on one event loop; at high --rate times
+--clients they, not the server, become the bottleneck (reading clients
+then fall behind and get evicted too, which the report shows).
+
+    python -m benchmarks.bench_room_hub --clients 500 --slow 20 --rate 50
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+import uvicorn
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+from server.core import config, serialization, storage
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, data_dir: str, queue: int):
+    """The child process: the app on a fresh data directory."""
+    config.use_data_dir(Path(data_dir))
+    config.ROOM_HUB_SEND_QUEUE = queue
+    storage.set_backend(None)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from server.main import app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_until_up(base: str, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(base + "/api/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("The server didn't start")
+
+
+class Client:
+    """A reading room member: records the latency and seq of every journal event."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies = []
+        self.seqs = []
+        self.epoch = None
+        self.last_seq = 0
+        self.last_at = None
+        self.close_code = None
+        self.ready = asyncio.Event()
+
+    async def run(self, query: str = ""):
+        self.close_code = None
+        try:
+            async with connect(self.url + query, max_size=None) as ws:
+                self.ws = ws
+                hello = serialization.loads(await ws.recv())
+                self.epoch = hello["epoch"]
+                self.resumed = hello["resumed"]
+                self.ready.set()
+                async for raw in ws:
+                    message = serialization.loads(raw)
+                    self.last_seq = message["seq"]
+                    self.seqs.append(message["seq"])
+                    if message["type"] == "journal":
+                        self.last_at = time.time()
+                        sent = float(message["data"]["entry"]["content"].split(" ", 1)[0])
+                        self.latencies.append(self.last_at - sent)
+        except ConnectionClosed as e:
+            self.close_code = e.rcvd.code if e.rcvd else None
+
+
+class SlowClient:
+    """
+    Reads the hello, then nothing until `drain` is set. Its socket has a small
+    receive buffer (a client on a poor link), so the server's send backs up
+    after a few messages instead of after megabytes of kernel buffers.
+    """
+
+    def __init__(self, url: str, port: int):
+        self.url = url
+        self.port = port
+        self.ready = asyncio.Event()
+        self.drain = asyncio.Event()
+        self.close_code = None
+
+    async def run(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", self.port))
+        try:
+            async with connect(self.url, sock=sock, max_size=None, max_queue=1) as ws:
+                await ws.recv()
+                self.ready.set()
+                await self.drain.wait()
+                async for _ in ws:
+                    pass
+        except ConnectionClosed as e:
+            self.close_code = e.rcvd.code if e.rcvd else None
+        self.ready.set()
+
+
+async def wait_for(predicate, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not predicate() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+async def scenario(args, base: str, port: int):
+    ws_base = base.replace("http://", "ws://")
+    async with httpx.AsyncClient(base_url=base, timeout=60) as http:
+        async def register(i):
+            response = await http.post("/api/auth/register", json={
+                "email": f"p{i}@bench.local", "password": "pw", "username": f"p{i}"})
+            return {"X-User-Code": response.json()["user_code"]}
+
+        host = await register("host")
+        campaign_id = (await http.post("/api/campaigns", json={"name": "Load"}, headers=host)).json()["id"]
+        room_code = (await http.post("/api/rooms", json={"is_public": False, "campaign_id": campaign_id},
+                                     headers=host)).json()["room_code"]
+        players = []
+        for i in range(args.clients):
+            headers = await register(i)
+            await http.post("/api/rooms/join", json={"room_code": room_code}, headers=headers)
+            players.append(headers["X-User-Code"])
+
+        url = lambda user: f"{ws_base}/api/rooms/{room_code}/ws?user_code={user}"
+
+        async def append(count, chars, rate=None):
+            for _ in range(count):
+                # Random padding: permessage-deflate would shrink repeated characters to nothing.
+                content = f"{time.time()} {secrets.token_hex(chars // 2)}"
+                await http.post(f"/api/campaigns/{campaign_id}/journal", headers=host,
+                                json={"message": {"role": "user", "content": content}})
+                if rate:
+                    await asyncio.sleep(1 / rate)
+
+        # Slow consumers first (a client that stops reading is also dropped by
+        # uvicorn's keepalive within a minute, which would hide the hub's eviction).
+        slow = [SlowClient(url(user), port) for user in players[:args.slow]]
+        tasks = [asyncio.create_task(client.run()) for client in slow]
+        for client in slow:
+            await client.ready.wait()
+        start = time.perf_counter()
+        await append(args.flood, args.flood_chars)
+        flood_ms = (time.perf_counter() - start) * 1000
+        for client in slow:
+            client.drain.set()
+        await wait_for(lambda: all(c.close_code for c in slow), timeout=60)
+        print(f"send queue {args.queue}; flood of {args.flood} events of {args.flood_chars // 1024} KB "
+              f"({args.flood * args.flood_chars / 2 ** 20:.0f} MB per client) in {flood_ms:.0f} ms: "
+              f"{sum(c.close_code == 4000 for c in slow)} of {args.slow} non-reading clients evicted")
+
+        fast = [Client(url(user)) for user in players[args.slow:]]
+        tasks += [asyncio.create_task(client.run()) for client in fast]
+        start = time.perf_counter()
+        for client in fast:
+            await client.ready.wait()
+        print(f"\n{len(fast)} clients connected in {time.perf_counter() - start:.2f}s")
+        await asyncio.sleep(0.5) # Let the join events settle
+
+        start = time.time()
+        await append(args.events, args.entry_chars, args.rate)
+        done = await wait_for(lambda: all(len(c.latencies) >= args.events or c.close_code for c in fast),
+                              timeout=60)
+        elapsed = max(c.last_at or start for c in fast) - start
+        latencies = [l * 1000 for c in fast for l in c.latencies]
+        print(f"{args.events} journal events at {args.rate}/s{'' if done else ' (TIMED OUT)'}")
+        print(f"  deliveries: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f}/s)")
+        print(f"  latency ms: p50 {percentile(latencies, 50):.2f}  p95 {percentile(latencies, 95):.2f}  "
+              f"p99 {percentile(latencies, 99):.2f}  max {max(latencies):.2f}")
+        print(f"  clients evicted: {sum(c.close_code == 4000 for c in fast)}")
+
+        # Resume: some clients drop, miss events, and reconnect from their last seq.
+        resumers = [c for c in fast if c.close_code is None][:args.resumers]
+        for client in resumers:
+            await client.ws.close()
+        await asyncio.sleep(0.2)
+        await append(args.missed, args.entry_chars, args.rate)
+        for client in resumers:
+            client.ready = asyncio.Event()
+            tasks.append(asyncio.create_task(
+                client.run(f"&since_seq={client.last_seq}&epoch={client.epoch}")))
+        start = time.perf_counter()
+        caught_up = await wait_for(lambda: all(len(c.latencies) >= args.events + args.missed for c in resumers),
+                                   timeout=30)
+        elapsed = time.perf_counter() - start
+        intact = all(c.resumed and c.seqs == list(range(c.seqs[0], c.seqs[0] + len(c.seqs))) for c in resumers)
+        print(f"\nresume: {len(resumers)} clients missed {args.missed} events; caught up in {elapsed * 1000:.0f} ms"
+              f"{'' if caught_up else ' (TIMED OUT)'}; "
+              f"{'no gaps or duplicates' if intact else 'GAPS OR DUPLICATES'}")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--slow", type=int, default=10, help="Clients that never read")
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="Journal appends per second")
+    parser.add_argument("--entry-chars", type=int, default=500)
+    parser.add_argument("--resumers", type=int, default=100)
+    parser.add_argument("--missed", type=int, default=20)
+    parser.add_argument("--flood", type=int, help="Events sent to the slow clients alone (default: --queue + 1000)")
+    parser.add_argument("--flood-chars", type=int, default=8 * 1024)
+    parser.add_argument("--queue", type=int, default=config.ROOM_HUB_SEND_QUEUE, help="Per-connection send queue")
+    parser.add_argument("--serve", nargs=2, metavar=("PORT", "DATA_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(int(args.serve[0]), args.serve[1], args.queue)
+    if args.flood is None:
+        args.flood = args.queue + 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_room_hub", "--queue", str(args.queue),
+                                   "--serve", str(port), tmp], cwd=Path(__file__).parent.parent)
+        try:
+            base = f"http://127.0.0.1:{port}"
+            wait_until_up(base)
+            asyncio.run(scenario(args, base, port))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
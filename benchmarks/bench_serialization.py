@@ -0,0 +1,91 @@
+"""
+JSON serialization cost on a large campaign journal.
+
+Storage (one campaign meta + journal document):
+  write  - json.dump(indent=2, default=str) (old) vs serialization.dumps (compact)
+  read   - json.load vs serialization.loads
+
+API response for GET /campaigns/{id}/journal:
+  model+encoder+json  - validate into CampaignJournal, jsonable_encoder, json.dumps (the classic FastAPI path)
+  model+dump_json     - validate + pydantic-core dump_json (FastAPI's path with its default response class)
+  model+encoder+fast  - validate, jsonable_encoder, serialization.dumps (a custom default response class)
+  pre-serialized      - serialization.dumps on the stored dicts (what the journal routes return)
+
+    python -m benchmarks.bench_serialization --entries 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from server.core import serialization
+from server.core.models import CampaignJournal
+
+WORDS = ("the party presses on through dark forest goblin torch sword whisper ancient door "
+         "gold cursed river tavern dragon shadow spell rolls attack wounded laughs").split()
+
+
+def make_entries(n: int) -> list:
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1)
+    return [{"role": "assistant" if i % 2 else "user",
+             "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 120))),
+             "timestamp": start + timedelta(seconds=i), "seq": i}
+            for i in range(n)]
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries)
+    document = {"meta": {"id": uuid.uuid4(), "created_at": datetime.utcnow()}, "entries": entries}
+    backend = "orjson" if serialization.orjson is not None else "stdlib json"
+    print(f"{args.entries} entries, serializer: {backend}")
+
+    old_text = json.dumps(document, indent=2, default=str)
+    new_bytes = serialization.dumps(document)
+    print(f"  size    old {len(old_text.encode()) / 1e6:6.2f} MB   compact {len(new_bytes) / 1e6:6.2f} MB")
+    write_old = best_of(lambda: json.dumps(document, indent=2, default=str), args.repeat)
+    write_new = best_of(lambda: serialization.dumps(document), args.repeat)
+    read_old = best_of(lambda: json.loads(old_text), args.repeat)
+    read_new = best_of(lambda: serialization.loads(new_bytes), args.repeat)
+    print(f"  write   old {write_old:7.1f} ms   new {write_new:7.1f} ms")
+    print(f"  read    old {read_old:7.1f} ms   new {read_new:7.1f} ms")
+
+    stored = serialization.loads(new_bytes)["entries"] # As read back from storage
+    journal = {"entries": stored, "next_seq": len(stored)}
+    adapter = TypeAdapter(CampaignJournal)
+    paths = {
+        "model+encoder+json": lambda: json.dumps(jsonable_encoder(CampaignJournal(**journal))).encode(),
+        "model+dump_json": lambda: adapter.dump_json(adapter.validate_python(journal)),
+        "model+encoder+fast": lambda: serialization.dumps(jsonable_encoder(CampaignJournal(**journal))),
+        "pre-serialized": lambda: serialization.dumps(journal),
+    }
+    print("  response body for GET /campaigns/{id}/journal:")
+    for label, func in paths.items():
+        print(f"    {label:<20} {best_of(func, args.repeat):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
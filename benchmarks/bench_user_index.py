@@ -0,0 +1,118 @@
+"""
+Login/register throughput of the email index at a large user count.
+
+Seeds N users and then measures, for each index implementation:
+  register - claim a new email in the index and write the profile
+  login    - look up an email and read the profile
+
+Implementations:
+  legacy   - the old monolithic index.json (read whole file, rewrite whole file)
+  sharded  - JsonFileBackend's hash-sharded index
+  sqlite   - SqliteBackend's email_index table
+
+    python -m benchmarks.bench_user_index --users 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.core import config, storage
+from server.core.storage_sqlite import SqliteBackend
+
+
+def user_code_for(i: int) -> str:
+    return str(uuid.UUID(int=i + 1))
+
+
+def seed_legacy_index(n: int) -> list:
+    emails = [f"user{i}@example.com" for i in range(n)]
+    users = {email: {"user_code": user_code_for(i), "username": f"user{i}"} for i, email in enumerate(emails)}
+    storage.write_json(config.INDEX_FILE, {"users": users, "campaigns": {}})
+    return emails
+
+
+def seed_profiles(backend, indices):
+    for i in indices:
+        backend.save_user_profile({"user_code": user_code_for(i), "email": f"user{i}@example.com"})
+
+
+class LegacyIndex:
+    """The pre-sharding implementation, kept here for comparison."""
+
+    def find_user_code_by_email(self, email):
+        storage.clear_read_cache()  # the old code had no read cache
+        index = storage.read_json(config.INDEX_FILE)
+        entry = index["users"].get(email)
+        return entry.get("user_code") if entry else None
+
+    def add_user_to_index(self, email, user_code, username):
+        storage.clear_read_cache()
+        index = storage.read_json(config.INDEX_FILE)
+        index["users"][email] = {"user_code": user_code, "username": username}
+        storage.write_json(config.INDEX_FILE, index)
+        return True
+
+
+def measure(label, index, profiles, emails, ops):
+    rng = random.Random(2)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        user_code = str(uuid.uuid4())
+        index.add_user_to_index(f"new-{label}-{i}@example.com", user_code, "new")
+        profiles.save_user_profile({"user_code": user_code, "email": f"new-{label}-{i}@example.com"})
+    register = ops / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        user_code = index.find_user_code_by_email(rng.choice(emails))
+        assert profiles.get_user_profile(user_code)
+    login = ops / (time.perf_counter() - start)
+
+    print(f"  {label:<8} register {register:9.0f} ops/s   login {login:9.0f} ops/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--legacy-ops", type=int, default=20, help="The legacy index is slow; use fewer ops.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.use_data_dir(Path(tmp))
+        json_backend = storage.JsonFileBackend()
+
+        start = time.perf_counter()
+        emails = seed_legacy_index(args.users)
+        print(f"seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+        sample = random.Random(1).sample(range(args.users), 500)
+        login_sample = [emails[i] for i in sample]
+        seed_profiles(json_backend, sample)
+
+        measure("legacy", LegacyIndex(), json_backend, login_sample, args.legacy_ops)
+
+        start = time.perf_counter()
+        json_backend.find_user_code_by_email(emails[0])  # first touch imports index.json into shards
+        print(f"  (index.json -> shards import: {time.perf_counter() - start:.1f}s)")
+        measure("sharded", json_backend, json_backend, login_sample, args.ops)
+
+        sqlite_backend = SqliteBackend(Path(tmp) / "bench.sqlite3")
+        with sqlite_backend._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO email_index (email, user_code, username) VALUES (?, ?, ?)",
+                ((email, user_code_for(i), f"user{i}") for i, email in enumerate(emails)),
+            )
+        seed_profiles(sqlite_backend, sample)
+        measure("sqlite", sqlite_backend, sqlite_backend, login_sample, args.ops)
+
+
+if __name__ == "__main__":
+    main()
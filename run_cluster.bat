@@ -0,0 +1,4 @@
+@echo off
+call .venv\Scripts\activate
+echo Starting 4 workers on http://0.0.0.0:8000
+python -m server.core.cluster --host 0.0.0.0 --port 8000 --workers 4
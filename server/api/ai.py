@@ -1,10 +1,20 @@
+import hashlib
 import re
 import json
-import google.generativeai as genai
-from fastapi import APIRouter, Depends, HTTPException
+from contextlib import AsyncExitStack
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from server.core import config, storage
-from server.core.models import AICompleteRequest, AICompleteResponse, Message
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from server.core import config, serialization, storage, summaries
+from server.core.ai_client import client as ai_client
+from server.core.cache import LRUCache, SingleFlight
+from server.core import llm_dispatch
+from server.core.room_hub import hub
+from server.core.models import AICompleteRequest, AICompleteResponse, CampaignMeta, Message
+from server.game_logic import engine
 from server.api.auth import get_current_user_code, get_current_user
 
 router = APIRouter(prefix="/ai", tags=["AI"])
@@ -31,86 +41,356 @@ def parse_ai_response(response_text: str) -> AICompleteResponse:
     return AICompleteResponse(text=text_content, meta=meta_data)
 
 
-@router.post("/complete", response_model=AICompleteResponse)
-async def get_ai_completion(
-    request: AICompleteRequest,
-    user_code: str = Depends(get_current_user_code)
-):
+JSON_BLOCK_OPEN = "```json\n"
+JSON_BLOCK_CLOSE = "\n```"
+
+
+def _partial_suffix(text: str, token: str) -> int:
+    """Length of the longest suffix of `text` that is a proper prefix of `token`."""
+    for size in range(min(len(text), len(token) - 1), 0, -1):
+        if text.endswith(token[:size]):
+            return size
+    return 0
+
+
+class StreamingResponseParser:
     """
-    Generates a response from the AI Dungeon Master.
+    The incremental counterpart of parse_ai_response for streamed replies.
+
+    feed() takes raw chunks from the model and returns the narrative text
+    that is safe to show. Anything that might be the start of a fenced
+    ```json block is held back until it is certain, and the block itself is
+    parsed into `meta` instead of being shown. Leading and trailing
+    whitespace around the narrative is dropped, as parse_ai_response does.
+    Call close() once the stream ends to flush what is left.
+    """
+
+    def __init__(self):
+        self.meta: Optional[Dict[str, Any]] = None
+        self._parts: List[str] = []
+        self._buffer = ""
+        self._space = "" # Whitespace held until more narrative follows it
+        self._in_block = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        return self._drain(final=False)
+
+    def close(self) -> str:
+        return self._drain(final=True)
+
+    def _narrative(self, text: str) -> str:
+        if not self._parts:
+            text = text.lstrip()
+        body = text.rstrip()
+        if not body:
+            self._space += text
+            return ""
+        text, self._space = self._space + body, text[len(body):]
+        self._parts.append(text)
+        return text
+
+    def _drain(self, final: bool) -> str:
+        out = []
+        while True:
+            if self._in_block:
+                end = self._buffer.find(JSON_BLOCK_CLOSE)
+                if end != -1:
+                    block, self._buffer = self._buffer[:end], self._buffer[end + len(JSON_BLOCK_CLOSE):]
+                    self._in_block = False
+                    try:
+                        self.meta = serialization.loads(block)
+                    except ValueError:
+                        print(f"Warning: Failed to parse JSON metadata from AI response: {block}")
+                        self.meta = {"error": "failed_to_parse_json"}
+                    continue
+                if final: # Never closed: it was narrative after all
+                    out.append(self._narrative(JSON_BLOCK_OPEN + self._buffer))
+                    self._buffer, self._in_block = "", False
+                break
+
+            start = self._buffer.find(JSON_BLOCK_OPEN)
+            if start != -1:
+                out.append(self._narrative(self._buffer[:start]))
+                self._buffer = self._buffer[start + len(JSON_BLOCK_OPEN):]
+                self._in_block = True
+                continue
+            split = len(self._buffer) - (0 if final else _partial_suffix(self._buffer, JSON_BLOCK_OPEN))
+            out.append(self._narrative(self._buffer[:split]))
+            self._buffer = self._buffer[split:]
+            break
+        return "".join(out)
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + serialization.dumps(data) + b"\n\n"
+
+
+async def _prepare_prompt(request: AICompleteRequest, user_code: str) -> Tuple[str, Dict[str, Any], Message]:
     """
-    if not config.GEMINI_API_KEY or config.GEMINI_API_KEY == "__PUT_YOUR_KEY_HERE__":
+    Checks the request and builds its prompt from the stored journal.
+    Returns (prompt, cost of the prompt and its context, the player's action).
+    """
+    if not ai_client.configured:
         raise HTTPException(
             status_code=500,
             detail="Gemini API key is not configured on the server."
         )
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No player action to respond to.")
 
     # 1. Gather context
-    campaign_details = await get_campaign_details(request.campaign_id, user_code)
+    meta_data = None
+    if storage.is_valid_id(request.campaign_id):
+        meta_data = await storage.aget_campaign_meta(user_code, request.campaign_id)
+    if not meta_data:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+    campaign_meta = CampaignMeta(**meta_data)
     user_settings = await get_user_settings(user_code)
 
+    # The last message is the new action. Earlier ones are only used while the
+    # journal is still empty (clients that kept the history themselves).
+    action = request.messages[-1]
+    history, journal_summaries, summarized_chars = request.messages[:-1], [], 0
+    length = await storage.ajournal_length(user_code, request.campaign_id)
+    if length:
+        summary = await storage.aupdate_journal_summary(
+            user_code, request.campaign_id, summaries.summarizable_length(length))
+        entries = await storage.aread_journal(user_code, request.campaign_id, summaries.covered(summary), length)
+        history = [Message(**entry) for entry in entries or []]
+        journal_summaries = [segment["text"] for segment in summary["segments"]]
+        summarized_chars = sum(segment["chars"] for segment in summary["segments"])
+    context = engine.process_player_action(
+        action, campaign_meta, history, user_settings.dict(), journal_summaries, summarized_chars,
+    )
+
+    # 2. Construct the prompt
     try:
-        with open(config.SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
-            system_prompt = f.read()
+        prompt, cost = ai_client.build_prompt(
+            campaign_meta, user_settings.language, context["messages"], context["summary"])
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail="System prompt file not found.")
+    return prompt, {**cost, **context["stats"]}, action
 
-    # 2. Construct the prompt
-    # The user already sends the message history, we just prepend the system prompt
-    # and provide context variables.
-    full_prompt_context = f"""
-{system_prompt}
-
----
-## Game Context
-- Campaign Name: {campaign_details.meta.name}
-- Tone: {campaign_details.meta.tone}
-- Difficulty: {campaign_details.meta.difficulty}
-- Language: {user_settings.language}
----
-"""
-
-    # Combine system prompt with the message history
-    messages_for_ai = [{"role": "system", "content": full_prompt_context}]
-
-    # Convert our Pydantic Message models to dicts for the AI
-    for msg in request.messages:
-        # The Gemini API uses 'model' for the assistant's role
-        role = "model" if msg.role == "assistant" else msg.role
-        messages_for_ai.append({"role": role, "parts": [msg.content]})
-
-    # 3. Call Gemini API
+
+def _cost_headers(cost: Dict[str, Any]) -> Dict[str, str]:
+    reduction = 1 - cost["context_tokens"] / cost["full_tokens"] if cost["full_tokens"] else 0.0
+    return {
+        "X-Prompt-Build-Ms": f"{cost['build_ms']:.3f}",
+        "X-Prompt-Chars": str(cost["chars"]),
+        "X-Context-Tokens": str(cost["context_tokens"]),
+        "X-Context-Full-Tokens": str(cost["full_tokens"]),
+        "X-Context-Reduction": f"{max(0.0, reduction):.3f}",
+    }
+
+
+def _turn_lock(campaign_id: str):
+    """
+    Held from building a turn's prompt until the turn is recorded, so each
+    reply is generated from the journal as the previous turn left it.
+    """
+    return storage.key_lock(f"turn:{campaign_id}")
+
+
+async def _record_turn(user_code: str, campaign_id: str, action: Message, reply: AICompleteResponse) -> bool:
+    """
+    Appends the action and the DM's reply to the journal (together, in one
+    write), and applies the reply's metadata to the campaign state. Returns
+    whether the journal needs compaction.
+    """
+    reply_entry = {"role": "assistant", "content": reply.text, "timestamp": datetime.utcnow()}
+    if reply.meta is not None:
+        reply_entry["meta"] = reply.meta
+    entries = [action.dict(exclude={"seq"}), reply_entry]
+    appended = await storage.aappend_journal_entries(user_code, campaign_id, entries)
+    if appended is not None:
+        for seq, entry in enumerate(entries, appended["seq"]):
+            hub.publish_campaign(campaign_id, "journal", {"seq": seq, "entry": {**entry, "seq": seq}})
+    if reply.meta is not None:
+        await storage.aupdate_campaign_state(user_code, campaign_id)
+    return bool(appended and appended["needs_compaction"])
+
+
+def _shed(error: llm_dispatch.Overloaded) -> HTTPException:
+    status_code = 429 if isinstance(error, llm_dispatch.UserLimitReached) else 503
+    return HTTPException(status_code=status_code, detail=str(error),
+                         headers={"Retry-After": str(error.retry_after)})
+
+
+class _LeasedStreamingResponse(StreamingResponse):
+    """Holds an LLM dispatch slot and the campaign's turn lock until the stream is sent or abandoned."""
+
+    def __init__(self, *args, lease: llm_dispatch.Lease, turn: AsyncExitStack, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lease = lease
+        self.turn = turn
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.lease.release()
+            await self.turn.aclose()
+
+
+# Duplicate completions (double clicks, retries) share one model call; see SingleFlight.
+# Only an Idempotency-Key makes a finished call's result replayable: the same
+# action sent again later without one is a new turn.
+_completions = SingleFlight(LRUCache(config.AI_RESULT_CACHE_ENTRIES, config.AI_RESULT_CACHE_TTL_SECONDS))
+_duplicates = SingleFlight()
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def _request_fingerprint(request: AICompleteRequest) -> str:
+    """Identifies a completion request by its campaign and message contents (not timestamps)."""
+    payload = [request.campaign_id, [[msg.role, msg.content] for msg in request.messages]]
+    return hashlib.sha256(serialization.dumps(payload)).hexdigest()
+
+
+def get_completion_stats() -> Dict[str, int]:
+    """Counters for completions executed, coalesced onto an in-flight call, or replayed from the cache."""
+    keyed, unkeyed = _completions.stats(), _duplicates.stats()
+    return {name: keyed[name] + unkeyed[name] for name in keyed}
+
+
+@router.post("/complete", response_model=AICompleteResponse)
+async def get_ai_completion(
+    request: AICompleteRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    user_code: str = Depends(get_current_user_code),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Generates a response from the AI Dungeon Master.
+    Answers 429 (this user has too many calls in flight) or 503 (the service
+    is saturated) with a Retry-After header when the call is shed.
+
+    The context is built from the campaign journal; the action and the reply
+    are appended to it. The prompt's cost is reported in `X-Prompt-Build-Ms`
+    and `X-Prompt-Chars`, and its estimated size against sending the whole
+    history in `X-Context-Tokens`, `X-Context-Full-Tokens` and
+    `X-Context-Reduction`.
+
+    Turns for one campaign are taken one at a time: a request waits until the
+    turn before it is recorded, so its prompt includes that turn.
+
+    Requests without an `Idempotency-Key` header but with the same campaign
+    and messages that arrive while one of them runs get its reply from a
+    single model call (and a single journal turn). Requests with the same
+    `Idempotency-Key` do too, and also up to AI_RESULT_CACHE_TTL_SECONDS
+    after it finished. `X-AI-Call` says whether this response "executed" the
+    call, was "coalesced" onto it or "replayed" it. Reusing a key for a
+    different request is a 422.
+    """
+    fingerprint = _request_fingerprint(request)
+    if idempotency_key is not None:
+        if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key header.")
+        flights, key = _completions, (user_code, "key", idempotency_key)
+    else:
+        flights, key = _duplicates, (user_code, "request", fingerprint)
+
+    async def complete() -> Dict[str, Any]:
+        async with _turn_lock(request.campaign_id):
+            prompt, cost, action = await _prepare_prompt(request, user_code)
+
+            # 3. Call the model, off the event loop
+            try:
+                text = await llm_dispatch.dispatcher.run(user_code, ai_client.generate, prompt)
+            except llm_dispatch.Overloaded as e:
+                raise _shed(e)
+            except Exception as e:
+                print(f"Error calling Gemini API: {e}")
+                raise HTTPException(status_code=503, detail=f"An error occurred with the AI service: {str(e)}")
+
+            # 4. Parse and record the response
+            reply = parse_ai_response(text)
+            needs_compaction = await _record_turn(user_code, request.campaign_id, action, reply)
+        return {"reply": reply, "cost": cost, "fingerprint": fingerprint, "needs_compaction": needs_compaction}
+
+    outcome, how = await flights.do(key, complete)
+    if outcome["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+    if how == "executed" and outcome["needs_compaction"]:
+        background_tasks.add_task(storage.compact_journal, user_code, request.campaign_id)
+    response.headers.update(_cost_headers(outcome["cost"]))
+    response.headers["X-AI-Call"] = how
+    return outcome["reply"]
+
+
+@router.post("/stream")
+async def stream_ai_completion(
+    request: AICompleteRequest,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    Streams the AI Dungeon Master's response as Server-Sent Events:
+    `token` events ({"text"}) carry the narrative as it is generated, and a
+    final `done` event carries the whole response ({"text", "meta"}), with
+    the metadata block parsed. A failure mid-stream ends it with an `error`
+    event ({"detail"}). Like /complete, it answers 429 or 503 (with
+    Retry-After) instead of streaming when the model dispatcher is saturated.
+    The turn is recorded in the journal once the reply is complete; a turn
+    abandoned mid-stream (the client disconnected) is not recorded, and the
+    model call is stopped. Turns for one campaign are taken one at a time,
+    like on /complete.
+    """
+    turn = AsyncExitStack()
+    await turn.enter_async_context(_turn_lock(request.campaign_id))
     try:
-        genai.configure(api_key=config.GEMINI_API_KEY)
-        model = genai.GenerativeModel(config.GEMINI_MODEL)
+        prompt, cost, action = await _prepare_prompt(request, user_code)
+        lease = await llm_dispatch.dispatcher.acquire(user_code)
+    except llm_dispatch.Overloaded as e:
+        await turn.aclose()
+        raise _shed(e)
+    except BaseException:
+        await turn.aclose()
+        raise
 
-        # The API expects role/parts format. We need to adapt.
-        # Let's reformat the messages for the `generate_content` method
-        formatted_messages = []
-        for msg in request.messages:
-            role = "model" if msg.role == "assistant" else msg.role
-            formatted_messages.append({'role': role, 'parts': [msg.content]})
+    async def events() -> AsyncIterator[bytes]:
+        parser = StreamingResponseParser()
+        try:
+            async for chunk in llm_dispatch.dispatcher.iterate(ai_client.stream(prompt)):
+                text = parser.feed(chunk)
+                if text:
+                    hub.publish_campaign(request.campaign_id, "dm_token", {"text": text})
+                    yield _sse("token", {"text": text})
+            text = parser.close()
+            if text:
+                hub.publish_campaign(request.campaign_id, "dm_token", {"text": text})
+                yield _sse("token", {"text": text})
+        except Exception as e:
+            print(f"Error calling Gemini API: {e}")
+            yield _sse("error", {"detail": f"An error occurred with the AI service: {str(e)}"})
+            return
+        finally:
+            lease.release()
+        reply = AICompleteResponse(text=parser.text, meta=parser.meta)
+        needs_compaction = await _record_turn(user_code, request.campaign_id, action, reply)
+        yield _sse("done", reply.dict())
+        if needs_compaction:
+            await storage.run_blocking(storage.compact_journal, user_code, request.campaign_id)
 
-        # The last message is the user's prompt, the history is the preceding messages
-        # The library wants a history list and a final prompt.
-        history = formatted_messages[:-1]
-        prompt = formatted_messages[-1]['parts'][0]
+    headers = {**_cost_headers(cost), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return _LeasedStreamingResponse(events(), media_type="text/event-stream", headers=headers, lease=lease, turn=turn)
 
-        # Let's build a simpler message list, as the `chat` approach is tricky
-        # The `generate_content` method can take a simple list of strings/parts
-        final_prompt_list = [full_prompt_context]
-        for msg in request.messages:
-            final_prompt_list.append(f"**{msg.role.capitalize()}:** {msg.content}")
 
-        response = model.generate_content("\n".join(final_prompt_list))
+@router.get("/queue")
+async def get_ai_queue_stats(user_code: str = Depends(get_current_user_code)):
+    """Load on the model dispatcher: running calls, queue depth, shed counts and recent wait times."""
+    return llm_dispatch.dispatcher.stats()
 
-        # 4. Parse and return response
-        return parse_ai_response(response.text)
 
-    except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        raise HTTPException(status_code=503, detail=f"An error occurred with the AI service: {str(e)}")
+@router.get("/stats")
+async def get_ai_stats(user_code: str = Depends(get_current_user_code)):
+    """Model dispatch load plus how many model calls request coalescing saved."""
+    return {"dispatch": llm_dispatch.dispatcher.stats(), "completions": get_completion_stats()}
 
 # Need to import these from the other routers to avoid circular dependencies
-from server.api.campaigns import get_campaign_details
 from server.api.users import get_user_settings
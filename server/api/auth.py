@@ -2,34 +2,71 @@ from fastapi import APIRouter, Depends, HTTPException, Header
 from fastapi.responses import JSONResponse
 from typing import Optional
 
-from server.core import storage, security
+from server.core import cluster, config, storage, security
+from server.core.cache import LRUCache
 from server.core.models import (
     RegisterRequest, LoginRequest, AuthResponse, UserProfile, UserProfileResponse,
+    SessionResponse,
 )
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# --- Principal cache ---
+# Resolved profiles by user_code. Entries expire after PRINCIPAL_CACHE_TTL_SECONDS
+# and are dropped whenever the profile is updated through the API.
+_principal_cache = LRUCache(config.PRINCIPAL_CACHE_ENTRIES, ttl_seconds=config.PRINCIPAL_CACHE_TTL_SECONDS)
+
+async def resolve_principal(user_code: str) -> Optional[UserProfile]:
+    """Returns the user's profile, from the principal cache when possible."""
+    profile = _principal_cache.get(user_code)
+    if profile is None:
+        profile_data = await storage.aget_user_profile(user_code)
+        if not profile_data:
+            return None
+        profile = UserProfile(**profile_data)
+        _principal_cache.set(user_code, profile)
+    return profile
+
+@cluster.on("principal.invalidate") # Profile updates made on other workers
+def invalidate_principal(user_code: str):
+    _principal_cache.pop(user_code)
+
+def get_principal_cache_stats():
+    return _principal_cache.stats()
+
 # --- Dependency for protected routes ---
 
-async def get_current_user_code(x_user_code: Optional[str] = Header(None)) -> str:
-    """Dependency to get and validate the user_code from the header."""
+async def get_current_user_code(
+    x_user_code: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+) -> str:
+    """
+    Dependency to get and validate the user_code of the caller.
+    Prefers an `Authorization: Bearer <session token>` header, which is
+    verified without touching storage; falls back to `X-User-Code`.
+    """
+    if authorization and authorization.lower().startswith("bearer "):
+        user_code = security.verify_session_token(authorization[len("bearer "):].strip())
+        if user_code:
+            return user_code
+        if not x_user_code:
+            raise HTTPException(status_code=401, detail="Invalid or expired session token")
+
     if not x_user_code:
         raise HTTPException(status_code=401, detail="X-User-Code header missing")
 
-    profile_path = storage.get_user_profile_file(x_user_code)
-    if not profile_path or not profile_path.exists():
+    if not storage.is_valid_id(x_user_code) or await resolve_principal(x_user_code) is None:
         raise HTTPException(status_code=401, detail="Invalid user code")
 
     return x_user_code
 
 async def get_current_user(user_code: str = Depends(get_current_user_code)) -> UserProfile:
     """Dependency to get the full user profile from the validated user_code."""
-    profile_path = storage.get_user_profile_file(user_code)
-    profile_data = storage.read_json(profile_path)
-    if not profile_data:
+    profile = await resolve_principal(user_code)
+    if not profile:
         # This case should ideally not be hit if get_current_user_code passed
         raise HTTPException(status_code=404, detail="User profile not found")
-    return UserProfile(**profile_data)
+    return profile
 
 
 # --- Authentication Endpoints ---
@@ -40,9 +77,6 @@ async def register_user(request: RegisterRequest):
     Creates a new user account.
     Validates that the email is not already in use.
     """
-    if storage.find_user_by_email(request.email):
-        raise HTTPException(status_code=409, detail="Email already registered")
-
     hashed_password = security.hash_password(request.password)
 
     new_user = UserProfile(
@@ -51,15 +85,21 @@ async def register_user(request: RegisterRequest):
         hashed_password=hashed_password,
     )
 
-    # Create user files
-    profile_path = storage.get_user_profile_file(new_user.user_code)
-    storage.write_json(profile_path, new_user.dict())
-
-    # Add to global index
-    storage.add_user_to_index(new_user)
+    # Write the profile before claiming the email: a profile nothing points
+    # to is harmless, but a claimed email without a profile could never log
+    # in or register again. The index update is atomic per email, so of two
+    # concurrent registrations with the same address only one gets through.
+    await storage.asave_user_profile(new_user.dict())
+    if not await storage.aadd_user_to_index(new_user):
+        await storage.adelete_user_profile(new_user.user_code)
+        raise HTTPException(status_code=409, detail="Email already registered")
 
     # Pass a dict to AuthResponse, Pydantic will validate it against UserProfileResponse
-    return AuthResponse(user_code=new_user.user_code, profile=new_user.dict())
+    return AuthResponse(
+        user_code=new_user.user_code,
+        profile=new_user.dict(),
+        session_token=security.create_session_token(new_user.user_code),
+    )
 
 
 @router.post("/login", response_model=AuthResponse)
@@ -67,12 +107,27 @@ async def login_user(request: LoginRequest):
     """
     Logs a user in by verifying their credentials.
     """
-    user_profile = storage.find_user_by_email(request.email)
+    user_profile = await storage.afind_user_by_email(request.email)
     if not user_profile or not security.verify_password(request.password, user_profile.hashed_password):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
 
     # Pass a dict to AuthResponse, Pydantic will validate it against UserProfileResponse
-    return AuthResponse(user_code=user_profile.user_code, profile=user_profile.dict())
+    return AuthResponse(
+        user_code=user_profile.user_code,
+        profile=user_profile.dict(),
+        session_token=security.create_session_token(user_profile.user_code),
+    )
+
+
+@router.post("/session", response_model=SessionResponse)
+async def renew_session(user_code: str = Depends(get_current_user_code)):
+    """
+    Issues a fresh session token for the current user.
+    """
+    return SessionResponse(
+        session_token=security.create_session_token(user_code),
+        expires_in=config.SESSION_TTL_SECONDS,
+    )
 
 
 @router.get("/me", response_model=UserProfileResponse)
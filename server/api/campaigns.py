@@ -1,14 +1,17 @@
-import uuid
-import shutil
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Body
+from typing import Dict, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Body, BackgroundTasks, Query
 from starlette.responses import Response
 from starlette import status
 
-from server.core import storage
+from server.api.responses import RawJSONResponse
+from server.core import config, serialization, storage
+from server.core.room_hub import hub
 from server.core.models import (
     CreateCampaignRequest, CampaignMeta, CampaignJournal, Message,
-    CampaignDetailsResponse, AddJournalEntryRequest
+    CampaignDetailsResponse, AddJournalEntryRequest, AddJournalEntryResponse, UpdateCampaignRequest,
+    CampaignStateResponse,
+    CAMPAIGN_STATUSES,
 )
 from server.api.auth import get_current_user_code
 
@@ -21,12 +24,6 @@ async def create_campaign(
     user_code: str = Depends(get_current_user_code)
 ):
     """Creates a new campaign for the logged-in user."""
-    campaigns_dir = storage.get_campaigns_dir(user_code)
-    if not campaigns_dir:
-        raise HTTPException(status_code=400, detail="Invalid user code.")
-
-    campaigns_dir.mkdir(exist_ok=True)
-
     new_campaign_meta = CampaignMeta(
         name=request.name,
         tone=request.tone,
@@ -34,99 +31,258 @@ async def create_campaign(
         host_user_code=user_code,
     )
 
-    # Save meta file
-    meta_path = storage.get_campaign_meta_file(user_code, str(new_campaign_meta.id))
-    storage.write_json(meta_path, new_campaign_meta.dict())
+    # Save meta
+    await storage.asave_campaign_meta(user_code, new_campaign_meta.dict())
 
-    # Save initial empty journal
-    journal_path = storage.get_campaign_journal_file(user_code, str(new_campaign_meta.id))
-    initial_journal = CampaignJournal()
-    storage.write_json(journal_path, initial_journal.dict())
+    # Create initial empty journal
+    await storage.acreate_journal(user_code, str(new_campaign_meta.id))
 
     return new_campaign_meta
 
 
 @router.get("", response_model=list[CampaignMeta])
-async def list_user_campaigns(user_code: str = Depends(get_current_user_code)):
-    """Lists all campaigns belonging to the current user."""
-    campaigns_dir = storage.get_campaigns_dir(user_code)
-    if not campaigns_dir or not campaigns_dir.exists():
-        return []
+async def list_user_campaigns(
+    response: Response,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    tone: Optional[str] = None,
+    sort: Literal["created_at", "status", "tone"] = "created_at",
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(config.CAMPAIGN_PAGE_SIZE, ge=1, le=config.CAMPAIGN_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    Lists the current user's campaigns, one page at a time (newest first by default).
+    If there are more, the `X-Next-Cursor` response header holds the `cursor` for the next page.
+    """
+    try:
+        meta_list, next_cursor = await storage.aquery_campaign_metas(
+            user_code, status=status_filter, tone=tone, sort=sort,
+            descending=order == "desc", cursor=cursor, limit=limit,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
-    campaign_metas = []
-    for camp_dir in campaigns_dir.iterdir():
-        if camp_dir.is_dir() and (camp_dir / "meta.json").exists():
-            meta_data = storage.read_json(camp_dir / "meta.json")
-            if meta_data:
-                campaign_metas.append(CampaignMeta(**meta_data))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [CampaignMeta(**meta_data) for meta_data in meta_list]
 
-    return campaign_metas
+
+async def _read_journal_window(
+    user_code: str,
+    campaign_id: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    tail: Optional[int] = None,
+    since_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+) -> Optional[Dict]:
+    """
+    Reads part of a campaign journal, as a CampaignJournal-shaped dict. Pick one of:
+      tail=N       - the last N entries
+      since_seq=N  - entries after sequence number N
+      since=T      - entries stamped after time T
+      offset=N     - entries from sequence number N on
+    `limit` caps the number of entries returned by the last three.
+    With no arguments, the whole journal is returned.
+    """
+    for name, value in (("offset", offset), ("limit", limit), ("tail", tail), ("since_seq", since_seq)):
+        if value is not None and value < (-1 if name == "since_seq" else 0):
+            raise HTTPException(status_code=400, detail=f"Invalid {name}.")
+
+    if tail is not None:
+        window = await storage.aread_journal_tail(user_code, campaign_id, tail)
+    elif since is not None:
+        window = await storage.aread_journal_since(user_code, campaign_id, since)
+    else:
+        start = since_seq + 1 if since_seq is not None else (offset or 0)
+        stop = start + limit if limit is not None else None
+        entries = await storage.aread_journal(user_code, campaign_id, start, stop)
+        window = (start, entries) if entries is not None else None
+    if window is None:
+        return None
+
+    start, entries = window
+    if limit is None or tail is not None or since is not None:
+        if since is not None and limit is not None:
+            entries = entries[:limit]
+        next_seq = start + len(entries) # The read ran to the end of the journal, or to `limit`
+    else:
+        next_seq = await storage.ajournal_length(user_code, campaign_id)
+    return {"entries": [{**entry, "seq": start + i} for i, entry in enumerate(entries)], "next_seq": next_seq}
 
 
 @router.get("/{campaign_id}", response_model=CampaignDetailsResponse)
 async def get_campaign_details(
     campaign_id: str,
+    user_code: str = Depends(get_current_user_code),
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    tail: Optional[int] = None,
+    since_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+):
+    """
+    Retrieves the metadata and journal for a specific campaign.
+    The journal can be narrowed with the same parameters as GET /{campaign_id}/journal.
+    """
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+
+    meta_data = await storage.aget_campaign_meta(user_code, campaign_id)
+    journal = await _read_journal_window(user_code, campaign_id, offset, limit, tail, since_seq, since)
+
+    if not meta_data or journal is None:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+
+    # Records straight from storage need no validation; skipping the model
+    # round trip matters on long journals.
+    return RawJSONResponse(serialization.dumps({"meta": meta_data, "journal": journal}))
+
+@router.get("/{campaign_id}/journal", response_model=CampaignJournal)
+async def get_campaign_journal(
+    campaign_id: str,
+    offset: Optional[int] = None,
+    limit: Optional[int] = None,
+    tail: Optional[int] = None,
+    since_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
     user_code: str = Depends(get_current_user_code)
 ):
-    """Retrieves the metadata and journal for a specific campaign."""
-    meta_path = storage.get_campaign_meta_file(user_code, campaign_id)
-    journal_path = storage.get_campaign_journal_file(user_code, campaign_id)
+    """
+    Reads a range of the campaign's journal: the last `tail` entries, the
+    entries after `since_seq` or `since` (a timestamp), or `limit` entries
+    from `offset`. Clients that poll for new entries should pass the last
+    seq they have as `since_seq`.
+    """
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+
+    journal = await _read_journal_window(user_code, campaign_id, offset, limit, tail, since_seq, since)
+    if journal is None:
+        raise HTTPException(status_code=404, detail="Campaign journal not found.")
+    return RawJSONResponse(serialization.dumps(journal))
 
-    if not meta_path or not journal_path:
+@router.get("/{campaign_id}/state", response_model=CampaignStateResponse)
+async def get_campaign_state(
+    campaign_id: str,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    The campaign's current game state (HP, inventory, NPCs, location...), as
+    applied from the DM's metadata. `version` is the journal length it covers.
+    """
+    if not storage.is_valid_id(campaign_id):
         raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
 
-    meta_data = storage.read_json(meta_path)
-    journal_data = storage.read_json(journal_path)
+    snapshot = await storage.aupdate_campaign_state(user_code, campaign_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Campaign journal not found.")
+    return RawJSONResponse(serialization.dumps(
+        {"version": snapshot["version"], "events": snapshot["events"], "state": snapshot["state"]}
+    ))
 
-    if not meta_data or not journal_data:
-        raise HTTPException(status_code=404, detail="Campaign not found.")
+@router.patch("/{campaign_id}", response_model=CampaignMeta)
+async def update_campaign(
+    campaign_id: str,
+    request: UpdateCampaignRequest,
+    user_code: str = Depends(get_current_user_code)
+):
+    """Renames a campaign or changes its status."""
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
 
-    return CampaignDetailsResponse(
-        meta=CampaignMeta(**meta_data),
-        journal=CampaignJournal(**journal_data)
-    )
+    changes = request.dict(exclude_unset=True, exclude_none=True)
+    if "status" in changes and changes["status"] not in CAMPAIGN_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(CAMPAIGN_STATUSES)}.")
 
-@router.post("/{campaign_id}/journal", response_model=CampaignJournal)
+    meta_data = await storage.aupdate_campaign_meta(user_code, campaign_id, changes)
+    if meta_data is None:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+    return CampaignMeta(**meta_data)
+
+@router.post("/{campaign_id}/journal", response_model=AddJournalEntryResponse)
 async def add_journal_entry(
     campaign_id: str,
     request: AddJournalEntryRequest,
+    background_tasks: BackgroundTasks,
     user_code: str = Depends(get_current_user_code)
 ):
-    """Adds a new entry to the campaign's journal."""
-    journal_path = storage.get_campaign_journal_file(user_code, campaign_id)
-    if not journal_path:
+    """Adds a new entry to the campaign's journal. Returns just that entry and its sequence number."""
+    if not storage.is_valid_id(campaign_id):
         raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
 
-    journal_data = storage.read_json(journal_path)
-    if journal_data is None:
+    entry = request.message.dict(exclude={"seq"})
+    appended = await storage.aappend_journal_entry(user_code, campaign_id, entry)
+    if appended is None:
         raise HTTPException(status_code=404, detail="Campaign journal not found.")
 
-    journal = CampaignJournal(**journal_data)
-    journal.entries.append(request.message)
-
-    storage.write_json(journal_path, journal.dict())
+    if appended["needs_compaction"]:
+        background_tasks.add_task(storage.compact_journal, user_code, campaign_id)
 
-    return journal
+    entry = {**entry, "seq": appended["seq"]}
+    hub.publish_campaign(campaign_id, "journal", {"seq": appended["seq"], "entry": entry})
+    return AddJournalEntryResponse(seq=appended["seq"], entry=entry)
 
-@router.post("/{campaign_id}/checkpoint")
+@router.post("/{campaign_id}/checkpoint", response_class=RawJSONResponse)
 async def save_campaign_checkpoint(
     campaign_id: str,
     user_code: str = Depends(get_current_user_code)
 ):
-    """Saves a snapshot of the current campaign state."""
-    # For this project, the journal is saved on every update, so this is more of a placeholder.
-    # A full implementation would save the journal and meta to a timestamped file.
-    campaign_details = await get_campaign_details(campaign_id, user_code)
+    """
+    Saves a checkpoint of the campaign: its meta plus the journal entries
+    added since the previous checkpoint. Old checkpoints are thinned out
+    according to the retention policy.
+    """
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
 
-    checkpoints_dir = journal_path = storage.get_campaign_journal_file(user_code, campaign_id).parent / "checkpoints"
-    checkpoints_dir.mkdir(exist_ok=True)
+    try:
+        created = await storage.acreate_checkpoint(user_code, campaign_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=409,
+            detail="The journal is shorter than the latest checkpoint; restore a checkpoint first.",
+        )
+    if created is None:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
 
-    timestamp = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%SZ")
-    checkpoint_file = checkpoints_dir / f"{timestamp}.json"
+    info, location = created
+    return {"message": "Checkpoint saved successfully", "file": location, "checkpoint": info}
 
-    storage.write_json(checkpoint_file, campaign_details.dict())
 
-    return {"message": "Checkpoint saved successfully", "file": str(checkpoint_file)}
+@router.get("/{campaign_id}/checkpoints", response_class=RawJSONResponse)
+async def list_campaign_checkpoints(
+    campaign_id: str,
+    user_code: str = Depends(get_current_user_code)
+):
+    """Lists the campaign's checkpoints, oldest first."""
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+    if not await storage.aget_campaign_meta(user_code, campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+    return await storage.alist_checkpoints(user_code, campaign_id)
+
+
+@router.post("/{campaign_id}/checkpoints/{name}/restore", response_class=RawJSONResponse)
+async def restore_campaign_checkpoint(
+    campaign_id: str,
+    name: str,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    Rolls the campaign back to a checkpoint. The journal is cut back to the
+    checkpoint and any later checkpoints are discarded.
+    """
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+    if await storage.aget_campaign_meta(user_code, campaign_id) is None:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+
+    info = await storage.arestore_checkpoint(user_code, campaign_id, name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Checkpoint not found.")
+    return {"message": "Campaign restored", "checkpoint": info, "next_seq": info["seq"]}
 
 
 @router.delete("/{campaign_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -135,23 +291,15 @@ async def delete_campaign(
     user_code: str = Depends(get_current_user_code)
 ):
     """Deletes a user's campaign, including all its data."""
-    campaigns_dir = storage.get_campaigns_dir(user_code)
-    if not campaigns_dir:
-        raise HTTPException(status_code=400, detail="Invalid user code.")
+    if not storage.is_valid_id(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
 
     try:
-        # Validate campaign_id format
-        uuid.UUID(campaign_id)
-        campaign_path = campaigns_dir / f"camp_{campaign_id}"
-
-        if not campaign_path.exists() or not campaign_path.is_dir():
-            raise HTTPException(status_code=404, detail="Campaign not found.")
-
-        shutil.rmtree(campaign_path)
-
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+        deleted = await storage.adelete_campaign(user_code, campaign_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete campaign: {e}")
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,214 @@
+import asyncio
+import re
+from typing import Optional
+
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Request
+from websockets.asyncio.client import connect, unix_connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+from server.api.responses import RawJSONResponse
+from server.core import cluster, config, metrics, serialization
+from server.core.room_registry import registry
+
+# --- Internal endpoints (only reachable by other workers) ---
+
+def _require_peer(request: Request):
+    if not cluster.enabled() or not cluster.is_forwarded(request.scope["headers"]):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+router = APIRouter(prefix="/internal", include_in_schema=False, dependencies=[Depends(_require_peer)])
+
+@router.post("/bus/{topic}")
+async def deliver_broadcast(topic: str, request: Request):
+    try:
+        await cluster.deliver(topic, serialization.loads(await request.body()))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No handler for {topic}")
+    return {"ok": True}
+
+@router.get("/rooms/public")
+async def local_public_rooms():
+    """This worker's public rooms, for GET /api/rooms/public on another worker."""
+    return RawJSONResponse(serialization.dumps(await registry.list_public()))
+
+
+@router.get("/metrics")
+async def local_metrics():
+    """This worker's metrics, for GET /api/metrics on another worker."""
+    return RawJSONResponse(serialization.dumps(metrics.snapshot()))
+
+
+# --- Routing ---
+# Routes that act on one room or campaign, and where the key is: in the path,
+# or (for these POSTs) a field of the JSON body.
+_ROOM_PATH = re.compile(r"^/api/rooms/(?!public$|join$)([^/]+)")
+_CAMPAIGN_PATH = re.compile(r"^/api/campaigns/([^/]+)")
+_BODY_KEYS = {
+    "/api/rooms": "campaign_id",
+    "/api/rooms/join": "room_code",
+    "/api/dice/bulk": "campaign_id",
+    "/api/ai/complete": "campaign_id",
+    "/api/ai/stream": "campaign_id",
+}
+_HOP_BY_HOP = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade"}
+
+
+def route_key(path: str, body: Optional[bytes] = None) -> Optional[str]:
+    """The room code or campaign id a request belongs to, or None if any worker can serve it."""
+    match = _ROOM_PATH.match(path)
+    if match:
+        return match.group(1).upper()
+    match = _CAMPAIGN_PATH.match(path)
+    if match:
+        return match.group(1).lower()
+    if body is not None and path in _BODY_KEYS:
+        try:
+            value = serialization.loads(body).get(_BODY_KEYS[path])
+        except (ValueError, AttributeError):
+            return None # Let the route report the bad request
+        if isinstance(value, str):
+            return value.upper() if path == "/api/rooms/join" else value.lower()
+    return None
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+class ClusterRouter:
+    """
+    ASGI middleware sending requests for rooms and campaigns owned by another
+    worker to that worker (and WebSockets through it), so their in-memory
+    state lives in exactly one process. Does nothing with a single worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not cluster.enabled() or scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        if cluster.is_forwarded(scope["headers"]):
+            return await self.app(scope, receive, self._tagged(send))
+
+        key = route_key(scope["path"])
+        body = None
+        if key is None and scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in _BODY_KEYS:
+            body = await _read_body(receive)
+            key = route_key(scope["path"], body)
+            receive = _replay(body, receive)
+        if key is None or cluster.is_local(key):
+            return await self.app(scope, receive, self._tagged(send))
+
+        worker = cluster.owner(key)
+        if scope["type"] == "websocket":
+            return await _pipe_websocket(worker, scope, receive, send)
+        if body is None:
+            body = await _read_body(receive)
+        await _forward(worker, scope, body, send)
+
+    @staticmethod
+    def _tagged(send):
+        """Adds X-Worker (the worker that served the request) to HTTP responses."""
+        header = (b"x-worker", str(config.WORKER_ID).encode())
+
+        async def tagged(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+        return tagged
+
+
+def _replay(body: bytes, receive):
+    """A receive() that hands the app the already-read body, then defers to the client."""
+    pending = True
+
+    async def replay():
+        nonlocal pending
+        if pending:
+            pending = False
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return replay
+
+
+def _target(scope) -> str:
+    path = scope.get("raw_path") or scope["path"].encode()
+    if scope.get("query_string"):
+        path += b"?" + scope["query_string"]
+    return path.decode("latin-1")
+
+
+async def _forward(worker: int, scope, body: bytes, send):
+    client = cluster.peer(worker)
+    headers = [(name, value) for name, value in scope["headers"]
+               if name not in _HOP_BY_HOP and name != b"content-length"]
+    headers.append((cluster.SECRET_HEADER.encode(), config.CLUSTER_SECRET.encode("latin-1")))
+    # A bare Request, so the client's default headers (Accept-Encoding, ...) aren't added.
+    request = httpx.Request(scope["method"], cluster.base_url(worker) + _target(scope), headers=headers, content=body)
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.TransportError as e:
+        print(f"Forwarding to worker {worker} failed: {e}")
+        await send({"type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")]})
+        await send({"type": "http.response.body", "body": b'{"detail":"Worker unavailable"}'})
+        return
+    try:
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": [(name, value) for name, value in response.headers.raw
+                                if name.lower() not in _HOP_BY_HOP]})
+        async for chunk in response.aiter_raw():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        await response.aclose()
+
+
+async def _pipe_websocket(worker: int, scope, receive, send):
+    await receive() # websocket.connect
+    uri = cluster.base_url(worker, "ws") + _target(scope)
+    options = {"additional_headers": {cluster.SECRET_HEADER: config.CLUSTER_SECRET}, "compression": None}
+    try:
+        if cluster.uses_unix_sockets():
+            upstream = await unix_connect(str(cluster.socket_path(worker)), uri, **options)
+        else:
+            upstream = await connect(uri, **options)
+    except (OSError, WebSocketException) as e:
+        print(f"Forwarding a WebSocket to worker {worker} failed: {e}")
+        await send({"type": "websocket.close", "code": 1011})
+        return
+    await send({"type": "websocket.accept"})
+
+    async def downstream():
+        try:
+            async for message in upstream:
+                key = "text" if isinstance(message, str) else "bytes"
+                await send({"type": "websocket.send", key: message})
+        except ConnectionClosed:
+            pass
+        close = upstream.close_rcvd
+        await send({"type": "websocket.close", "code": close.code if close else 1011,
+                    "reason": close.reason if close else ""})
+
+    async def upstream_pump():
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+    tasks = [asyncio.create_task(downstream()), asyncio.create_task(upstream_pump())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED) # Either side went away
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await upstream.close()
@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+from server.core import config
+
+try:
+    import brotli
+except ImportError: # Optional: assets are then served gzip-compressed only
+    brotli = None
+
+# Media types worth compressing; everything else (images, fonts, archives) is served as is.
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml",
+                 "application/manifest+json", "application/wasm")
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Parses an Accept-Encoding header into {coding: q}, lower-cased."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def _acceptable(accepted: Dict[str, float], coding: str) -> bool:
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+# --- Frontend assets ---
+
+@dataclass
+class _Asset:
+    """A file's content, its precompressed variants (smallest first) and validators."""
+    mtime_ns: int
+    size: int
+    body: bytes
+    digest: str
+    last_modified: str
+    compressible: bool
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles serving each file from memory in the best encoding the client
+    accepts (br, then gzip, then none), compressed once rather than per
+    request, with a strong ETag per encoding and Cache-Control. Conditional
+    requests (If-None-Match, or If-Modified-Since without it) get a 304.
+
+    precompress() loads the whole directory at startup. A file that is added
+    or changed afterwards (checked against the stat StaticFiles already
+    does) is compressed when it is first requested. Files over
+    STATIC_PRECOMPRESS_MAX_BYTES are left to StaticFiles.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._assets: Dict[str, _Asset] = {}
+
+    def precompress(self) -> int:
+        """Loads and compresses every file under the directory. Returns the number of files."""
+        count = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if self._load(path, os.stat(path)) is not None:
+                    count += 1
+        return count
+
+    def _load(self, path: str, stat_result: os.stat_result) -> Optional[_Asset]:
+        asset = self._assets.get(path)
+        if asset is not None and (asset.mtime_ns, asset.size) == (stat_result.st_mtime_ns, stat_result.st_size):
+            return asset
+        if stat_result.st_size > config.STATIC_PRECOMPRESS_MAX_BYTES:
+            return None
+
+        body = Path(path).read_bytes()
+        media_type = self._media_type(path)
+        asset = _Asset(
+            mtime_ns=stat_result.st_mtime_ns,
+            size=stat_result.st_size,
+            body=body,
+            digest=hashlib.sha256(body).hexdigest()[:32],
+            last_modified=formatdate(stat_result.st_mtime, usegmt=True),
+            compressible=media_type.startswith(_COMPRESSIBLE),
+        )
+        if asset.compressible:
+            variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(body, quality=11)
+            # Only keep encodings that actually save something.
+            for coding, data in sorted(variants.items(), key=lambda item: len(item[1])):
+                if len(data) < len(body) * 0.95:
+                    asset.variants[coding] = data
+        self._assets[path] = asset
+        return asset
+
+    @staticmethod
+    def _media_type(path: str) -> str:
+        return mimetypes.guess_type(path)[0] or "text/plain"
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        asset = self._load(str(full_path), stat_result)
+        if asset is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        request_headers = Headers(scope=scope)
+
+        coding, body = None, asset.body
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for candidate, data in asset.variants.items():
+            if _acceptable(accepted, candidate):
+                coding, body = candidate, data
+                break
+
+        media_type = self._media_type(str(full_path))
+        etag = f'"{asset.digest}-{coding}"' if coding else f'"{asset.digest}"'
+        headers = {
+            "etag": etag,
+            "last-modified": asset.last_modified,
+            "cache-control": "no-cache" if media_type == "text/html"
+                             else f"public, max-age={config.STATIC_MAX_AGE_SECONDS}",
+        }
+        if asset.compressible:
+            headers["vary"] = "Accept-Encoding"
+        if status_code == 200 and self._not_modified(request_headers, etag, asset):
+            return Response(status_code=304, headers=headers)
+
+        if coding:
+            headers["content-encoding"] = coding
+        headers["content-length"] = str(len(body))
+        if scope["method"] == "HEAD":
+            body = b""
+        return Response(body, status_code=status_code, headers=headers, media_type=media_type)
+
+    @staticmethod
+    def _not_modified(request_headers: Headers, etag: str, asset: _Asset) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return asset.mtime_ns // 10 ** 9 <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+# --- API responses ---
+
+class APICompressionMiddleware(GZipMiddleware):
+    """
+    Streaming gzip for /api responses of at least API_COMPRESSION_MIN_BYTES,
+    for clients that accept it (streamed responses are compressed chunk by
+    chunk, flushed after each). Server-sent events are left alone, and so is
+    everything outside /api: the frontend is precompressed.
+    """
+
+    def __init__(self, app):
+        super().__init__(app, minimum_size=config.API_COMPRESSION_MIN_BYTES,
+                         compresslevel=config.API_COMPRESSION_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        if not _acceptable(accepted_encodings(Headers(scope=scope).get("accept-encoding", "")), "gzip"):
+            return await self.app(scope, receive, send)
+        await super().__call__(scope, receive, send)
@@ -1,11 +1,22 @@
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 
-from server.game_logic import dice as dice_logic
-from server.core.models import RollRequest, DiceRoll
+from server.api.responses import RawJSONResponse
+from server.core import config, serialization, storage
+from server.core.room_hub import hub
+from server.game_logic import dice as dice_logic, dice_notation, probability, rng
+from server.core.models import (
+    RollRequest, DiceRoll, BulkRollRequest, BulkRollResponse, ReplayRequest, ReplayResponse,
+    ProbabilityRequest, ProbabilityResponse,
+)
 from server.api.auth import get_current_user_code
 
 router = APIRouter(prefix="/dice", tags=["Dice"])
 
+# Requests rolling more dice than this are rolled off the event loop.
+INLINE_ROLL_DICE = 10000
+
 
 @router.post("/roll", response_model=DiceRoll)
 async def roll_dice(
@@ -32,3 +43,149 @@ async def roll_dice(
     else:
         result = dice_logic.roll(sides=request.sides, seed=request.seed)
         return DiceRoll(sides=request.sides, result=result)
+
+
+def _check_rolls(items, breakdown: bool) -> list:
+    """Parses and bounds a batch of {expression, times} items. Returns the parsed expressions."""
+    if not items:
+        raise HTTPException(status_code=400, detail="No rolls requested.")
+    try:
+        expressions = [dice_notation.parse(item.expression) for item in items]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if any(item.times < 1 for item in items):
+        raise HTTPException(status_code=400, detail="`times` must be at least 1.")
+
+    dice = sum(e.dice_count * item.times for e, item in zip(expressions, items))
+    limit = config.DICE_MAX_BREAKDOWN_DICE if breakdown else config.DICE_MAX_DICE_PER_REQUEST
+    if dice > limit:
+        raise HTTPException(status_code=400, detail=f"Too many dice in one request (at most {limit}).")
+    return expressions
+
+
+def _roll_all(expressions, items, generators, breakdown: bool) -> list:
+    """Rolls each expression with its generator. `generators` yields (roll number or None, generator)."""
+    results = []
+    for expression, item, (number, rng) in zip(expressions, items, generators):
+        result = {"expression": expression.notation, "times": item.times,
+                  **dice_notation.roll(expression, item.times, rng, breakdown)}
+        if number is not None:
+            result["roll"] = number
+        results.append(result)
+    return results
+
+
+async def _run(func, expressions, items, *args):
+    """Small batches are rolled inline; big ones off the event loop."""
+    if sum(e.dice_count * item.times for e, item in zip(expressions, items)) > INLINE_ROLL_DICE:
+        return await run_in_threadpool(func, expressions, items, *args)
+    return func(expressions, items, *args)
+
+
+@router.post("/bulk", response_model=BulkRollResponse)
+async def roll_bulk(
+    request: BulkRollRequest,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    Rolls dice expressions in notation ("8d6", "4d6kh3", "d20adv+5", "2d10!")
+    in one call, each `times` times. Totals are always returned; `breakdown`
+    adds every die of every roll.
+
+    With `campaign_id`, each expression is one roll from the campaign's RNG
+    stream, and its result carries the `roll` number that POST /dice/replay
+    can regenerate it from. With `seed` instead, the whole batch is
+    reproducible.
+    """
+    if request.campaign_id is not None and request.seed is not None:
+        raise HTTPException(status_code=400, detail="Give either `campaign_id` or `seed`, not both.")
+    if request.campaign_id is not None and not storage.is_valid_id(request.campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+    expressions = _check_rolls(request.rolls, request.breakdown)
+
+    if request.campaign_id is not None:
+        stream = await storage.areserve_rolls(user_code, request.campaign_id, len(request.rolls), rng.new_key())
+        if stream is None:
+            raise HTTPException(status_code=404, detail="Campaign not found.")
+        generators = [(number, rng.generator(stream["key"], number))
+                      for number in range(stream["first"], stream["first"] + len(request.rolls))]
+    else:
+        shared = np.random.default_rng(request.seed)
+        generators = [(None, shared)] * len(request.rolls)
+
+    results = await _run(_roll_all, expressions, request.rolls, generators, request.breakdown)
+    if request.campaign_id is not None:
+        hub.publish_campaign(request.campaign_id, "dice", {"user_code": user_code, "results": results})
+    return RawJSONResponse(serialization.dumps({
+        "results": results,
+        "dice_rolled": sum(e.dice_count * item.times for e, item in zip(expressions, request.rolls)),
+        "campaign_id": request.campaign_id,
+    }))
+
+
+@router.post("/replay", response_model=ReplayResponse)
+async def replay_rolls(
+    request: ReplayRequest,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    Regenerates rolls already made from a campaign's RNG stream, by roll
+    number, in one call. Where the logged `totals` are given, each result
+    says whether they match, and `verified` whether all of them did.
+    """
+    if not storage.is_valid_id(request.campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+    expressions = _check_rolls(request.rolls, request.breakdown)
+    if await storage.aget_campaign_meta(user_code, request.campaign_id) is None:
+        raise HTTPException(status_code=404, detail="Campaign not found.")
+
+    stream = await storage.aget_rng_stream(user_code, request.campaign_id)
+    issued = stream["counter"] if stream else 0
+    for item in request.rolls:
+        if not 0 <= item.roll < issued:
+            raise HTTPException(status_code=400, detail=f"Roll {item.roll} hasn't been made in this campaign.")
+
+    generators = [(item.roll, rng.generator(stream["key"], item.roll)) for item in request.rolls]
+    results = await _run(_roll_all, expressions, request.rolls, generators, request.breakdown)
+    for result, item in zip(results, request.rolls):
+        if item.totals is not None:
+            result["matches"] = result["totals"] == item.totals
+    return RawJSONResponse(serialization.dumps({
+        "campaign_id": request.campaign_id,
+        "results": results,
+        "verified": all(result.get("matches", True) for result in results),
+    }))
+
+
+def _describe(expression, request: ProbabilityRequest) -> bytes:
+    dist = probability.distribution(expression)
+    body = {
+        "expression": expression.notation,
+        "modifier": request.modifier,
+        "min": dist.min,
+        "max": dist.max,
+        "mean": round(dist.mean, 12),
+        "stdev": round(dist.stdev, 12),
+        "success": probability.success_chances(dist, request.modifier),
+    }
+    if request.distribution:
+        body["distribution"] = {"values": dist.values.tolist(), "pmf": dist.pmf.tolist(), "cdf": dist.cdf.tolist()}
+    return serialization.dumps(body)
+
+
+@router.post("/probability", response_model=ProbabilityResponse)
+async def roll_probability(
+    request: ProbabilityRequest,
+    user_code: str = Depends(get_current_user_code)
+):
+    """
+    The exact odds of a dice expression (plus `modifier`) meeting each of
+    the standard difficulty classes, e.g. "d20adv" with modifier 5. With
+    `distribution`, also returns the probability of every total.
+    """
+    try:
+        expression = dice_notation.parse(request.expression)
+        # Distributions are memoized; computing a new one can take a while, so it happens off the loop.
+        return RawJSONResponse(await run_in_threadpool(_describe, expression, request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
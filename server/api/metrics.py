@@ -0,0 +1,98 @@
+import time
+
+from fastapi import APIRouter
+from starlette.responses import Response
+
+from server.core import cluster, config, llm_dispatch, metrics
+from server.core.room_hub import hub
+
+router = APIRouter(tags=["System"])
+
+# --- HTTP ---
+
+_REQUESTS = metrics.Counter(
+    "neuro_dnd_http_requests_total", "HTTP requests served, by route template and status code.",
+    ("method", "route", "status"))
+_REQUEST_SECONDS = metrics.Histogram(
+    "neuro_dnd_http_request_duration_seconds", "Time to serve HTTP requests, up to the last byte of the body.",
+    ("method", "route"))
+
+
+def _route_label(scope) -> str:
+    """The matched route's path template (bounded label values), not the raw path."""
+    if scope.get("route") is None:
+        # The frontend mount catches every other path.
+        return "/{path:path}" if scope.get("endpoint") is not None else "unmatched"
+    # Included routers don't expose their prefix, so put the parameter names back into the path.
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(f"{{{names[part]}}}" if part in names else part for part in scope["path"].split("/"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting HTTP requests and timing them, per method, route and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500 # If the app fails before responding
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = _route_label(scope)
+            _REQUESTS.inc(labels=(scope["method"], route, str(status)))
+            _REQUEST_SECONDS.observe(time.perf_counter() - start, (scope["method"], route))
+
+
+# --- State counted elsewhere ---
+
+def _dispatcher_counts():
+    stats = llm_dispatch.dispatcher.stats()
+    return {(key,): stats[key] for key in ("admitted", "queued", "rejected_queue_full", "rejected_user_limit", "timeouts")}
+
+metrics.Collected("neuro_dnd_llm_dispatch_total",
+                  "Model call admissions: admitted (at once or after queueing), queued, and shed.",
+                  _dispatcher_counts, ("event",), type="counter")
+metrics.Collected("neuro_dnd_llm_dispatch_running", "Model calls running now.",
+                  lambda: llm_dispatch.dispatcher.stats()["running"])
+metrics.Collected("neuro_dnd_llm_dispatch_queue_depth", "Model calls waiting for a slot.",
+                  lambda: llm_dispatch.dispatcher.stats()["queue_depth"])
+metrics.Collected("neuro_dnd_room_hub_rooms", "Rooms with live WebSocket channels.", lambda: hub.stats()["rooms"])
+metrics.Collected("neuro_dnd_room_hub_connections", "Open room WebSockets.", lambda: hub.stats()["connections"])
+metrics.Collected("neuro_dnd_room_hub_events_total", "Room events published, delivered, and slow clients evicted.",
+                  lambda: {(key,): hub.stats()[key] for key in ("published", "delivered", "evicted")},
+                  ("event",), type="counter")
+
+
+# --- Export ---
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Metrics in the Prometheus text format. With several workers, every
+    worker's samples are included, labelled with `worker`.
+    """
+    families = metrics.snapshot()
+    if not cluster.enabled():
+        return Response(metrics.render(families), media_type=metrics.CONTENT_TYPE)
+
+    snapshots = [metrics.with_labels(families, worker=str(config.WORKER_ID))]
+    try:
+        peers = await cluster.gather("/internal/metrics")
+    except Exception as e:
+        print(f"Collecting metrics from other workers failed: {e}")
+        peers = []
+    for worker, peer_families in zip(cluster.others(), peers):
+        snapshots.append(metrics.with_labels(peer_families, worker=str(worker)))
+    return Response(metrics.render(*snapshots), media_type=metrics.CONTENT_TYPE)
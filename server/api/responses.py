@@ -0,0 +1,23 @@
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+from server.core import serialization
+
+
+class RawJSONResponse(JSONResponse):
+    """
+    A JSON response rendered with server.core.serialization. Routes can also
+    hand it bytes they serialized themselves, which are sent unchanged.
+
+    Routes with a `response_model` should keep FastAPI's default response
+    class: FastAPI only takes its pydantic-core serialization fast path when
+    no response class is set, and that is faster than re-encoding the
+    validated model here. Use this for data that needs no validation, such
+    as records read straight from storage.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return serialization.dumps(content)
@@ -1,16 +1,21 @@
-import random
-import string
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from typing import Optional
 
-from server.core import storage
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+
+from server.core import cluster, security, serialization, storage
 from server.core.models import Room, CreateRoomRequest, JoinRoomRequest, RoomResponse
-from server.api.auth import get_current_user_code
+from server.core.room_hub import hub
+from server.core.room_registry import registry
+from server.api.auth import get_current_user_code, resolve_principal
 
 router = APIRouter(prefix="/rooms", tags=["Rooms & Lobby"])
 
-def generate_room_code(length: int = 4) -> str:
-    """Generates a short, user-friendly, base36 room code (uppercase letters + digits)."""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+# WebSocket close codes (4000-4999 are free for applications).
+CLOSE_SLOW_CONSUMER = 4000
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_NOT_A_MEMBER = 4403
+CLOSE_ROOM_NOT_FOUND = 4404
 
 @router.post("", response_model=Room)
 async def create_room(
@@ -19,46 +24,37 @@ async def create_room(
 ):
     """
     Creates a new game room. The creator becomes the host.
+    With `campaign_id` (one of the host's campaigns), the room's members get
+    that campaign's journal and dice rolls live over the room's WebSocket.
     """
-    all_rooms = storage.get_all_rooms()
-
-    # Generate a unique room code
-    while True:
-        room_code = generate_room_code()
-        if not any(r['room_code'] == room_code for r in all_rooms):
-            break
-
-    new_room = Room(
-        room_code=room_code,
-        host_user_code=user_code,
-        name=request.name or f"Room {room_code}",
-        is_public=request.is_public,
-        players=[user_code] # Host is the first player
-    )
-
-    all_rooms.append(new_room.dict())
-    storage.write_all_rooms(all_rooms)
+    if request.campaign_id is not None:
+        if not storage.is_valid_id(request.campaign_id):
+            raise HTTPException(status_code=400, detail="Invalid campaign ID format.")
+        if await storage.aget_campaign_meta(user_code, request.campaign_id) is None:
+            raise HTTPException(status_code=404, detail="Campaign not found.")
+    return await registry.create(user_code, request.name, request.is_public, request.campaign_id)
 
-    return new_room
+@router.get("/public")
+async def list_public_rooms():
+    """
+    Returns a list of all public rooms.
+    """
+    rooms = [Room(**r) for r in await registry.list_public()]
+    if cluster.enabled():
+        # Each worker only holds the rooms it owns.
+        for others in await cluster.gather("/internal/rooms/public"):
+            rooms += [Room(**r) for r in others]
+        rooms.sort(key=lambda room: room.created_at)
+    return rooms
 
 @router.get("/{room_code}", response_model=Room)
 async def get_room_details(room_code: str):
     """Gets the details of a specific room."""
-    all_rooms = storage.get_all_rooms()
-    room = next((r for r in all_rooms if r['room_code'] == room_code.upper()), None)
+    room = await registry.get(room_code.upper())
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     return room
 
-@router.get("/public")
-async def list_public_rooms():
-    """
-    Returns a list of all public rooms.
-    """
-    all_rooms = storage.get_all_rooms()
-    public_rooms = [Room(**r) for r in all_rooms if r.get('is_public')]
-    return public_rooms
-
 @router.post("/join")
 async def join_room(
     request: JoinRoomRequest,
@@ -67,19 +63,94 @@ async def join_room(
     """
     Allows a user to join an existing room.
     """
-    all_rooms = storage.get_all_rooms()
-    room_to_join = None
+    room_code = request.room_code.upper()
+    before = await registry.get(room_code)
+    if before is None or not await registry.join(room_code, user_code):
+        raise HTTPException(status_code=404, detail="Room not found")
+    if user_code not in before['players']:
+        hub.publish(room_code, "member_joined", {"user_code": user_code})
 
-    for r in all_rooms:
-        if r['room_code'] == request.room_code.upper():
-            room_to_join = r
-            break
+    return {"message": "Successfully joined room", "room_code": room_code}
 
-    if not room_to_join:
-        raise HTTPException(status_code=404, detail="Room not found")
 
-    if user_code not in room_to_join['players']:
-        room_to_join['players'].append(user_code)
-        storage.write_all_rooms(all_rooms)
+# --- Live events ---
+
+async def _websocket_user(token: Optional[str], user_code: Optional[str]) -> Optional[str]:
+    """The same credentials as get_current_user_code, from query parameters (browsers can't set WS headers)."""
+    if token:
+        verified = security.verify_session_token(token)
+        if verified:
+            return verified
+    if user_code and storage.is_valid_id(user_code) and await resolve_principal(user_code) is not None:
+        return user_code
+    return None
+
+@router.websocket("/{room_code}/ws")
+async def room_events(
+    websocket: WebSocket,
+    room_code: str,
+    token: Optional[str] = None,
+    user_code: Optional[str] = None,
+    since_seq: Optional[int] = None,
+    epoch: Optional[str] = None,
+):
+    """
+    Live events for the members of a room. Authenticate with `token` (a
+    session token) or `user_code`.
+
+    The first message is {"type": "hello", "epoch", "seq", "resumed",
+    "online"}; after it, every message is {"seq", "type", "data"} with type
+    one of "join", "leave", "member_joined", "journal", "dice" or
+    "dm_token". To resume after a disconnect, reconnect with the last
+    `since_seq` seen and the hello's `epoch`: if `resumed` is true the missed
+    events follow, otherwise reload the room and campaign over HTTP.
+    Send "ping" to get "pong". A client that can't keep up is disconnected
+    with code 4000 and should resume.
+    """
+    await websocket.accept()
+    member = await _websocket_user(token, user_code)
+    if member is None:
+        await websocket.close(code=CLOSE_UNAUTHENTICATED, reason="Not authenticated")
+        return
+    room_code = room_code.upper()
+    room = await registry.get(room_code)
+    if room is None:
+        await websocket.close(code=CLOSE_ROOM_NOT_FOUND, reason="Room not found")
+        return
+    if member not in room['players']:
+        await websocket.close(code=CLOSE_NOT_A_MEMBER, reason="Not a member of this room")
+        return
+
+    subscriber, hello, backlog = hub.subscribe(room_code, member, since_seq, epoch)
+    try:
+        await websocket.send_text(serialization.dumps_str(hello))
+        for message in backlog:
+            await websocket.send_text(message)
+        hub.publish(room_code, "join", {"user_code": member})
+
+        async def pump():
+            while True:
+                await websocket.send_text(await subscriber.queue.get())
+
+        async def receive():
+            while True:
+                if await websocket.receive_text() == "ping":
+                    await websocket.send_text("pong")
 
-    return {"message": "Successfully joined room", "room_code": request.room_code.upper()}
+        tasks = [asyncio.create_task(pump()), asyncio.create_task(receive()),
+                 asyncio.create_task(subscriber.evicted.wait())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if subscriber.evicted.is_set():
+            await websocket.close(code=CLOSE_SLOW_CONSUMER, reason="Slow consumer")
+        else:
+            for task in done:
+                task.result() # Re-raises the disconnect
+    except (WebSocketDisconnect, RuntimeError):
+        pass # The client went away
+    finally:
+        hub.unsubscribe(room_code, subscriber)
+        hub.publish(room_code, "leave", {"user_code": member})
@@ -2,9 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 
-from server.core import storage
+from server.core import cluster, storage
 from server.core.models import UserSettings, UserProfile, UserProfileResponse
-from server.api.auth import get_current_user_code, get_current_user
+from server.api.auth import get_current_user_code, get_current_user, invalidate_principal
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -18,14 +18,11 @@ async def update_user_profile(
     current_user: UserProfile = Depends(get_current_user)
 ):
     """Updates the current user's profile (e.g., username)."""
-    profile_path = storage.get_user_profile_file(current_user.user_code)
-    if not profile_path:
-        # This should not happen if get_current_user succeeds
-        raise HTTPException(status_code=404, detail="User profile file not found.")
-
     updated_user = current_user.copy(update=request.dict(exclude_unset=True))
 
-    storage.write_json(profile_path, updated_user.dict())
+    await storage.asave_user_profile(updated_user.dict())
+    invalidate_principal(updated_user.user_code)
+    await cluster.broadcast("principal.invalidate", updated_user.user_code)
 
     # FastAPI will correctly serialize this to UserProfileResponse
     return updated_user
@@ -37,11 +34,7 @@ async def get_user_settings(user_code: str = Depends(get_current_user_code)):
     Retrieves the current user's settings.
     If no settings file exists, returns default settings.
     """
-    settings_path = storage.get_user_settings_file(user_code)
-    if not settings_path:
-        raise HTTPException(status_code=400, detail="Invalid user code format.")
-
-    settings_data = storage.read_json(settings_path)
+    settings_data = await storage.aget_user_settings(user_code)
     if settings_data is None:
         return UserSettings()  # Return default settings
 
@@ -56,9 +49,5 @@ async def update_user_settings(
     """
     Updates the current user's settings.
     """
-    settings_path = storage.get_user_settings_file(user_code)
-    if not settings_path:
-        raise HTTPException(status_code=400, detail="Invalid user code format.")
-
-    storage.write_json(settings_path, settings.dict())
+    await storage.asave_user_settings(user_code, settings.dict())
     return settings
@@ -0,0 +1,227 @@
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from server.core import config, metrics
+from server.core.models import CampaignMeta, Message
+
+
+_CALLS = metrics.Counter(
+    "neuro_dnd_llm_calls_total",
+    "Model calls by mode (complete or stream) and outcome: ok, error, or cancelled (stream abandoned).",
+    ("mode", "outcome"))
+_CALL_SECONDS = metrics.Histogram(
+    "neuro_dnd_llm_call_duration_seconds", "Time from sending a prompt to the end of the reply.", ("mode",),
+    metrics.LLM_BUCKETS)
+_FIRST_TOKEN_SECONDS = metrics.Histogram(
+    "neuro_dnd_llm_first_token_seconds", "Time from sending a prompt to the first streamed text.",
+    buckets=metrics.LLM_BUCKETS)
+_PROMPT_CHARS = metrics.Histogram(
+    "neuro_dnd_llm_prompt_chars", "Size of prompts sent to the model.", ("mode",), metrics.SIZE_BUCKETS)
+_RESPONSE_CHARS = metrics.Histogram(
+    "neuro_dnd_llm_response_chars", "Size of complete model replies.", ("mode",), metrics.SIZE_BUCKETS)
+
+
+class PromptTemplate:
+    """
+    The static head of every Dungeon Master prompt: the system prompt and the
+    few-shot examples from PROMPTS_DIR, joined once into a single string.
+
+    The source files are stat()ed on each use and the template is recompiled
+    only when one of them changed (mtime or size), so prompts can be edited
+    on a running server. The system prompt is required; examples are optional.
+    """
+
+    def __init__(self, system_file: Path, examples_file: Optional[Path] = None):
+        self.system_file = Path(system_file)
+        self.examples_file = Path(examples_file) if examples_file else None
+        self._stamp: Optional[Tuple] = None
+        self._head = ""
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    def _file_stamp(self, path: Optional[Path]) -> Optional[Tuple[int, int]]:
+        if path is None:
+            return None
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _compile(self) -> str:
+        parts = [self.system_file.read_text(encoding="utf-8").strip()]
+        if self.examples_file is not None and self.examples_file.exists():
+            parts.append(self.examples_file.read_text(encoding="utf-8").strip())
+        parts.append("## Game Context\n")
+        return "\n\n---\n".join(parts)
+
+    def head(self) -> str:
+        """Returns the compiled template. Raises FileNotFoundError if the system prompt is missing."""
+        stamp = (self._file_stamp(self.system_file), self._file_stamp(self.examples_file))
+        if stamp[0] is None:
+            raise FileNotFoundError(self.system_file)
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._head = self._compile()
+                    self._stamp = stamp
+                    self.compiles += 1
+        return self._head
+
+
+def build_prompt(template: PromptTemplate, campaign_meta: CampaignMeta, language: str,
+                 messages: List[Message], summary: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Assembles the full prompt in one pass: the compiled template, the game
+    context, the summary of earlier events (if any) and the message history
+    are joined once. Returns the prompt and its cost ({"build_ms", "chars",
+    "messages"}).
+    """
+    start = time.perf_counter()
+    parts = [
+        template.head(),
+        f"- Campaign Name: {campaign_meta.name}\n"
+        f"- Tone: {campaign_meta.tone}\n"
+        f"- Difficulty: {campaign_meta.difficulty}\n"
+        f"- Language: {language}\n"
+        "---\n",
+    ]
+    if summary:
+        parts.append(f"## Story So Far\n{summary}\n---\n")
+    parts.extend(f"**{msg.role.capitalize()}:** {msg.content}\n" for msg in messages)
+    prompt = "".join(parts)
+    cost = {
+        "build_ms": (time.perf_counter() - start) * 1000,
+        "chars": len(prompt),
+        "messages": len(messages),
+    }
+    return prompt, cost
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+FAKE_REPLY = (
+    "The torchlight trembles as the stone door grinds open. Cold air rushes out, "
+    "carrying the smell of dust and old iron. Somewhere below, water drips.\n\n"
+    "*Prompts:*\n1. Descend the stairs.\n2. Examine the runes.\n3. Listen at the threshold.\n\n"
+    "```json\n{\"mood\": \"tense\", \"location\": \"crypt_entrance\"}\n```"
+)
+
+
+class FakeModel:
+    """
+    A local stand-in for genai.GenerativeModel, for offline tests and
+    benchmarks. It answers every prompt with `reply`, after `first_token_delay`
+    seconds, streamed `chunk_chars` characters at a time with `chunk_delay`
+    seconds between chunks.
+    """
+
+    def __init__(self, reply: str = FAKE_REPLY, first_token_delay: float = 0.0,
+                 chunk_delay: float = 0.0, chunk_chars: int = 16):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = max(1, chunk_chars)
+        self.calls = 0
+
+    def _chunks(self) -> Iterator[_Chunk]:
+        time.sleep(self.first_token_delay)
+        for i in range(0, len(self.reply), self.chunk_chars):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield _Chunk(self.reply[i:i + self.chunk_chars])
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        if stream:
+            return self._chunks()
+        return _Chunk("".join(chunk.text for chunk in self._chunks()))
+
+
+class AIClient:
+    """
+    The process-wide LLM client. `genai` is configured and the model is
+    created once, in start() at application startup, instead of per request.
+    Anything with genai's generate_content(prompt, stream=...) can be plugged
+    in with use_model() (see FakeModel).
+    """
+
+    def __init__(self):
+        self.template = PromptTemplate(config.SYSTEM_PROMPT_FILE, config.EXAMPLES_FILE)
+        self.model = None
+
+    @property
+    def configured(self) -> bool:
+        if self.model is not None or config.AI_BACKEND == "fake":
+            return True
+        return bool(config.GEMINI_API_KEY) and config.GEMINI_API_KEY != "__PUT_YOUR_KEY_HERE__"
+
+    def use_model(self, model):
+        self.model = model
+
+    def start(self):
+        if self.model is None and config.AI_BACKEND == "fake":
+            self.model = FakeModel()
+        elif self.model is None and self.configured:
+            genai.configure(api_key=config.GEMINI_API_KEY)
+            self.model = genai.GenerativeModel(config.GEMINI_MODEL)
+        try:
+            self.template.head() # Compile now rather than on the first request
+        except FileNotFoundError:
+            print(f"Warning: System prompt file not found: {self.template.system_file}")
+
+    def build_prompt(self, campaign_meta: CampaignMeta, language: str, messages: List[Message],
+                     summary: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        return build_prompt(self.template, campaign_meta, language, messages, summary)
+
+    def _ensure_model(self):
+        if self.model is None:
+            self.start()
+        if self.model is None:
+            raise RuntimeError("Gemini API key is not configured")
+        return self.model
+
+    def generate(self, prompt: str) -> str:
+        start = time.perf_counter()
+        _PROMPT_CHARS.observe(len(prompt), ("complete",))
+        try:
+            text = self._ensure_model().generate_content(prompt).text
+        except Exception:
+            _CALLS.inc(labels=("complete", "error"))
+            raise
+        _CALLS.inc(labels=("complete", "ok"))
+        _CALL_SECONDS.observe(time.perf_counter() - start, ("complete",))
+        _RESPONSE_CHARS.observe(len(text), ("complete",))
+        return text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yields the reply text as the model produces it."""
+        start = time.perf_counter()
+        _PROMPT_CHARS.observe(len(prompt), ("stream",))
+        chars = 0
+        try:
+            for chunk in self._ensure_model().generate_content(prompt, stream=True):
+                if chunk.text:
+                    if not chars:
+                        _FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    chars += len(chunk.text)
+                    yield chunk.text
+        except GeneratorExit:
+            _CALLS.inc(labels=("stream", "cancelled"))
+            raise
+        except Exception:
+            _CALLS.inc(labels=("stream", "error"))
+            raise
+        _CALLS.inc(labels=("stream", "ok"))
+        _CALL_SECONDS.observe(time.perf_counter() - start, ("stream",))
+        _RESPONSE_CHARS.observe(chars, ("stream",))
+
+
+client = AIClient()
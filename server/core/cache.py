@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    A small thread-safe, bounded least-recently-used cache with hit/miss counters.
+    With `ttl_seconds`, entries also expire that long after they were set.
+    Values are stored as-is, so callers must treat them as read-only.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._expires: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl_seconds is not None and self._expires[key] <= time.monotonic():
+                del self._data[key]
+                del self._expires[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl_seconds is not None:
+                self._expires[key] = time.monotonic() + self.ttl_seconds
+            while len(self._data) > self.max_entries:
+                evicted, _ = self._data.popitem(last=False)
+                self._expires.pop(evicted, None)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._expires.pop(key, None)
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "max_size": self.max_entries,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key onto one execution.
+
+    The first caller for a key starts `func()` as its own task; callers that
+    arrive while it runs await the same task, and if `results` is given,
+    successful results are kept there for later callers too. The task is
+    shielded, so a caller that goes away (e.g. a disconnected client) doesn't
+    cancel the work the others are waiting for. Failures are not cached.
+    """
+
+    def __init__(self, results: Optional[LRUCache] = None):
+        self.results = results
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Returns (result, how), where how is "executed", "coalesced" or "replayed"."""
+        if self.results is not None:
+            cached = self.results.get(key, _MISSING)
+            if cached is not _MISSING:
+                self.replayed += 1
+                return cached, "replayed"
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, func))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception()) # Never "unretrieved"
+            self._inflight[key] = task
+            self.executed += 1
+            how = "executed"
+        else:
+            self.coalesced += 1
+            how = "coalesced"
+        return await asyncio.shield(task), how
+
+    async def _run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await func()
+            if self.results is not None:
+                self.results.set(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+            "saved": self.coalesced + self.replayed,
+            "in_flight": len(self._inflight),
+        }
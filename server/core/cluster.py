@@ -0,0 +1,211 @@
+"""
+Multi-worker mode: N worker processes serving the app behind one port.
+
+    python -m server.core.cluster --workers 4 [--host 0.0.0.0] [--port 8000] [--data-dir data]
+
+The launcher binds the public socket and starts the workers, which all
+accept connections on it; each worker also listens on a private socket
+that only the other workers use. Rooms and campaigns are owned by the
+worker that owner() picks from their room code or id, and live only in
+that worker's memory (room registry, room hub, key locks): the
+ClusterRouter middleware forwards requests and WebSockets for them to the
+owner. Rooms playing a campaign get a room code owned by the campaign's
+worker, so campaign events reach their rooms without crossing workers.
+
+Caches of other data (e.g. resolved principals) are per worker;
+broadcast() runs a registered handler in every other worker, which is how
+they are invalidated. A worker that dies is restarted with the same id.
+"""
+import argparse
+import asyncio
+import inspect
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from server.core import config, serialization
+
+SECRET_HEADER = "x-cluster-secret"
+
+
+# --- Ownership ---
+
+def enabled() -> bool:
+    return config.WORKERS > 1
+
+def owner(key: str) -> int:
+    """The worker owning a room code or campaign id. The same in every process (unlike hash())."""
+    return zlib.crc32(key.encode("utf-8")) % config.WORKERS
+
+def is_local(key: str) -> bool:
+    return config.WORKERS <= 1 or owner(key) == config.WORKER_ID
+
+def is_forwarded(headers) -> bool:
+    """True for requests sent by another worker (ASGI header pairs)."""
+    if not config.CLUSTER_SECRET:
+        return False
+    expected = config.CLUSTER_SECRET.encode("latin-1")
+    return any(name == SECRET_HEADER.encode() and secrets.compare_digest(value, expected) for name, value in headers)
+
+
+# --- Peers ---
+
+def uses_unix_sockets() -> bool:
+    return hasattr(socket, "AF_UNIX") and bool(config.CLUSTER_SOCKET_DIR)
+
+def socket_path(worker: int) -> Path:
+    return Path(config.CLUSTER_SOCKET_DIR) / f"worker-{worker}.sock"
+
+def base_url(worker: int, scheme: str = "http") -> str:
+    if uses_unix_sockets():
+        return f"{scheme}://worker-{worker}" # The host is ignored on a Unix socket
+    return f"{scheme}://127.0.0.1:{config.CLUSTER_BASE_PORT + worker}"
+
+_peers: Dict[int, httpx.AsyncClient] = {}
+
+def peer(worker: int) -> httpx.AsyncClient:
+    """A pooled HTTP client for another worker's private socket."""
+    client = _peers.get(worker)
+    if client is None:
+        transport = httpx.AsyncHTTPTransport(uds=str(socket_path(worker))) if uses_unix_sockets() else None
+        client = httpx.AsyncClient(
+            base_url=base_url(worker), transport=transport,
+            headers={SECRET_HEADER: config.CLUSTER_SECRET},
+            timeout=config.CLUSTER_TIMEOUT_SECONDS,
+        )
+        _peers[worker] = client
+    return client
+
+def others() -> List[int]:
+    return [worker for worker in range(config.WORKERS) if worker != config.WORKER_ID]
+
+async def gather(path: str) -> List[Any]:
+    """GETs an internal endpoint from every other worker. Returns the decoded bodies."""
+    responses = await asyncio.gather(*(peer(worker).get(path) for worker in others()))
+    for response in responses:
+        response.raise_for_status()
+    return [serialization.loads(response.content) for response in responses]
+
+async def stop():
+    for client in _peers.values():
+        await client.aclose()
+    _peers.clear()
+
+
+# --- Broadcast ---
+
+_handlers: Dict[str, Callable[[Any], Any]] = {}
+
+def on(topic: str):
+    """Registers the handler other workers' broadcast(topic, data) run in this one."""
+    def register(handler):
+        _handlers[topic] = handler
+        return handler
+    return register
+
+async def deliver(topic: str, data: Any):
+    result = _handlers[topic](data)
+    if inspect.isawaitable(result):
+        await result
+
+async def broadcast(topic: str, data: Any):
+    """Runs the topic's handler with `data` in every other worker and waits for them."""
+    if not enabled():
+        return
+    body = serialization.dumps(data)
+    results = await asyncio.gather(*(peer(worker).post(f"/internal/bus/{topic}", content=body)
+                                     for worker in others()), return_exceptions=True)
+    for worker, result in zip(others(), results):
+        if isinstance(result, Exception) or result.is_error:
+            print(f"Broadcast of {topic} to worker {worker} failed: {result}")
+
+
+# --- Launcher ---
+
+def _private_socket(worker: int) -> socket.socket:
+    if uses_unix_sockets():
+        path = socket_path(worker)
+        path.unlink(missing_ok=True) # Left over by a worker that died
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(path))
+        os.chmod(path, 0o600)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", config.CLUSTER_BASE_PORT + worker))
+    return sock
+
+def _run_worker(worker: int, settings: Dict[str, Any], data_dir: Optional[Path], log_level: str,
+                public: socket.socket):
+    import uvicorn
+
+    if data_dir is not None:
+        config.use_data_dir(data_dir)
+    for name, value in settings.items():
+        setattr(config, name, value)
+    config.WORKER_ID = worker
+    uvicorn.Server(uvicorn.Config("server.main:app", log_level=log_level)).run(
+        sockets=[public, _private_socket(worker)])
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the server as several worker processes sharing one port.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--data-dir", type=Path, default=None, help="Data directory (default: config.DATA_DIR).")
+    parser.add_argument("--internal-port", type=int, default=None,
+                        help="First private port, where Unix sockets aren't available (default: --port + 1).")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    import uvicorn
+    public = uvicorn.Config("server.main:app", host=args.host, port=args.port).bind_socket()
+    socket_dir = tempfile.mkdtemp(prefix="neuro-dnd-") if hasattr(socket, "AF_UNIX") else ""
+    settings = {
+        "WORKERS": args.workers,
+        "CLUSTER_SECRET": secrets.token_hex(16),
+        "CLUSTER_SOCKET_DIR": socket_dir,
+        "CLUSTER_BASE_PORT": args.internal_port or args.port + 1,
+    }
+
+    context = multiprocessing.get_context("spawn")
+    def start(worker: int):
+        process = context.Process(target=_run_worker, name=f"worker-{worker}",
+                                  args=(worker, settings, args.data_dir, args.log_level, public))
+        process.start()
+        return process
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Starting {args.workers} workers on http://{args.host}:{args.port}")
+    processes = {worker: start(worker) for worker in range(args.workers)}
+    try:
+        while True:
+            time.sleep(1)
+            for worker, process in processes.items():
+                if not process.is_alive():
+                    print(f"Worker {worker} exited with code {process.exitcode}; restarting it")
+                    processes[worker] = start(worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+        if socket_dir:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,27 @@ ROOT_DIR = Path(__file__).parent.parent.parent
 DATA_DIR = ROOT_DIR / "data"
 USERS_DIR = DATA_DIR / "users"
 ROOMS_FILE = DATA_DIR / "rooms.json"
-INDEX_FILE = DATA_DIR / "index.json"
+INDEX_FILE = DATA_DIR / "index.json" # Legacy monolithic email index, migrated into USER_INDEX_DIR
+USER_INDEX_DIR = DATA_DIR / "user_index"
+
+# Settings derived from DATA_DIR, updated together by use_data_dir().
+DATA_DIR_SETTINGS = ("DATA_DIR", "USERS_DIR", "ROOMS_FILE", "INDEX_FILE", "USER_INDEX_DIR", "SQLITE_PATH")
+
+def use_data_dir(data_dir: Path):
+    """
+    Points every DATA_DIR-derived path at another data directory (tools, tests,
+    benchmarks). SQLITE_PATH follows too, unless it was set in the environment.
+    """
+    global DATA_DIR, USERS_DIR, ROOMS_FILE, INDEX_FILE, USER_INDEX_DIR, SQLITE_PATH
+    DATA_DIR = Path(data_dir)
+    USERS_DIR = DATA_DIR / "users"
+    ROOMS_FILE = DATA_DIR / "rooms.json"
+    INDEX_FILE = DATA_DIR / "index.json"
+    USER_INDEX_DIR = DATA_DIR / "user_index"
+    if "SQLITE_PATH" not in os.environ:
+        SQLITE_PATH = DATA_DIR / "neuro_dnd.sqlite3"
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    USERS_DIR.mkdir(exist_ok=True)
 
 # Game Logic Prompts
 PROMPTS_DIR = ROOT_DIR / "server" / "game_logic" / "prompts"
@@ -21,15 +41,156 @@ SYSTEM_PROMPT_FILE = PROMPTS_DIR / "system_prompt.txt"
 EXAMPLES_FILE = PROMPTS_DIR / "examples.md"
 
 
+# --- Storage Backend ---
+# "json" keeps everything as files under DATA_DIR; "sqlite" uses a single
+# SQLite database (WAL mode). Import an existing tree with:
+#   python -m server.core.migrate --to sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = Path(os.getenv("SQLITE_PATH", DATA_DIR / "neuro_dnd.sqlite3"))
+
+# Number of leading hex digits of the email hash used to pick an index shard
+# (3 => 4096 shard files). Changing it requires rebuilding USER_INDEX_DIR.
+USER_INDEX_SHARD_PREFIX = int(os.getenv("USER_INDEX_SHARD_PREFIX", "3"))
+
+# JSON files are written compact; set to "true" for indented, human-readable files.
+STORAGE_PRETTY_JSON = os.getenv("STORAGE_PRETTY_JSON", "false").lower() in ("1", "true", "yes")
+
+# --- Storage Read Cache ---
+# Maximum number of parsed JSON files kept in memory by storage.read_json.
+STORAGE_CACHE_ENTRIES = int(os.getenv("STORAGE_CACHE_ENTRIES", "1024"))
+# Files larger than this are always read from disk and never cached.
+STORAGE_CACHE_MAX_FILE_BYTES = int(os.getenv("STORAGE_CACHE_MAX_FILE_BYTES", str(1024 * 1024)))
+
+# Size of the thread pool that runs blocking file I/O for async route handlers.
+STORAGE_IO_THREADS = int(os.getenv("STORAGE_IO_THREADS", "8"))
+
+# --- Rooms ---
+# Rooms with no lookups or joins for this long are removed.
+ROOM_IDLE_TTL_SECONDS = int(os.getenv("ROOM_IDLE_TTL_SECONDS", str(24 * 60 * 60)))
+ROOM_SWEEP_INTERVAL_SECONDS = int(os.getenv("ROOM_SWEEP_INTERVAL_SECONDS", "300"))
+# Fold the persisted room change log into a snapshot after this many changes.
+ROOM_SNAPSHOT_EVERY_CHANGES = int(os.getenv("ROOM_SNAPSHOT_EVERY_CHANGES", "500"))
+
+# --- Room Hub ---
+# Room members get live events over a WebSocket. Each connection may have
+# ROOM_HUB_SEND_QUEUE messages waiting to be sent (on top of the socket's own
+# buffers); a client that falls further behind is disconnected and has to
+# resume. Queued messages are shared between connections, so a deep queue
+# costs little; it has to absorb bursts like a full room reconnecting at
+# once (one "join" per member). Rooms keep their last ROOM_HUB_REPLAY_EVENTS
+# events for resuming, for ROOM_HUB_RESUME_WINDOW_SECONDS after their last
+# client left.
+ROOM_HUB_SEND_QUEUE = int(os.getenv("ROOM_HUB_SEND_QUEUE", "1024"))
+ROOM_HUB_REPLAY_EVENTS = int(os.getenv("ROOM_HUB_REPLAY_EVENTS", "1024"))
+ROOM_HUB_RESUME_WINDOW_SECONDS = int(os.getenv("ROOM_HUB_RESUME_WINDOW_SECONDS", "300"))
+
+# --- Workers ---
+# `python -m server.core.cluster --workers N` serves the app from N worker
+# processes sharing one port. Every room and campaign is owned by one worker,
+# picked by hashing its room code or id, and requests for it that reach
+# another worker are forwarded to the owner over the owner's private socket
+# (a Unix socket in CLUSTER_SOCKET_DIR, or loopback port CLUSTER_BASE_PORT + id
+# where Unix sockets aren't available). The launcher sets all of these for
+# its workers; a plain `uvicorn server.main:app` is one worker owning everything.
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))
+CLUSTER_SOCKET_DIR = os.getenv("CLUSTER_SOCKET_DIR", "")
+CLUSTER_BASE_PORT = int(os.getenv("CLUSTER_BASE_PORT", "0"))
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+# Timeout for forwarded requests (per read, so long streams are fine) and broadcasts.
+CLUSTER_TIMEOUT_SECONDS = float(os.getenv("CLUSTER_TIMEOUT_SECONDS", "60"))
+
+# --- Compression & Caching ---
+# Frontend files up to STATIC_PRECOMPRESS_MAX_BYTES are compressed once (gzip,
+# and brotli when it is installed) and served from memory. index.html is
+# revalidated on every load (a 304 when unchanged); other assets are cached
+# for STATIC_MAX_AGE_SECONDS. API responses of at least
+# API_COMPRESSION_MIN_BYTES are gzipped as they are sent, at
+# API_COMPRESSION_LEVEL (1-9: lower is faster, higher is smaller).
+STATIC_MAX_AGE_SECONDS = int(os.getenv("STATIC_MAX_AGE_SECONDS", "3600"))
+STATIC_PRECOMPRESS_MAX_BYTES = int(os.getenv("STATIC_PRECOMPRESS_MAX_BYTES", str(8 * 1024 * 1024)))
+API_COMPRESSION_MIN_BYTES = int(os.getenv("API_COMPRESSION_MIN_BYTES", "1024"))
+API_COMPRESSION_LEVEL = int(os.getenv("API_COMPRESSION_LEVEL", "6"))
+
+# --- Metrics ---
+# Request, storage and model-call counters and latency histograms, exported
+# in the Prometheus text format at /api/metrics (merged over all workers).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# --- Campaign Listing ---
+CAMPAIGN_PAGE_SIZE = int(os.getenv("CAMPAIGN_PAGE_SIZE", "50"))
+CAMPAIGN_PAGE_SIZE_MAX = int(os.getenv("CAMPAIGN_PAGE_SIZE_MAX", "200"))
+
+# --- Campaign Journal ---
+# Entries per append-only journal segment before a new one is started.
+JOURNAL_SEGMENT_ENTRIES = int(os.getenv("JOURNAL_SEGMENT_ENTRIES", "500"))
+# Background compaction merges small sealed segments up to this many entries...
+JOURNAL_COMPACTED_SEGMENT_ENTRIES = int(os.getenv("JOURNAL_COMPACTED_SEGMENT_ENTRIES", "5000"))
+# ...once at least this many small sealed segments have accumulated.
+JOURNAL_COMPACTION_THRESHOLD = int(os.getenv("JOURNAL_COMPACTION_THRESHOLD", "8"))
+
+# --- Campaign Checkpoints ---
+# "gzip" or "none"
+CHECKPOINT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "gzip")
+# Retention: the most recent N checkpoints, plus the newest one of each of the last N days.
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_KEEP_DAILY = int(os.getenv("CHECKPOINT_KEEP_DAILY", "30"))
+
+
 # --- Gemini AI Configuration ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash") # Use flash for speed and cost, but allow override
+# "gemini" calls the Gemini API; "fake" answers with a canned local reply (offline development and tests).
+AI_BACKEND = os.getenv("AI_BACKEND", "gemini")
+
+# --- AI Context ---
+# The server builds each prompt from the stored campaign journal: the last
+# AI_CONTEXT_RECENT_TURNS entries verbatim (as many as fit in
+# AI_CONTEXT_TOKEN_BUDGET), and everything older as rolling summaries of
+# AI_SUMMARY_SEGMENT_ENTRIES entries each, up to AI_CONTEXT_SUMMARY_TOKEN_BUDGET.
+AI_CONTEXT_RECENT_TURNS = int(os.getenv("AI_CONTEXT_RECENT_TURNS", "12"))
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "3000"))
+AI_CONTEXT_SUMMARY_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_SUMMARY_TOKEN_BUDGET", "1000"))
+AI_SUMMARY_SEGMENT_ENTRIES = int(os.getenv("AI_SUMMARY_SEGMENT_ENTRIES", "20"))
+
+# --- AI Request Coalescing ---
+# Duplicate /ai/complete requests (same campaign and messages, or the same
+# Idempotency-Key) share one model call while it runs. Results of calls made
+# with an Idempotency-Key are replayed to repeats for
+# AI_RESULT_CACHE_TTL_SECONDS afterwards.
+AI_RESULT_CACHE_TTL_SECONDS = int(os.getenv("AI_RESULT_CACHE_TTL_SECONDS", "30"))
+AI_RESULT_CACHE_ENTRIES = int(os.getenv("AI_RESULT_CACHE_ENTRIES", "1024"))
+
+# --- LLM Dispatch ---
+# Model calls run on their own thread pool, at most LLM_MAX_CONCURRENCY at a
+# time and LLM_MAX_PER_USER per user. Up to LLM_QUEUE_SIZE more wait for a
+# slot, each for at most LLM_QUEUE_TIMEOUT_SECONDS. Beyond that, requests are
+# shed with 503 (or 429 for a user who already has LLM_MAX_PER_USER waiting).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# --- Dice ---
+# Parsed dice expressions are cached. One bulk roll request may roll at most
+# DICE_MAX_DICE_PER_REQUEST dice (expression dice x times, summed), or
+# DICE_MAX_BREAKDOWN_DICE when it asks for every die in the response.
+DICE_EXPRESSION_CACHE_ENTRIES = int(os.getenv("DICE_EXPRESSION_CACHE_ENTRIES", "1024"))
+DICE_MAX_DICE_PER_REQUEST = int(os.getenv("DICE_MAX_DICE_PER_REQUEST", "1000000"))
+DICE_MAX_BREAKDOWN_DICE = int(os.getenv("DICE_MAX_BREAKDOWN_DICE", "10000"))
+# Exact distributions are memoized for this many terms and expressions.
+DICE_DISTRIBUTION_CACHE_ENTRIES = int(os.getenv("DICE_DISTRIBUTION_CACHE_ENTRIES", "256"))
 
 # --- Security ---
-# For simplicity, we're not using a complex signing key, but this is where it would go.
 SECRET_KEY = os.getenv("SECRET_KEY", "a_very_secret_default_key_for_dev")
 PASSWORD_SALT = os.getenv("PASSWORD_SALT", "a_not_so_secret_salt_for_dev_passwords")
 
+# Session tokens are signed with SECRET_KEY and verified without touching storage.
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(12 * 60 * 60)))
+# Resolved user profiles are cached this long (and dropped on profile updates).
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_ENTRIES", "10000"))
+
 # --- Ensure directories exist ---
 DATA_DIR.mkdir(exist_ok=True)
 USERS_DIR.mkdir(exist_ok=True)
@@ -0,0 +1,350 @@
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import filelock
+
+from server.core import config, serialization
+
+# --- Segmented, append-only campaign journal ---
+#
+# Layout inside a campaign folder:
+#
+#   journal/
+#     manifest.json        {"version": 1, "next_seq": N, "segments": [...]}
+#     seg_00000000.jsonl   one journal entry per line
+#     seg_00000500.jsonl
+#
+# Each segment record in the manifest is {"name", "start", "count", "bytes"}.
+# Only the last segment is ever appended to. Readers trust the manifest:
+# they read exactly `bytes` bytes of each segment, so a half-written line
+# from an in-flight (or crashed) append is never visible. The manifest is
+# always replaced atomically, and the next append truncates the active
+# segment back to its recorded size before writing.
+#
+# Rolling a journal back (truncate/replace below) bumps the manifest's
+# "generation", which is part of every segment name written afterwards, so
+# a segment name never refers to two different contents.
+
+MANIFEST_VERSION = 1
+LEGACY_JOURNAL_NAME = "journal.json"
+
+
+def get_journal_dir(campaign_dir: Path) -> Path:
+    return campaign_dir / "journal"
+
+
+def _manifest_path(campaign_dir: Path) -> Path:
+    return get_journal_dir(campaign_dir) / "manifest.json"
+
+
+def _lock(campaign_dir: Path) -> filelock.FileLock:
+    return filelock.FileLock(get_journal_dir(campaign_dir) / "journal.lock")
+
+
+def _segment_name(start: int, generation: int = 0, end: Optional[int] = None) -> str:
+    name = f"seg_{start:08d}" if end is None else f"seg_{start:08d}_{end:08d}"
+    return f"{name}.g{generation}.jsonl" if generation else f"{name}.jsonl"
+
+
+def _encode_entry(entry: Dict[str, Any]) -> bytes:
+    return serialization.dumps(entry) + b"\n"
+
+
+def _read_manifest(campaign_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_manifest_path(campaign_dir), "rb") as f:
+            return serialization.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(campaign_dir: Path, manifest: Dict[str, Any]):
+    """Atomically replaces the manifest (write to a temp file, then rename)."""
+    path = _manifest_path(campaign_dir)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(serialization.dumps(manifest))
+    os.replace(tmp_path, path)
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {"version": MANIFEST_VERSION, "next_seq": 0, "segments": []}
+
+
+def _migrate_legacy(campaign_dir: Path) -> Optional[Dict[str, Any]]:
+    """
+    Converts a legacy single-file `journal.json` into segments.
+    Must be called with the journal lock held. Returns the new manifest,
+    or None if there is no legacy journal to migrate.
+    """
+    legacy_path = campaign_dir / LEGACY_JOURNAL_NAME
+    try:
+        with open(legacy_path, "rb") as f:
+            legacy = serialization.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        legacy = {}
+
+    manifest = _empty_manifest()
+    _write_segments(campaign_dir, manifest, legacy.get("entries", []))
+    _write_manifest(campaign_dir, manifest)
+    legacy_path.unlink()
+    return manifest
+
+
+def _write_segments(campaign_dir: Path, manifest: Dict[str, Any], entries: List[Dict[str, Any]]):
+    """Writes entries as fresh, full-size segments and records them in `manifest`."""
+    size = config.JOURNAL_SEGMENT_ENTRIES
+    for offset in range(0, len(entries), size):
+        chunk = entries[offset:offset + size]
+        start = manifest["next_seq"]
+        name = _segment_name(start, manifest.get("generation", 0))
+        data = b"".join(_encode_entry(e) for e in chunk)
+        with open(get_journal_dir(campaign_dir) / name, "wb") as f:
+            f.write(data)
+        manifest["segments"].append({"name": name, "start": start, "count": len(chunk), "bytes": len(data)})
+        manifest["next_seq"] = start + len(chunk)
+
+
+def _remove_segments(campaign_dir: Path, names: List[str]):
+    for name in names:
+        try:
+            (get_journal_dir(campaign_dir) / name).unlink()
+        except OSError:
+            # Already gone, or still held open by a reader (Windows).
+            pass
+
+
+def _load_manifest(campaign_dir: Path) -> Optional[Dict[str, Any]]:
+    """
+    Returns the journal manifest, transparently migrating a legacy
+    `journal.json` on first touch. Returns None if the campaign has no journal.
+    """
+    manifest = _read_manifest(campaign_dir)
+    if manifest is not None:
+        return manifest
+    if not (campaign_dir / LEGACY_JOURNAL_NAME).exists():
+        return None
+
+    get_journal_dir(campaign_dir).mkdir(parents=True, exist_ok=True)
+    with _lock(campaign_dir):
+        # Another worker may have migrated while we waited for the lock.
+        manifest = _read_manifest(campaign_dir)
+        if manifest is not None:
+            return manifest
+        return _migrate_legacy(campaign_dir)
+
+
+# --- Public API ---
+
+def create_journal(campaign_dir: Path):
+    """Creates an empty journal for a new campaign."""
+    get_journal_dir(campaign_dir).mkdir(parents=True, exist_ok=True)
+    with _lock(campaign_dir):
+        if _read_manifest(campaign_dir) is None:
+            _write_manifest(campaign_dir, _empty_manifest())
+
+
+def journal_exists(campaign_dir: Path) -> bool:
+    return _manifest_path(campaign_dir).exists() or (campaign_dir / LEGACY_JOURNAL_NAME).exists()
+
+
+def entry_count(campaign_dir: Path) -> Optional[int]:
+    """Returns the number of entries in the journal, or None if it doesn't exist."""
+    manifest = _load_manifest(campaign_dir)
+    return manifest["next_seq"] if manifest is not None else None
+
+
+def append_entries(campaign_dir: Path, entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Appends entries to the end of the journal. The cost depends only on the
+    size of the new entries, not on the length of the journal.
+    Returns the updated manifest, or None if the journal doesn't exist.
+    """
+    if _load_manifest(campaign_dir) is None:
+        return None
+
+    with _lock(campaign_dir):
+        manifest = _read_manifest(campaign_dir)
+        segments = manifest["segments"]
+        for entry in entries:
+            if not segments or segments[-1]["count"] >= config.JOURNAL_SEGMENT_ENTRIES:
+                start = manifest["next_seq"]
+                name = _segment_name(start, manifest.get("generation", 0))
+                segments.append({"name": name, "start": start, "count": 0, "bytes": 0})
+                open(get_journal_dir(campaign_dir) / name, "wb").close()
+
+            active = segments[-1]
+            data = _encode_entry(entry)
+            with open(get_journal_dir(campaign_dir) / active["name"], "r+b") as f:
+                # Drop any tail left behind by an append that crashed before
+                # its manifest update.
+                f.truncate(active["bytes"])
+                f.seek(active["bytes"])
+                f.write(data)
+            active["count"] += 1
+            active["bytes"] += len(data)
+            manifest["next_seq"] += 1
+
+        _write_manifest(campaign_dir, manifest)
+        return manifest
+
+
+def read_entries(campaign_dir: Path, start: int = 0, stop: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Reads journal entries with sequence numbers in [start, stop).
+    Only the segments overlapping the range are opened.
+    Returns None if the journal doesn't exist.
+    """
+    # A concurrent compaction may delete a segment between reading the
+    # manifest and opening it; re-reading the manifest resolves that.
+    for _ in range(3):
+        manifest = _load_manifest(campaign_dir)
+        if manifest is None:
+            return None
+        try:
+            return _read_range(campaign_dir, manifest, start, stop)
+        except FileNotFoundError:
+            continue
+    return _read_range(campaign_dir, _load_manifest(campaign_dir), start, stop)
+
+
+def _read_range(campaign_dir: Path, manifest: Dict[str, Any], start: int, stop: Optional[int]) -> List[Dict[str, Any]]:
+    if stop is None or stop > manifest["next_seq"]:
+        stop = manifest["next_seq"]
+    entries: List[Dict[str, Any]] = []
+    for segment in manifest["segments"]:
+        seg_start, seg_end = segment["start"], segment["start"] + segment["count"]
+        if seg_end <= start or seg_start >= stop:
+            continue
+        with open(get_journal_dir(campaign_dir) / segment["name"], "rb") as f:
+            lines = f.read(segment["bytes"]).splitlines()
+        lo, hi = max(start, seg_start) - seg_start, min(stop, seg_end) - seg_start
+        entries.extend(serialization.loads(line) for line in lines[lo:hi])
+    return entries
+
+
+def truncate(campaign_dir: Path, length: int) -> Optional[Dict[str, Any]]:
+    """
+    Drops every entry with a sequence number >= `length` (a rollback).
+    Segments entirely before `length` are kept as they are, so the cost is
+    at most one segment rewrite. Returns the new manifest, or None if the
+    journal doesn't exist.
+    """
+    if _load_manifest(campaign_dir) is None:
+        return None
+
+    with _lock(campaign_dir):
+        manifest = _read_manifest(campaign_dir)
+        if length >= manifest["next_seq"]:
+            return manifest
+
+        journal_dir = get_journal_dir(campaign_dir)
+        generation = manifest.get("generation", 0) + 1
+        kept: List[Dict[str, Any]] = []
+        obsolete: List[str] = []
+        for segment in manifest["segments"]:
+            if segment["start"] + segment["count"] <= length:
+                kept.append(segment)
+                continue
+            obsolete.append(segment["name"])
+            if segment["start"] < length:
+                count = length - segment["start"]
+                with open(journal_dir / segment["name"], "rb") as f:
+                    data = b"".join(f.read(segment["bytes"]).splitlines(keepends=True)[:count])
+                name = _segment_name(segment["start"], generation)
+                with open(journal_dir / name, "wb") as f:
+                    f.write(data)
+                kept.append({"name": name, "start": segment["start"], "count": count, "bytes": len(data)})
+
+        manifest = {**manifest, "generation": generation, "next_seq": length, "segments": kept}
+        _write_manifest(campaign_dir, manifest)
+        _remove_segments(campaign_dir, obsolete)
+        return manifest
+
+
+def replace_entries(campaign_dir: Path, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Replaces the whole journal (creating it if needed) with `entries`. Returns the new manifest."""
+    get_journal_dir(campaign_dir).mkdir(parents=True, exist_ok=True)
+    with _lock(campaign_dir):
+        old = _read_manifest(campaign_dir) or _migrate_legacy(campaign_dir) or _empty_manifest()
+        manifest = {**_empty_manifest(), "generation": old.get("generation", 0) + 1}
+        _write_segments(campaign_dir, manifest, entries)
+        _write_manifest(campaign_dir, manifest)
+        _remove_segments(campaign_dir, [segment["name"] for segment in old["segments"]])
+        return manifest
+
+
+# --- Compaction ---
+
+def needs_compaction(manifest: Dict[str, Any]) -> bool:
+    """
+    True when there are enough small sealed segments to be worth merging.
+    Only segments that fit together with a neighbour count: merged segments
+    may stay below the target, and a pass over them would change nothing.
+    """
+    sealed = manifest["segments"][:-1]
+    target = config.JOURNAL_COMPACTED_SEGMENT_ENTRIES
+    fits = [a["count"] + b["count"] <= target for a, b in zip(sealed, sealed[1:])]
+    mergeable = sum(1 for i in range(len(sealed)) if (i > 0 and fits[i - 1]) or (i < len(fits) and fits[i]))
+    return mergeable >= config.JOURNAL_COMPACTION_THRESHOLD
+
+
+def compact(campaign_dir: Path):
+    """
+    Merges runs of small sealed segments into larger ones, keeping the number
+    of files (and the size of the manifest) bounded on long campaigns.
+    The active segment is never touched, so appends can continue right after.
+    Safe to run in the background.
+    """
+    with _lock(campaign_dir):
+        manifest = _read_manifest(campaign_dir)
+        if manifest is None or not needs_compaction(manifest):
+            return
+
+        journal_dir = get_journal_dir(campaign_dir)
+        sealed, active = manifest["segments"][:-1], manifest["segments"][-1:]
+        target = config.JOURNAL_COMPACTED_SEGMENT_ENTRIES
+
+        merged: List[Dict[str, Any]] = []
+        obsolete: List[str] = []
+        run: List[Dict[str, Any]] = []
+
+        def flush_run():
+            if len(run) < 2:
+                merged.extend(run)
+                run.clear()
+                return
+            start = run[0]["start"]
+            count = sum(s["count"] for s in run)
+            # Within a generation segments are immutable, so a name derived
+            # from the entry range always identifies the same content.
+            name = _segment_name(start, manifest.get("generation", 0), start + count)
+            chunks = []
+            for seg in run:
+                with open(journal_dir / seg["name"], "rb") as f:
+                    chunks.append(f.read(seg["bytes"]))
+            data = b"".join(chunks)
+            tmp_path = journal_dir / (name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, journal_dir / name)
+            merged.append({"name": name, "start": start, "count": count, "bytes": len(data)})
+            obsolete.extend(s["name"] for s in run)
+            run.clear()
+
+        for seg in sealed:
+            if seg["count"] >= target or sum(s["count"] for s in run) + seg["count"] > target:
+                flush_run()
+            if seg["count"] >= target:
+                merged.append(seg)
+            else:
+                run.append(seg)
+        flush_run()
+        if not obsolete:
+            return # Nothing fitted together; leave the manifest alone
+
+        manifest["segments"] = merged + active
+        _write_manifest(campaign_dir, manifest)
+        _remove_segments(campaign_dir, obsolete)
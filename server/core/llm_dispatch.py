@@ -0,0 +1,238 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from server.core import config
+
+
+class Overloaded(Exception):
+    """A model call was shed instead of queued. `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The shared wait queue is full."""
+
+
+class UserLimitReached(Overloaded):
+    """The user already has their share of model calls running and waiting."""
+
+
+class QueueTimeout(Overloaded):
+    """No slot became free within the queue timeout."""
+
+
+class Lease:
+    """A held dispatch slot. release() is idempotent."""
+
+    def __init__(self, dispatcher: "LLMDispatcher", user_code: str, waited: float):
+        self._dispatcher = dispatcher
+        self.user_code = user_code
+        self.waited = waited
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._dispatcher._release(self.user_code)
+
+
+class _Waiter:
+    __slots__ = ("user_code", "future")
+
+    def __init__(self, user_code: str, future: asyncio.Future):
+        self.user_code = user_code
+        self.future = future
+
+
+def _close_after(pending: Future, iterator: Iterator):
+    wait([pending]) # A generator can't be closed while next() runs
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+class LLMDispatcher:
+    """
+    Admission control and a dedicated thread pool for blocking model calls.
+
+    At most `max_concurrency` calls run at once, and at most `max_per_user`
+    of them for any one user. Requests beyond that wait in a single FIFO
+    queue, skipping only waiters whose user is still at their limit. Each
+    waits at most `queue_timeout` seconds. A request is shed straight away
+    when its user already has `max_per_user` waiting (UserLimitReached), or
+    when the queue already holds `queue_size` waiters (QueueFull).
+
+    All bookkeeping happens on the event loop; only the model calls
+    themselves run on the pool, so a slow model never blocks other requests.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_per_user: Optional[int] = None,
+                 queue_size: Optional[int] = None, queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency or config.LLM_MAX_CONCURRENCY
+        self.max_per_user = max_per_user or config.LLM_MAX_PER_USER
+        self.queue_size = config.LLM_QUEUE_SIZE if queue_size is None else queue_size
+        self.queue_timeout = config.LLM_QUEUE_TIMEOUT_SECONDS if queue_timeout is None else queue_timeout
+        # A few spare threads: a call abandoned mid-stream keeps its thread until the model returns.
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix="llm")
+        self._running = 0
+        self._running_by_user: Dict[str, int] = {}
+        self._waiters: Deque[_Waiter] = deque()
+        self._waiting_by_user: Dict[str, int] = {}
+        self._recent_waits: Deque[float] = deque(maxlen=1024)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_user_limit = 0
+        self.timeouts = 0
+
+    # --- Admission ---
+
+    def _has_slot(self, user_code: str) -> bool:
+        return (self._running < self.max_concurrency
+                and self._running_by_user.get(user_code, 0) < self.max_per_user)
+
+    def _grant(self, user_code: str):
+        self._running += 1
+        self._running_by_user[user_code] = self._running_by_user.get(user_code, 0) + 1
+        self.admitted += 1
+
+    def _dequeue(self, waiter: _Waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        count = self._waiting_by_user[waiter.user_code] - 1
+        if count:
+            self._waiting_by_user[waiter.user_code] = count
+        else:
+            del self._waiting_by_user[waiter.user_code]
+
+    async def acquire(self, user_code: str) -> Lease:
+        """Waits for a slot. Raises an Overloaded subclass if the call is shed."""
+        start = time.perf_counter()
+        # Waiters left in the queue are all blocked (by the global cap or their
+        # own user's cap), so a request that has a slot never jumps ahead of one
+        # that could have used it.
+        if self._has_slot(user_code):
+            self._grant(user_code)
+            self._recent_waits.append(0.0)
+            return Lease(self, user_code, 0.0)
+
+        retry_after = max(1, round(self.queue_timeout / 2))
+        if self._waiting_by_user.get(user_code, 0) >= self.max_per_user:
+            self.rejected_user_limit += 1
+            raise UserLimitReached("Too many AI requests in progress for this user", retry_after)
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise QueueFull("The AI service is at capacity", retry_after)
+
+        waiter = _Waiter(user_code, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._waiting_by_user[user_code] = self._waiting_by_user.get(user_code, 0) + 1
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(user_code) # Granted just as the wait timed out
+            else:
+                self._dequeue(waiter)
+            self.timeouts += 1
+            raise QueueTimeout("Timed out waiting for the AI service", retry_after)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(user_code) # Granted just as the caller went away
+            else:
+                self._dequeue(waiter)
+            raise
+
+        waited = time.perf_counter() - start
+        self._recent_waits.append(waited)
+        return Lease(self, user_code, waited)
+
+    def _release(self, user_code: str):
+        self._running -= 1
+        count = self._running_by_user[user_code] - 1
+        if count:
+            self._running_by_user[user_code] = count
+        else:
+            del self._running_by_user[user_code]
+
+        for waiter in list(self._waiters):
+            if self._running >= self.max_concurrency:
+                break
+            if waiter.future.done() or waiter.future.get_loop().is_closed():
+                self._dequeue(waiter) # Timed out or abandoned
+                continue
+            if self._has_slot(waiter.user_code):
+                self._dequeue(waiter)
+                self._grant(waiter.user_code)
+                waiter.future.set_result(None)
+
+    # --- Running calls ---
+
+    async def run(self, user_code: str, func: Callable, *args, **kwargs) -> Any:
+        """Runs a blocking model call on the pool once a slot is free."""
+        lease = await self.acquire(user_code)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        finally:
+            lease.release()
+
+    async def iterate(self, iterator: Iterator) -> AsyncIterator:
+        """
+        Drains a blocking iterator (e.g. a model stream) on the pool. The caller
+        holds the slot. If the caller stops early (a disconnected client), the
+        iterator is closed once any next() still running on the pool returns,
+        so the upstream stream stops instead of generating until GC.
+        """
+        done = object()
+        pending: Optional[Future] = None
+        try:
+            while True:
+                pending = self._executor.submit(next, iterator, done)
+                item = await asyncio.wrap_future(pending)
+                if item is done:
+                    pending = None
+                    return
+                yield item
+        finally:
+            if pending is not None:
+                closing = self._executor.submit(_close_after, pending, iterator)
+                await asyncio.shield(asyncio.wrap_future(closing))
+
+    # --- Metrics ---
+
+    def stats(self) -> Dict[str, Any]:
+        waits: List[float] = sorted(self._recent_waits)
+        def wait_ms(fraction: float) -> float:
+            return round(waits[min(len(waits) - 1, int(len(waits) * fraction))] * 1000, 3) if waits else 0.0
+        return {
+            "running": self._running,
+            "queue_depth": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_per_user": self.max_per_user,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_user_limit": self.rejected_user_limit,
+            "timeouts": self.timeouts,
+            "wait_ms": {
+                "mean": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                "p50": wait_ms(0.5),
+                "p95": wait_ms(0.95),
+                "max": round(waits[-1] * 1000, 3) if waits else 0.0,
+            },
+        }
+
+
+dispatcher = LLMDispatcher()
@@ -0,0 +1,180 @@
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from server.core import config
+
+# --- Metrics ---
+# Counters and histograms kept in process memory and exported in the
+# Prometheus text format (GET /api/metrics). Metrics are module-level
+# objects created where they are updated; label values are passed as a
+# tuple in the order of the metric's label names. Updating one takes a
+# lock and a dict lookup, so it is cheap enough for every request and
+# storage call (see benchmarks/bench_metrics.py). With METRICS_ENABLED off,
+# updates return straight away.
+
+# Seconds. HTTP requests; storage calls (mostly well under a millisecond); model calls.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STORAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+# Characters.
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# One family per metric: [name, type, help, samples]; a sample is [name, labels, value].
+Family = List[Any]
+
+_registry: List["_Metric"] = []
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> List[List[Any]]:
+        raise NotImplementedError
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """A monotonically increasing value per label set."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, labels: Tuple = ()):
+        if not config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[List[Any]]:
+        with self._lock:
+            values = list(self._values.items())
+        return [[self.name, dict(zip(self.labels, key)), value] for key, value in values]
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, with their sum and count, per label set."""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple = ()):
+        if not config.METRICS_ENABLED:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, labels: Tuple = ()) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> List[List[Any]]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append([f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative])
+            samples.append([f"{self.name}_sum", labels, total])
+            samples.append([f"{self.name}_count", labels, cumulative])
+        return samples
+
+
+class Collected(_Metric):
+    """
+    A counter or gauge whose values are read from `collect` at export time,
+    for state other modules already count (caches, queues, connections).
+    `collect` returns a number, or {label values tuple: number}.
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Any], labels: Sequence[str] = (),
+                 type: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        self.type = type
+
+    def samples(self) -> List[List[Any]]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [[self.name, dict(zip(self.labels, key)), value] for key, value in values.items()]
+
+
+# --- Export ---
+
+def snapshot() -> List[Family]:
+    """Every registered metric's current samples (JSON-serializable, for merging across workers)."""
+    return [[metric.name, metric.type, metric.help, metric.samples()] for metric in _registry]
+
+
+def with_labels(families: List[Family], **labels: str) -> List[Family]:
+    """Adds constant labels (e.g. worker="2") to every sample."""
+    return [[name, type, help, [[sample, {**labels, **sample_labels}, value]
+                                for sample, sample_labels, value in samples]]
+            for name, type, help, samples in families]
+
+
+def render(*snapshots: List[Family]) -> str:
+    """Renders one or more snapshots in the Prometheus text format, merging families with the same name."""
+    merged: Dict[str, Family] = {}
+    for families in snapshots:
+        for name, type, help, samples in families:
+            family = merged.setdefault(name, [name, type, help, []])
+            family[3].extend(samples)
+
+    lines = []
+    for name, type, help, samples in merged.values():
+        lines.append(f"# HELP {name} {_escape(help, quote=False)}")
+        lines.append(f"# TYPE {name} {type}")
+        for sample, labels, value in samples:
+            if labels:
+                pairs = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+                lines.append(f"{sample}{{{pairs}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Zeroes every counter and histogram (collected metrics read live state)."""
+    for metric in _registry:
+        metric.reset()
+
+
+def _escape(value: str, quote: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_value(value: Optional[float]) -> str:
+    if value is None:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
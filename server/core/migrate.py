@@ -0,0 +1,77 @@
+"""
+One-shot import of an existing JSON data/ tree into the SQLite backend.
+
+    python -m server.core.migrate --to sqlite [--data-dir data] [--db data/neuro_dnd.sqlite3]
+
+The source tree is only read (legacy single-file journals are converted to
+the segmented format on the way, as on any other access). Re-running the
+command is safe: every record is upserted. Set STORAGE_BACKEND=sqlite
+afterwards to switch the server over.
+"""
+import argparse
+from pathlib import Path
+
+from server.core import config
+from server.core.storage import JsonFileBackend
+from server.core.storage_sqlite import SqliteBackend
+
+
+def import_json_tree(source: JsonFileBackend, target: SqliteBackend) -> dict:
+    """Copies every record from `source` into `target`. Returns per-table counts."""
+    counts = {"users": 0, "emails": 0, "campaigns": 0, "journal_entries": 0, "checkpoints": 0, "rooms": 0}
+
+    for user_code in source.iter_user_codes():
+        profile = source.get_user_profile(user_code)
+        if profile:
+            target.save_user_profile(profile)
+            counts["users"] += 1
+
+        settings = source.get_user_settings(user_code)
+        if settings is not None:
+            target.save_user_settings(user_code, settings)
+
+        for meta in source.list_campaign_metas(user_code):
+            campaign_id = str(meta["id"])
+            target.save_campaign_meta(user_code, meta)
+            counts["campaigns"] += 1
+
+            entries = source.read_journal(user_code, campaign_id)
+            if entries is not None:
+                target.replace_journal(user_code, campaign_id, entries)
+                counts["journal_entries"] += len(entries)
+
+            for info, payload in source.iter_checkpoints(user_code, campaign_id):
+                target.save_checkpoint(user_code, campaign_id, info, payload)
+                counts["checkpoints"] += 1
+
+            stream = source.get_rng_stream(user_code, campaign_id)
+            if stream is not None:
+                target.save_rng_stream(user_code, campaign_id, stream)
+
+    for email, entry in source.iter_index():
+        target.add_user_to_index(email, entry.get("user_code"), entry.get("username"))
+        counts["emails"] += 1
+
+    for room in source.list_rooms():
+        target.save_room(room)
+        counts["rooms"] += 1
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a JSON data/ tree into another storage backend.")
+    parser.add_argument("--to", choices=["sqlite"], required=True, help="Target backend.")
+    parser.add_argument("--data-dir", type=Path, default=config.DATA_DIR, help="Source data directory.")
+    parser.add_argument("--db", type=Path, default=None, help="Target SQLite file (default: $SQLITE_PATH, or neuro_dnd.sqlite3 in the data directory).")
+    args = parser.parse_args()
+
+    config.use_data_dir(args.data_dir)
+
+    db_path = args.db or config.SQLITE_PATH
+    counts = import_json_tree(JsonFileBackend(), SqliteBackend(db_path))
+    print(f"Imported into {db_path}: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,9 @@ class Message(BaseModel):
     role: str # 'user', 'assistant', or 'system'
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    seq: Optional[int] = None # Position in the campaign journal; assigned by the server
+
+CAMPAIGN_STATUSES = ("active", "archived", "completed")
 
 class CampaignMeta(BaseModel):
     id: uuid.UUID = Field(default_factory=uuid.uuid4)
@@ -36,6 +39,7 @@ class CampaignMeta(BaseModel):
 
 class CampaignJournal(BaseModel):
     entries: List[Message] = []
+    next_seq: Optional[int] = None # Sequence number the next appended entry will get
 
 class CampaignCheckpoint(BaseModel):
     timestamp: datetime
@@ -52,8 +56,10 @@ class Room(BaseModel):
     host_user_code: str
     name: Optional[str] = None
     is_public: bool = False
+    campaign_id: Optional[str] = None # The host's campaign played in this room
     players: List[str] = [] # List of user_codes
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_active_at: datetime = Field(default_factory=datetime.utcnow) # Used for idle expiry
 
 
 # --- API Request/Response Models ---
@@ -80,11 +86,17 @@ class UserProfileResponse(BaseModel):
 class AuthResponse(BaseModel):
     user_code: str
     profile: UserProfileResponse
+    session_token: Optional[str] = None # Send as "Authorization: Bearer <token>"
+
+class SessionResponse(BaseModel):
+    session_token: str
+    expires_in: int # Seconds
 
 # Rooms
 class CreateRoomRequest(BaseModel):
     is_public: bool
     name: Optional[str] = None
+    campaign_id: Optional[str] = None
 
 class JoinRoomRequest(BaseModel):
     room_code: str
@@ -98,6 +110,10 @@ class CreateCampaignRequest(BaseModel):
     tone: str = "epic_fantasy"
     difficulty: str = "medium"
 
+class UpdateCampaignRequest(BaseModel):
+    name: Optional[str] = None
+    status: Optional[str] = None # One of CAMPAIGN_STATUSES
+
 class CampaignDetailsResponse(BaseModel):
     meta: CampaignMeta
     journal: CampaignJournal
@@ -105,12 +121,104 @@ class CampaignDetailsResponse(BaseModel):
 class AddJournalEntryRequest(BaseModel):
     message: Message
 
+class AddJournalEntryResponse(BaseModel):
+    seq: int
+    entry: Message
+
+class CampaignState(BaseModel):
+    """Game state folded from the DM's metadata (see server/game_logic/state.py)."""
+    hp: int
+    max_hp: int
+    location: Optional[str] = None
+    mood: Optional[str] = None
+    inventory: Dict[str, int] = {} # Item name -> count
+    npcs: Dict[str, Dict[str, Any]] = {} # NPC name -> {"introduced_seq"}
+    status_effects: List[str] = []
+    last_action_result: Optional[str] = None
+
+class CampaignStateResponse(BaseModel):
+    version: int # Journal entries folded into the state
+    events: int # How many of them carried metadata
+    state: CampaignState
+
 # Dice
 class RollRequest(BaseModel):
     sides: int
     private: bool = False
     seed: Optional[int] = None
 
+class ExpressionRollRequest(BaseModel):
+    expression: str # Dice notation, e.g. "4d6kh3" or "d20adv+5"
+    times: int = 1
+
+class BulkRollRequest(BaseModel):
+    rolls: List[ExpressionRollRequest]
+    breakdown: bool = False # Include every die of every roll
+    seed: Optional[int] = None
+    campaign_id: Optional[str] = None # Roll from the campaign's RNG stream (instead of `seed`)
+
+class DiceTermRoll(BaseModel):
+    notation: str
+    sign: int
+    rolls: List[int] # Each die's value (its exploded total for "!" dice)
+    kept: Optional[List[bool]] = None # For keep/drop terms, which dice count
+    subtotal: int
+
+class ExpressionRoll(BaseModel):
+    total: int
+    terms: List[DiceTermRoll]
+
+class ExpressionRollResult(BaseModel):
+    expression: str # Canonical notation
+    times: int
+    totals: List[int]
+    rolls: Optional[List[ExpressionRoll]] = None # With `breakdown`
+    roll: Optional[int] = None # Roll number in the campaign's RNG stream
+    matches: Optional[bool] = None # Replays: whether the logged totals were reproduced
+
+class BulkRollResponse(BaseModel):
+    results: List[ExpressionRollResult]
+    dice_rolled: int
+    campaign_id: Optional[str] = None
+
+class ReplayRollRequest(ExpressionRollRequest):
+    roll: int # Roll number, as returned by /dice/bulk
+    totals: Optional[List[int]] = None # The logged totals, to verify
+
+class ReplayRequest(BaseModel):
+    campaign_id: str
+    rolls: List[ReplayRollRequest]
+    breakdown: bool = False
+
+class ReplayResponse(BaseModel):
+    campaign_id: str
+    results: List[ExpressionRollResult]
+    verified: bool # Every given `totals` matched
+
+class ProbabilityRequest(BaseModel):
+    expression: str
+    modifier: int = 0 # Added to the total, as in rules.check_success
+    distribution: bool = False # Include the full PMF/CDF
+
+class SuccessChance(BaseModel):
+    dc: int
+    probability: float # P(total + modifier >= dc)
+
+class DistributionTable(BaseModel):
+    values: List[int]
+    pmf: List[float]
+    cdf: List[float] # P(total <= value)
+
+class ProbabilityResponse(BaseModel):
+    expression: str
+    modifier: int
+    min: int
+    max: int
+    mean: float
+    stdev: float
+    success: Dict[str, SuccessChance] # Keyed by DIFFICULTY_CLASSES name
+    distribution: Optional[DistributionTable] = None
+
 # AI
 class AICompleteRequest(BaseModel):
     campaign_id: str
@@ -0,0 +1,182 @@
+import asyncio
+import secrets
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from server.core import config, serialization
+from server.core.room_registry import registry
+
+
+class Subscriber:
+    """
+    One connection's view of a room: a bounded queue of serialized events.
+    When the queue is full the subscriber is evicted instead of the publisher
+    waiting; `evicted` is set so the connection can be closed.
+    """
+
+    def __init__(self, user_code: str, queue_size: int):
+        self.user_code = user_code
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(queue_size)
+        self.evicted = asyncio.Event()
+
+    def offer(self, message: str) -> bool:
+        if self.evicted.is_set():
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.evicted.set()
+            return False
+
+
+class _Channel:
+    __slots__ = ("epoch", "seq", "backlog", "subscribers", "idle_since")
+
+    def __init__(self, replay_events: int):
+        # A fresh epoch tells reconnecting clients that sequence numbers restarted (e.g. after a restart).
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.backlog: Deque[Tuple[int, str]] = deque(maxlen=replay_events)
+        self.subscribers: Set[Subscriber] = set()
+        self.idle_since: Optional[float] = None
+
+
+class RoomHub:
+    """
+    In-process publish/subscribe for room events.
+
+    Each room with connected clients has a channel. Publishing numbers the
+    event with the room's next sequence number, serializes it once
+    ({"seq", "type", "data"}) and hands the same text to every subscriber's
+    queue without waiting, so one slow client never holds up the others;
+    a subscriber whose queue is full is evicted. The last
+    ROOM_HUB_REPLAY_EVENTS events are kept, so a client that reconnects with
+    the room's epoch and the last seq it saw gets exactly what it missed.
+
+    Events for rooms nobody is connected to are dropped. Channels outlive
+    their last subscriber by ROOM_HUB_RESUME_WINDOW_SECONDS.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._channels: Dict[str, _Channel] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.resumed = 0
+        self.resyncs = 0
+
+    # --- Publishing ---
+
+    def publish(self, room_code: str, event_type: str, data: Any) -> Optional[int]:
+        """Sends an event to everyone in the room. Returns its seq, or None if nobody is listening."""
+        channel = self._channels.get(room_code)
+        if channel is None:
+            return None
+        channel.seq += 1
+        message = serialization.dumps_str({"seq": channel.seq, "type": event_type, "data": data})
+        channel.backlog.append((channel.seq, message))
+        self.published += 1
+        for subscriber in list(channel.subscribers):
+            if subscriber.offer(message):
+                self.delivered += 1
+            else:
+                self._drop(room_code, channel, subscriber)
+                self.evicted += 1
+        return channel.seq
+
+    def publish_campaign(self, campaign_id: str, event_type: str, data: Any):
+        """Sends an event to every room playing the campaign."""
+        for room_code in registry.rooms_for_campaign(campaign_id):
+            self.publish(room_code, event_type, data)
+
+    # --- Subscribing ---
+
+    def subscribe(self, room_code: str, user_code: str, since_seq: Optional[int] = None,
+                  epoch: Optional[str] = None) -> Tuple[Subscriber, Dict[str, Any], List[str]]:
+        """
+        Joins a room's channel. Returns the subscriber, a hello message
+        ({"type": "hello", "epoch", "seq", "resumed", "online"}) and the
+        backlog to send before the queue. `resumed` is true when the backlog
+        is everything after `since_seq`; otherwise the client should reload
+        the room's state and continue from the hello's `seq`.
+        """
+        channel = self._channels.get(room_code)
+        if channel is None:
+            channel = self._channels[room_code] = _Channel(config.ROOM_HUB_REPLAY_EVENTS)
+        oldest = channel.backlog[0][0] if channel.backlog else channel.seq + 1
+        resumed = (since_seq is not None and epoch == channel.epoch
+                   and oldest - 1 <= since_seq <= channel.seq)
+        backlog = [message for seq, message in channel.backlog if seq > since_seq] if resumed else []
+        if since_seq is not None:
+            if resumed:
+                self.resumed += 1
+            else:
+                self.resyncs += 1
+
+        subscriber = Subscriber(user_code, config.ROOM_HUB_SEND_QUEUE)
+        channel.subscribers.add(subscriber)
+        channel.idle_since = None
+        hello = {"type": "hello", "epoch": channel.epoch, "seq": channel.seq, "resumed": resumed,
+                 "online": self.online(room_code)}
+        return subscriber, hello, backlog
+
+    def unsubscribe(self, room_code: str, subscriber: Subscriber):
+        channel = self._channels.get(room_code)
+        if channel is not None:
+            self._drop(room_code, channel, subscriber)
+
+    def _drop(self, room_code: str, channel: _Channel, subscriber: Subscriber):
+        channel.subscribers.discard(subscriber)
+        if not channel.subscribers and channel.idle_since is None:
+            channel.idle_since = time.monotonic()
+
+    def online(self, room_code: str) -> List[str]:
+        """User codes with at least one live connection to the room."""
+        channel = self._channels.get(room_code)
+        return sorted({s.user_code for s in channel.subscribers}) if channel else []
+
+    # --- Housekeeping ---
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drops channels that have had no subscribers for the resume window. Returns how many."""
+        cutoff = (now or time.monotonic()) - config.ROOM_HUB_RESUME_WINDOW_SECONDS
+        idle = [code for code, channel in self._channels.items()
+                if channel.idle_since is not None and channel.idle_since < cutoff]
+        for code in idle:
+            del self._channels[code]
+        return len(idle)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(config.ROOM_SWEEP_INTERVAL_SECONDS)
+            self.sweep()
+
+    def start(self):
+        """Starts the background sweeper on the running event loop."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rooms": len(self._channels),
+            "connections": sum(len(c.subscribers) for c in self._channels.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "resumed": self.resumed,
+            "resyncs": self.resyncs,
+        }
+
+
+hub = RoomHub()
@@ -0,0 +1,201 @@
+import asyncio
+import random
+import string
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from server.core import cluster, config, storage
+from server.core.models import Room
+
+
+def generate_room_code(length: int = 4) -> str:
+    """Generates a short, user-friendly, base36 room code (uppercase letters + digits)."""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def _epoch(value) -> float:
+    """Converts a stored (naive UTC) datetime or ISO string to epoch seconds."""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RoomRegistry:
+    """
+    Process-wide, in-memory view of all rooms.
+
+    Rooms are held in a dict keyed by room_code, with a secondary
+    insertion-ordered index of public room codes, so lookup, join and the
+    public listing never scan rooms that have been created before. Each
+    change is written through to the storage backend as a single-room
+    update. A background sweeper expires rooms that have been idle for
+    ROOM_IDLE_TTL_SECONDS and periodically asks the backend to fold its
+    change log into a fresh snapshot.
+
+    Lookups refresh a room's idle timer in memory only; creating and joining
+    also persist it as `last_active_at`, so the TTL survives restarts.
+
+    With several workers, each one's registry holds only the rooms it owns
+    (see server/core/cluster.py), and creates rooms with codes it owns.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drops all in-memory state; rooms are reloaded from storage on next use."""
+        self._rooms: Dict[str, Dict] = {}
+        self._public: Dict[str, None] = {}
+        self._by_campaign: Dict[str, Dict[str, None]] = {}
+        self._last_active: Dict[str, float] = {}
+        self._loaded = False
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._changes_since_snapshot = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    # --- Indexing ---
+
+    def _put(self, room: Dict, last_active: float):
+        code = room['room_code']
+        self._rooms[code] = room
+        self._last_active[code] = last_active
+        if room.get('is_public'):
+            self._public[code] = None
+        else:
+            self._public.pop(code, None)
+        if room.get('campaign_id'):
+            self._by_campaign.setdefault(room['campaign_id'], {})[code] = None
+
+    def _remove(self, code: str):
+        room = self._rooms.pop(code, None)
+        self._public.pop(code, None)
+        self._last_active.pop(code, None)
+        if room is not None and room.get('campaign_id'):
+            rooms = self._by_campaign.get(room['campaign_id'], {})
+            rooms.pop(code, None)
+            if not rooms:
+                self._by_campaign.pop(room['campaign_id'], None)
+
+    async def ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for room in await storage.alist_rooms():
+                if not cluster.is_local(room['room_code']):
+                    continue
+                last_active = room.get('last_active_at') or room.get('created_at')
+                self._put(room, _epoch(last_active) if last_active else time.time())
+            self._loaded = True
+
+    async def _persist(self, code: str):
+        """Writes the current state of one room (or its deletion) to storage."""
+        # Persisting the *current* state under a per-room lock keeps storage
+        # correct even if two updates to the same room finish out of order.
+        async with storage.key_lock(f"room:{code}"):
+            room = self._rooms.get(code)
+            if room is not None:
+                await storage.asave_room(room)
+            else:
+                await storage.adelete_room(code)
+        self._changes_since_snapshot += 1
+
+    # --- Public API ---
+
+    async def create(self, host_user_code: str, name: Optional[str], is_public: bool,
+                     campaign_id: Optional[str] = None) -> Dict:
+        await self.ensure_loaded()
+        room_code = generate_room_code()
+        while room_code in self._rooms or not cluster.is_local(room_code):
+            room_code = generate_room_code()
+
+        room = Room(
+            room_code=room_code,
+            host_user_code=host_user_code,
+            name=name or f"Room {room_code}",
+            is_public=is_public,
+            campaign_id=campaign_id,
+            players=[host_user_code] # Host is the first player
+        ).dict()
+        self._put(room, time.time())
+        await self._persist(room_code)
+        return room
+
+    async def get(self, room_code: str) -> Optional[Dict]:
+        await self.ensure_loaded()
+        room = self._rooms.get(room_code)
+        if room is not None:
+            self._last_active[room_code] = time.time()
+        return room
+
+    async def join(self, room_code: str, user_code: str) -> Optional[Dict]:
+        """Adds a player to a room. Returns the room, or None if it doesn't exist."""
+        await self.ensure_loaded()
+        room = self._rooms.get(room_code)
+        if room is None:
+            return None
+        if user_code not in room['players']:
+            room = {**room, 'players': room['players'] + [user_code], 'last_active_at': datetime.utcnow()}
+            self._put(room, time.time())
+            await self._persist(room_code)
+        else:
+            self._last_active[room_code] = time.time()
+        return room
+
+    async def list_public(self) -> List[Dict]:
+        await self.ensure_loaded()
+        return [self._rooms[code] for code in self._public]
+
+    def rooms_for_campaign(self, campaign_id: str) -> List[str]:
+        """Codes of the (loaded) rooms playing a campaign."""
+        return list(self._by_campaign.get(campaign_id, ()))
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    # --- Expiry & snapshots ---
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """Expires idle rooms and compacts storage if enough changes piled up. Returns rooms expired."""
+        await self.ensure_loaded()
+        cutoff = (now or time.time()) - config.ROOM_IDLE_TTL_SECONDS
+        expired = [code for code, last_active in self._last_active.items() if last_active < cutoff]
+        for code in expired:
+            self._remove(code)
+            await self._persist(code)
+
+        if self._changes_since_snapshot >= config.ROOM_SNAPSHOT_EVERY_CHANGES:
+            await self.snapshot()
+        return len(expired)
+
+    async def snapshot(self):
+        self._changes_since_snapshot = 0
+        # Other workers' rooms aren't in memory here; let the backend fold what it has persisted.
+        await storage.acompact_rooms(None if cluster.enabled() else list(self._rooms.values()))
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(config.ROOM_SWEEP_INTERVAL_SECONDS)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Room sweeper failed: {e}")
+
+    def start(self):
+        """Starts the background sweeper on the running event loop."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self._loaded and self._changes_since_snapshot:
+            await self.snapshot()
+
+
+registry = RoomRegistry()
@@ -1,5 +1,9 @@
 import uuid
+import base64
 import hashlib
+import hmac
+import time
+from typing import Optional
 from server.core import config
 
 def generate_user_code() -> str:
@@ -20,3 +24,34 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Verifies a plain password against a hashed one.
     """
     return hash_password(plain_password) == hashed_password
+
+# --- Session Tokens ---
+# A token is "<user_code>.<expiry>.<signature>", where the signature is an
+# HMAC-SHA256 over "<user_code>.<expiry>" keyed from SECRET_KEY. Verifying it
+# is pure CPU work, so authenticated requests don't need to hit storage.
+
+def _session_key() -> bytes:
+    return hashlib.sha256(("session:" + config.SECRET_KEY).encode('utf-8')).digest()
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_session_key(), payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode('ascii')
+
+def create_session_token(user_code: str, ttl_seconds: Optional[int] = None) -> str:
+    """Issues a signed session token for a user, valid for SESSION_TTL_SECONDS."""
+    expires_at = int(time.time()) + (ttl_seconds if ttl_seconds is not None else config.SESSION_TTL_SECONDS)
+    payload = f"{user_code}.{expires_at}"
+    return f"{payload}.{_sign(payload)}"
+
+def verify_session_token(token: str) -> Optional[str]:
+    """Returns the user_code of a valid, unexpired token, or None."""
+    try:
+        user_code, expires_at, signature = token.split(".")
+        if int(expires_at) < time.time():
+            return None
+    except ValueError:
+        return None
+    # Compared as bytes: compare_digest rejects str with non-ASCII characters.
+    if not hmac.compare_digest(signature.encode('utf-8'), _sign(f"{user_code}.{expires_at}").encode('ascii')):
+        return None
+    return user_code
@@ -0,0 +1,50 @@
+import json
+import uuid
+from datetime import date, datetime, time
+from typing import Any
+
+try:
+    import orjson
+except ImportError: # Optional: falls back to the standard library
+    orjson = None
+
+# --- JSON serialization ---
+# Every JSON document the server writes to disk or sends over the wire goes
+# through dumps()/loads() here. Output is compact UTF-8 bytes unless
+# `pretty=True`. Datetimes are written as ISO 8601 and UUIDs as plain
+# strings. orjson is used when it is installed; the standard library
+# produces the same documents, only slower.
+
+
+def _default(value: Any) -> Any:
+    """Encodes the types the JSON encoders don't handle natively."""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, "model_dump"): # Pydantic models
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def dumps(data: Any, pretty: bool = False) -> bytes:
+    """Serializes `data` to JSON bytes (compact unless `pretty`)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, default=_default, option=option)
+    if pretty:
+        return json.dumps(data, default=_default, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(data: Any, pretty: bool = False) -> str:
+    return dumps(data, pretty).decode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    """Parses JSON from bytes or str. Raises ValueError on malformed input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,11 +1,24 @@
-import json
+import asyncio
+import base64
+import bisect
+import hashlib
+import os
+import shutil
+import time
 import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 import filelock
 
-from server.core import config
+from server.core import checkpoints, config, journal, metrics, serialization, summaries
+from server.core.cache import LRUCache
 from server.core.models import UserProfile
+from server.game_logic import state as game_state
 
 # --- Path Helpers ---
 
@@ -31,77 +44,956 @@ def get_campaigns_dir(user_code: str) -> Optional[Path]:
     user_dir = get_user_dir(user_code)
     return user_dir / "campaigns" if user_dir else None
 
-def get_campaign_meta_file(user_code: str, campaign_id: str) -> Optional[Path]:
+def get_campaign_dir(user_code: str, campaign_id: str) -> Optional[Path]:
     try:
         uuid.UUID(campaign_id)
         campaigns_dir = get_campaigns_dir(user_code)
-        return campaigns_dir / f"camp_{campaign_id}" / "meta.json" if campaigns_dir else None
+        return campaigns_dir / f"camp_{campaign_id}" if campaigns_dir else None
     except ValueError:
         return None
 
-def get_campaign_journal_file(user_code: str, campaign_id: str) -> Optional[Path]:
+def is_valid_id(value: str) -> bool:
+    """True if `value` is a UUID string (user codes and campaign IDs)."""
     try:
-        uuid.UUID(campaign_id)
-        campaigns_dir = get_campaigns_dir(user_code)
-        return campaigns_dir / f"camp_{campaign_id}" / "journal.json" if campaigns_dir else None
-    except ValueError:
-        return None
+        uuid.UUID(value)
+        return True
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+def get_campaign_meta_file(user_code: str, campaign_id: str) -> Optional[Path]:
+    campaign_dir = get_campaign_dir(user_code, campaign_id)
+    return campaign_dir / "meta.json" if campaign_dir else None
 
 # --- Generic Read/Write with Locking ---
 
+# Parsed JSON documents keyed by path. Each entry remembers the (mtime, size)
+# of the file it was parsed from, so edits made outside this process are
+# picked up on the next read. Cached values are shared between callers and
+# must not be mutated in place.
+_read_cache = LRUCache(config.STORAGE_CACHE_ENTRIES)
+
+# The histograms' _count doubles as the number of reads and writes.
+_JSON_READ_SECONDS = metrics.Histogram(
+    "neuro_dnd_storage_json_read_seconds",
+    "Duration of storage.read_json calls: from the read cache (hit), parsed from disk (miss), or no such file (absent).",
+    ("result",), metrics.STORAGE_BUCKETS)
+_JSON_READ_BYTES = metrics.Counter("neuro_dnd_storage_json_read_bytes_total", "Bytes of JSON read from disk.")
+_JSON_WRITE_BYTES = metrics.Counter("neuro_dnd_storage_json_write_bytes_total", "Bytes of JSON written to disk.")
+_JSON_WRITE_SECONDS = metrics.Histogram(
+    "neuro_dnd_storage_json_write_seconds", "Time to serialize and write a JSON document, once its lock is held.",
+    buckets=metrics.STORAGE_BUCKETS)
+_LOCK_WAIT_SECONDS = metrics.Histogram(
+    "neuro_dnd_storage_lock_wait_seconds",
+    "Time spent waiting for storage locks: cross-process file locks (file) and per-key asyncio locks (key).",
+    ("lock",), metrics.STORAGE_BUCKETS)
+
 def read_json(file_path: Path) -> Optional[Any]:
     """Reads a JSON file and returns its content. Returns None if file doesn't exist."""
-    if not file_path.exists():
+    start = time.perf_counter()
+    key = str(file_path)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        _read_cache.pop(key)
+        _JSON_READ_SECONDS.observe(time.perf_counter() - start, ("absent",))
         return None
-    with open(file_path, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return None # Or handle corrupted file case
+
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _read_cache.get(key)
+    if cached is not None and cached[0] == version:
+        _JSON_READ_SECONDS.observe(time.perf_counter() - start, ("hit",))
+        return cached[1]
+
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    _JSON_READ_BYTES.inc(len(raw))
+    try:
+        data = serialization.loads(raw)
+    except ValueError:
+        return None # Or handle corrupted file case
+    finally:
+        _JSON_READ_SECONDS.observe(time.perf_counter() - start, ("miss",))
+
+    if stat.st_size <= config.STORAGE_CACHE_MAX_FILE_BYTES:
+        _read_cache.set(key, (version, data))
+    return data
+
+def _write_json_unlocked(file_path: Path, data: Any):
+    start = time.perf_counter()
+    raw = serialization.dumps(data, pretty=config.STORAGE_PRETTY_JSON)
+    # Readers never see a half-written file: write aside, then swap it in.
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, file_path)
+    _read_cache.pop(str(file_path))
+    _JSON_WRITE_BYTES.inc(len(raw))
+    _JSON_WRITE_SECONDS.observe(time.perf_counter() - start)
+
+@contextmanager
+def _file_lock(file_path: Path) -> Iterator[None]:
+    """Holds the cross-process lock of a file (recording how long it took to get)."""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with filelock.FileLock(file_path.with_suffix('.lock')):
+        _LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, ("file",))
+        yield
 
 def write_json(file_path: Path, data: Any):
     """Writes data to a JSON file with file locking to prevent race conditions."""
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    lock_path = file_path.with_suffix('.lock')
-    lock = filelock.FileLock(lock_path)
+    with _file_lock(file_path):
+        _write_json_unlocked(file_path, data)
+
+def update_json(file_path: Path, updater: Callable[[Optional[Any]], Any]) -> Any:
+    """
+    Reads a JSON file, passes its content (or None) to `updater` and writes
+    back whatever it returns, holding the file lock for the whole sequence.
+    `updater` must not modify its argument in place; returning the argument
+    itself means "no change" and skips the write. Returns the new data.
+    """
+    with _file_lock(file_path):
+        current = read_json(file_path)
+        data = updater(current)
+        if data is not current:
+            _write_json_unlocked(file_path, data)
+        return data
+
+def get_read_cache_stats() -> Dict[str, int]:
+    """Returns hit/miss/eviction counters of the read cache."""
+    return _read_cache.stats()
+
+def clear_read_cache():
+    _read_cache.clear()
+
+# --- Campaign Pagination ---
+# Campaign pages are addressed with keyset cursors: the sort value and id of
+# the last campaign on the previous page, so pages stay stable while
+# campaigns are created or deleted in between.
+
+CAMPAIGN_SORT_FIELDS = ("created_at", "status", "tone")
+
+def sort_timestamp(value: Any) -> Optional[str]:
+    """Normalizes datetimes and ISO strings so they sort consistently as text."""
+    if value is None:
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value).replace(" ", "T", 1)
+
+def campaign_sort_value(meta: Dict, sort: str) -> str:
+    value = meta.get(sort)
+    if sort == "created_at":
+        value = sort_timestamp(value)
+    return value or ""
+
+def encode_campaign_cursor(sort: str, descending: bool, value: str, campaign_id: str) -> str:
+    raw = serialization.dumps([sort, descending, value, str(campaign_id)])
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_campaign_cursor(cursor: str, sort: str, descending: bool) -> Tuple[str, str]:
+    """Returns the (sort value, campaign id) a cursor points after."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, value, campaign_id = serialization.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError("Cursor was issued for a different sort order")
+    return str(value), str(campaign_id)
+
+def paginate_campaign_metas(metas: List[Dict], status: Optional[str], tone: Optional[str], sort: str,
+                            descending: bool, cursor: Optional[str], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """In-memory implementation of StorageBackend.query_campaign_metas."""
+    if sort not in CAMPAIGN_SORT_FIELDS:
+        raise ValueError(f"Unknown sort field: {sort!r}")
+    keyed = [
+        ((campaign_sort_value(meta, sort), str(meta["id"])), meta) for meta in metas
+        if (status is None or meta.get("status") == status) and (tone is None or meta.get("tone") == tone)
+    ]
+    if cursor:
+        after = decode_campaign_cursor(cursor, sort, descending)
+        keyed = [item for item in keyed if (item[0] < after if descending else item[0] > after)]
+    keyed.sort(key=lambda item: item[0], reverse=descending)
+
+    page = keyed[:limit]
+    next_cursor = None
+    if len(keyed) > limit and page:
+        (value, campaign_id), _ = page[-1]
+        next_cursor = encode_campaign_cursor(sort, descending, value, campaign_id)
+    return [meta for _, meta in page], next_cursor
+
+# --- Storage Backends ---
+# Everything above is the low-level JSON file layer. The rest of the app talks
+# to a StorageBackend, chosen by config.STORAGE_BACKEND:
+#   "json"   - the data/ directory tree (JsonFileBackend, below)
+#   "sqlite" - a single SQLite database in WAL mode (server/core/storage_sqlite.py)
+# Records are passed around as plain dicts, the same shape as the JSON files.
+# All backend methods are blocking; async handlers use the wrappers at the end
+# of this module.
+
+class StorageBackend:
+    """Interface implemented by all storage backends."""
+
+    # Users
+    def user_exists(self, user_code: str) -> bool:
+        raise NotImplementedError
+
+    def get_user_profile(self, user_code: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_user_profile(self, profile: Dict):
+        """Creates or replaces a profile, keyed by profile["user_code"]."""
+        raise NotImplementedError
+
+    def delete_user_profile(self, user_code: str):
+        """Removes a profile that was never registered (its email was taken)."""
+        raise NotImplementedError
+
+    def find_user_code_by_email(self, email: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def add_user_to_index(self, email: str, user_code: str, username: str) -> bool:
+        """Maps an email to a user, unless it is already taken. Returns False on conflict."""
+        raise NotImplementedError
+
+    def get_user_settings(self, user_code: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_user_settings(self, user_code: str, settings: Dict):
+        raise NotImplementedError
+
+    # Campaigns
+    def list_campaign_metas(self, user_code: str) -> List[Dict]:
+        raise NotImplementedError
+
+    def query_campaign_metas(self, user_code: str, status: Optional[str] = None, tone: Optional[str] = None,
+                             sort: str = "created_at", descending: bool = True,
+                             cursor: Optional[str] = None, limit: int = 50) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of a user's campaigns, filtered and sorted, and the
+        cursor of the next page (None on the last page). Raises ValueError
+        for a cursor that wasn't issued for the same sort.
+        """
+        return paginate_campaign_metas(
+            self.list_campaign_metas(user_code), status, tone, sort, descending, cursor, limit,
+        )
+
+    def get_campaign_meta(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_campaign_meta(self, user_code: str, meta: Dict):
+        """Creates or replaces a campaign's meta, keyed by meta["id"]."""
+        raise NotImplementedError
+
+    def delete_campaign(self, user_code: str, campaign_id: str) -> bool:
+        """Deletes a campaign with its journal and checkpoints. False if it didn't exist."""
+        raise NotImplementedError
+
+    # Checkpoints
+    # Checkpoint policy lives in server/core/checkpoints.py; backends store
+    # index records (dicts with at least "name", "seq" and "created_at") and
+    # opaque payloads.
+    def list_checkpoints(self, user_code: str, campaign_id: str) -> List[Dict]:
+        """Returns the campaign's checkpoint records, oldest first (by seq, then created_at)."""
+        raise NotImplementedError
+
+    def save_checkpoint(self, user_code: str, campaign_id: str, info: Dict, payload: bytes) -> str:
+        """Creates or replaces the checkpoint info["name"]. Returns a description of where it went."""
+        raise NotImplementedError
+
+    def read_checkpoint(self, user_code: str, campaign_id: str, name: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def delete_checkpoints(self, user_code: str, campaign_id: str, names: List[str]):
+        raise NotImplementedError
+
+    def checkpoint_location(self, user_code: str, campaign_id: str, name: str) -> str:
+        raise NotImplementedError
+
+    # Journals
+    def create_journal(self, user_code: str, campaign_id: str):
+        raise NotImplementedError
+
+    def read_journal(self, user_code: str, campaign_id: str,
+                     start: int = 0, stop: Optional[int] = None) -> Optional[List[Dict]]:
+        """Returns entries with sequence numbers in [start, stop), or None if there is no journal."""
+        raise NotImplementedError
+
+    def journal_length(self, user_code: str, campaign_id: str) -> Optional[int]:
+        """Returns the number of entries (= the next sequence number), or None if there is no journal."""
+        raise NotImplementedError
+
+    def append_journal_entry(self, user_code: str, campaign_id: str, entry: Dict) -> Optional[Dict]:
+        """
+        Appends one entry. Returns {"seq": <sequence number of the entry>,
+        "needs_compaction": bool}, or None if the campaign has no journal.
+        """
+        return self.append_journal_entries(user_code, campaign_id, [entry])
+
+    def append_journal_entries(self, user_code: str, campaign_id: str, entries: List[Dict]) -> Optional[Dict]:
+        """
+        Appends entries all together or not at all. Returns {"seq": <sequence
+        number of the first entry>, "needs_compaction": bool}, or None if the
+        campaign has no journal.
+        """
+        raise NotImplementedError
+
+    def truncate_journal(self, user_code: str, campaign_id: str, length: int):
+        """Drops all entries with a sequence number >= length."""
+        raise NotImplementedError
+
+    def replace_journal(self, user_code: str, campaign_id: str, entries: List[Dict]):
+        """Replaces the whole journal (creating it if needed)."""
+        raise NotImplementedError
+
+    def compact_journal(self, user_code: str, campaign_id: str):
+        """Background maintenance after appends. Optional."""
+
+    # Journal summaries
+    # Rolling summaries for the AI context (see server/core/summaries.py).
+    # Derived data: truncating or replacing a journal must drop the parts
+    # that no longer match it.
+    def get_journal_summary(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_journal_summary(self, user_code: str, campaign_id: str, summary: Dict):
+        raise NotImplementedError
+
+    # Campaign state
+    # Snapshots of the game state folded from the journal (see
+    # server/game_logic/state.py). Derived data, like summaries: truncating or
+    # replacing a journal must reset a snapshot that is ahead of it.
+    def get_campaign_state(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_campaign_state(self, user_code: str, campaign_id: str, snapshot: Dict):
+        raise NotImplementedError
+
+    # Dice streams
+    # A campaign's RNG stream is a secret key and a count of the rolls issued
+    # from it (see server/game_logic/rng.py). The count only moves forward and
+    # isn't part of checkpoints, so no roll number is ever issued twice.
+    def reserve_rolls(self, user_code: str, campaign_id: str, count: int, new_key: str) -> Optional[Dict]:
+        """
+        Atomically reserves the next `count` roll numbers, creating the stream
+        with `new_key` on first use. Returns {"key", "first"}, or None if the
+        campaign doesn't exist.
+        """
+        raise NotImplementedError
+
+    def get_rng_stream(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        """Returns {"key", "counter"} (the number of rolls issued), or None if no roll was made yet."""
+        raise NotImplementedError
+
+    # Rooms
+    # Live room state is owned by the in-memory registry (server/core/room_registry.py);
+    # the backend only needs to load everything at startup and persist single changes.
+    def list_rooms(self) -> List[Dict]:
+        raise NotImplementedError
+
+    def save_room(self, room: Dict):
+        """Creates or replaces a room, keyed by room["room_code"]."""
+        raise NotImplementedError
+
+    def delete_room(self, room_code: str):
+        raise NotImplementedError
+
+    def compact_rooms(self, rooms: Optional[List[Dict]] = None):
+        """
+        Optional: rewrites persisted room state from a full copy of it (or,
+        with None, from what is persisted). Backends that log changes use
+        this to fold the log into a snapshot.
+        """
+
+
+class JsonFileBackend(StorageBackend):
+    """The original data/ tree: one directory per user, JSON files everywhere."""
+
+    # Users
+    def user_exists(self, user_code: str) -> bool:
+        profile_path = get_user_profile_file(user_code)
+        return bool(profile_path) and profile_path.exists()
+
+    def get_user_profile(self, user_code: str) -> Optional[Dict]:
+        profile_path = get_user_profile_file(user_code)
+        return read_json(profile_path) if profile_path else None
+
+    def save_user_profile(self, profile: Dict):
+        write_json(get_user_profile_file(profile["user_code"]), profile)
+
+    def delete_user_profile(self, user_code: str):
+        user_dir = get_user_dir(user_code)
+        if user_dir:
+            _read_cache.pop(str(get_user_profile_file(user_code)))
+            shutil.rmtree(user_dir, ignore_errors=True)
+
+    # The email index is split into shard files under USER_INDEX_DIR, picked
+    # by a hash prefix of the email. A lookup parses one small (usually
+    # cached) file, and an update locks and rewrites only that shard, so both
+    # stay cheap as the number of users grows. The legacy monolithic
+    # index.json is folded into the shards on first use.
+
+    _index_ready_dir: Optional[Path] = None
+
+    def _index_shard(self, email: str) -> Path:
+        digest = hashlib.blake2b(email.encode('utf-8'), digest_size=8).hexdigest()
+        return config.USER_INDEX_DIR / f"{digest[:config.USER_INDEX_SHARD_PREFIX]}.json"
+
+    def _ensure_index(self):
+        if self._index_ready_dir == config.USER_INDEX_DIR:
+            return
+        marker = config.USER_INDEX_DIR / "_meta.json"
+        if not marker.exists():
+            with _file_lock(marker):
+                if not marker.exists():
+                    legacy = read_json(config.INDEX_FILE) or {}
+                    by_shard: Dict[Path, Dict] = {}
+                    for email, entry in legacy.get("users", {}).items():
+                        by_shard.setdefault(self._index_shard(email), {})[email] = entry
+                    for shard_path, entries in by_shard.items():
+                        update_json(shard_path, lambda shard: {**entries, **(shard or {})})
+                    _write_json_unlocked(marker, {"version": 1, "shard_prefix": config.USER_INDEX_SHARD_PREFIX})
+        self._index_ready_dir = config.USER_INDEX_DIR
+
+    def find_user_code_by_email(self, email: str) -> Optional[str]:
+        self._ensure_index()
+        entry = (read_json(self._index_shard(email)) or {}).get(email)
+        return entry.get("user_code") if entry else None
+
+    def add_user_to_index(self, email: str, user_code: str, username: str) -> bool:
+        self._ensure_index()
+
+        def add(shard):
+            shard = shard or {}
+            if email in shard:
+                return shard
+            # Copy before modifying: the parsed shard may be shared through the read cache.
+            return {**shard, email: {"user_code": user_code, "username": username}}
+
+        return update_json(self._index_shard(email), add).get(email, {}).get("user_code") == user_code
+
+    def get_user_settings(self, user_code: str) -> Optional[Dict]:
+        settings_path = get_user_settings_file(user_code)
+        return read_json(settings_path) if settings_path else None
+
+    def save_user_settings(self, user_code: str, settings: Dict):
+        write_json(get_user_settings_file(user_code), settings)
+
+    # Campaigns
+    # Each user has a campaign manifest (campaigns/manifest.json) holding a
+    # copy of every campaign's meta, kept up to date by save_campaign_meta and
+    # delete_campaign. Listing reads this one (usually cached) file instead of
+    # opening every meta.json. Users from before the manifest existed get one
+    # built from their campaign directories on first use.
+    def _campaign_manifest_file(self, user_code: str) -> Optional[Path]:
+        campaigns_dir = get_campaigns_dir(user_code)
+        return campaigns_dir / "manifest.json" if campaigns_dir else None
+
+    def _scan_campaign_metas(self, user_code: str) -> Dict:
+        metas = {}
+        for camp_dir in get_campaigns_dir(user_code).iterdir():
+            if camp_dir.is_dir():
+                meta_data = read_json(camp_dir / "meta.json")
+                if meta_data:
+                    metas[str(meta_data["id"])] = meta_data
+        return {"version": 1, "campaigns": metas}
 
-    with lock:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str) # Use default=str for datetime/uuid
+    def _update_campaign_manifest(self, user_code: str, campaign_id: str, meta: Optional[Dict]):
+        """Puts (or with meta=None, removes) one campaign in the user's manifest."""
+        def update(manifest):
+            if manifest is None:
+                return self._scan_campaign_metas(user_code) # Already reflects this change
+            campaigns = dict(manifest["campaigns"])
+            if meta is None:
+                campaigns.pop(campaign_id, None)
+            else:
+                campaigns[campaign_id] = meta
+            return {**manifest, "campaigns": campaigns}
+        update_json(self._campaign_manifest_file(user_code), update)
+
+    def list_campaign_metas(self, user_code: str) -> List[Dict]:
+        campaigns_dir = get_campaigns_dir(user_code)
+        if not campaigns_dir or not campaigns_dir.exists():
+            return []
+
+        manifest_file = self._campaign_manifest_file(user_code)
+        manifest = read_json(manifest_file)
+        if manifest is None:
+            manifest = update_json(
+                manifest_file,
+                lambda current: current if current is not None else self._scan_campaign_metas(user_code),
+            )
+        return list(manifest["campaigns"].values())
+
+    def get_campaign_meta(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        meta_path = get_campaign_meta_file(user_code, campaign_id)
+        return read_json(meta_path) if meta_path else None
+
+    def save_campaign_meta(self, user_code: str, meta: Dict):
+        write_json(get_campaign_meta_file(user_code, str(meta["id"])), meta)
+        self._update_campaign_manifest(user_code, str(meta["id"]), meta)
+
+    def delete_campaign(self, user_code: str, campaign_id: str) -> bool:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        if not campaign_dir or not campaign_dir.is_dir():
+            return False
+        shutil.rmtree(campaign_dir)
+        self._update_campaign_manifest(user_code, campaign_id, None)
+        return True
+
+    # Checkpoints
+    # checkpoints/index.json lists the records; each payload is a file next to it.
+    # (Full-copy checkpoints written by older versions are left where they are.)
+    def _checkpoints_dir(self, user_code: str, campaign_id: str) -> Path:
+        return get_campaign_dir(user_code, campaign_id) / "checkpoints"
+
+    def _checkpoint_file(self, user_code: str, campaign_id: str, name: str) -> Path:
+        return self._checkpoints_dir(user_code, campaign_id) / f"{name}.ckpt"
+
+    def list_checkpoints(self, user_code: str, campaign_id: str) -> List[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        index = read_json(campaign_dir / "checkpoints" / "index.json") if campaign_dir else None
+        return list(index["checkpoints"]) if index else []
+
+    def save_checkpoint(self, user_code: str, campaign_id: str, info: Dict, payload: bytes) -> str:
+        checkpoint_file = self._checkpoint_file(user_code, campaign_id, info["name"])
+        checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = checkpoint_file.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, checkpoint_file)
+
+        def add(index):
+            records = [r for r in (index or {}).get("checkpoints", []) if r["name"] != info["name"]]
+            records.append(info)
+            records.sort(key=lambda r: (r["seq"], r["created_at"]))
+            return {"version": 1, "checkpoints": records}
+        update_json(checkpoint_file.parent / "index.json", add)
+        return str(checkpoint_file)
+
+    def read_checkpoint(self, user_code: str, campaign_id: str, name: str) -> Optional[bytes]:
+        try:
+            with open(self._checkpoint_file(user_code, campaign_id, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_checkpoints(self, user_code: str, campaign_id: str, names: List[str]):
+        doomed = set(names)
+        def remove(index):
+            if index is None:
+                return index
+            return {**index, "checkpoints": [r for r in index["checkpoints"] if r["name"] not in doomed]}
+        update_json(self._checkpoints_dir(user_code, campaign_id) / "index.json", remove)
+        for name in doomed:
+            try:
+                self._checkpoint_file(user_code, campaign_id, name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def checkpoint_location(self, user_code: str, campaign_id: str, name: str) -> str:
+        return str(self._checkpoint_file(user_code, campaign_id, name))
+
+    # Journals
+    # Journals are stored as segmented append-only logs (see server/core/journal.py).
+    # Legacy single-file `journal.json` journals are migrated on first access.
+    def create_journal(self, user_code: str, campaign_id: str):
+        journal.create_journal(get_campaign_dir(user_code, campaign_id))
+
+    def read_journal(self, user_code: str, campaign_id: str,
+                     start: int = 0, stop: Optional[int] = None) -> Optional[List[Dict]]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        return journal.read_entries(campaign_dir, start, stop) if campaign_dir else None
+
+    def journal_length(self, user_code: str, campaign_id: str) -> Optional[int]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        return journal.entry_count(campaign_dir) if campaign_dir else None
+
+    def append_journal_entries(self, user_code: str, campaign_id: str, entries: List[Dict]) -> Optional[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        # One manifest write makes the whole batch visible at once.
+        manifest = journal.append_entries(campaign_dir, entries) if campaign_dir else None
+        if manifest is None:
+            return None
+        return {"seq": manifest["next_seq"] - len(entries), "needs_compaction": journal.needs_compaction(manifest)}
+
+    def truncate_journal(self, user_code: str, campaign_id: str, length: int):
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        journal.truncate(campaign_dir, length)
+        update_json(self._summary_file(campaign_dir), lambda summary: summaries.trim(summary, length))
+        update_json(self._state_file(campaign_dir), lambda snapshot: game_state.trim(snapshot, length))
+
+    def replace_journal(self, user_code: str, campaign_id: str, entries: List[Dict]):
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        journal.replace_entries(campaign_dir, entries)
+        update_json(self._summary_file(campaign_dir), lambda summary: summaries.trim(summary, 0))
+        update_json(self._state_file(campaign_dir), lambda snapshot: game_state.trim(snapshot, 0))
+
+    def compact_journal(self, user_code: str, campaign_id: str):
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        if campaign_dir:
+            journal.compact(campaign_dir)
+
+    # Journal summaries
+    # journal/summary.json, next to the journal's manifest.
+    def _summary_file(self, campaign_dir: Path) -> Path:
+        return journal.get_journal_dir(campaign_dir) / "summary.json"
+
+    def get_journal_summary(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        return read_json(self._summary_file(campaign_dir)) if campaign_dir else None
+
+    def save_journal_summary(self, user_code: str, campaign_id: str, summary: Dict):
+        write_json(self._summary_file(get_campaign_dir(user_code, campaign_id)), summary)
+
+    # Campaign state
+    # journal/state.json, next to the summaries.
+    def _state_file(self, campaign_dir: Path) -> Path:
+        return journal.get_journal_dir(campaign_dir) / "state.json"
+
+    def get_campaign_state(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        return read_json(self._state_file(campaign_dir)) if campaign_dir else None
+
+    def save_campaign_state(self, user_code: str, campaign_id: str, snapshot: Dict):
+        write_json(self._state_file(get_campaign_dir(user_code, campaign_id)), snapshot)
+
+    # Dice streams
+    # rng.json in the campaign directory (not under journal/: it isn't derived from the journal).
+    def _rng_file(self, campaign_dir: Path) -> Path:
+        return campaign_dir / "rng.json"
+
+    def reserve_rolls(self, user_code: str, campaign_id: str, count: int, new_key: str) -> Optional[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        if not campaign_dir or not (campaign_dir / "meta.json").exists():
+            return None
+        reserved = {}
+
+        def advance(stream):
+            stream = stream or {"key": new_key, "counter": 0}
+            reserved.update(key=stream["key"], first=stream["counter"])
+            return {**stream, "counter": stream["counter"] + count}
+
+        update_json(self._rng_file(campaign_dir), advance)
+        return reserved
+
+    def get_rng_stream(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        campaign_dir = get_campaign_dir(user_code, campaign_id)
+        return read_json(self._rng_file(campaign_dir)) if campaign_dir else None
+
+    # Rooms
+    # Rooms are kept as a snapshot (rooms.json, the original list format) plus
+    # an append-only log of changes (rooms.delta.jsonl), so persisting one
+    # room costs one appended line. compact_rooms() folds the log back into
+    # the snapshot.
+    def _rooms_delta_file(self) -> Path:
+        return config.ROOMS_FILE.with_suffix(".delta.jsonl")
+
+    def list_rooms(self) -> List[Dict]:
+        rooms = {r['room_code']: r for r in read_json(config.ROOMS_FILE) or []}
+        try:
+            with open(self._rooms_delta_file(), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        change = serialization.loads(line)
+                    except ValueError:
+                        continue # A torn line from an interrupted append
+                    if change["op"] == "put":
+                        rooms[change["room"]["room_code"]] = change["room"]
+                    else:
+                        rooms.pop(change["room_code"], None)
+        except FileNotFoundError:
+            pass
+        return list(rooms.values())
+
+    def _append_room_change(self, change: Dict):
+        line = serialization.dumps(change) + b"\n"
+        with _file_lock(config.ROOMS_FILE):
+            with open(self._rooms_delta_file(), 'a+b') as f:
+                # Start on a fresh line if a previous append was cut short.
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+
+    def save_room(self, room: Dict):
+        self._append_room_change({"op": "put", "room": room})
+
+    def delete_room(self, room_code: str):
+        self._append_room_change({"op": "del", "room_code": room_code})
+
+    def compact_rooms(self, rooms: Optional[List[Dict]] = None):
+        with _file_lock(config.ROOMS_FILE):
+            if rooms is None:
+                rooms = self.list_rooms()
+            _write_json_unlocked(config.ROOMS_FILE, rooms)
+            open(self._rooms_delta_file(), 'wb').close()
+
+    # Enumeration, used by the migration command
+    def iter_user_codes(self) -> Iterator[str]:
+        if not config.USERS_DIR.exists():
+            return
+        for user_dir in config.USERS_DIR.iterdir():
+            if user_dir.is_dir() and user_dir.name.startswith("user_"):
+                yield user_dir.name[len("user_"):]
+
+    def iter_index(self) -> Iterator[Tuple[str, Dict]]:
+        self._ensure_index()
+        for shard_path in sorted(config.USER_INDEX_DIR.glob("*.json")):
+            if shard_path.name != "_meta.json":
+                yield from (read_json(shard_path) or {}).items()
+
+    def iter_checkpoints(self, user_code: str, campaign_id: str) -> Iterator[Tuple[Dict, bytes]]:
+        for info in self.list_checkpoints(user_code, campaign_id):
+            payload = self.read_checkpoint(user_code, campaign_id, info["name"])
+            if payload is not None:
+                yield info, payload
+
+
+_backend: Optional[StorageBackend] = None
+
+def create_backend(kind: str) -> StorageBackend:
+    if kind == "json":
+        return JsonFileBackend()
+    if kind == "sqlite":
+        from server.core.storage_sqlite import SqliteBackend
+        return SqliteBackend(config.SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {kind!r}. Expected 'json' or 'sqlite'.")
+
+def get_backend() -> StorageBackend:
+    """Returns the process-wide storage backend selected by config.STORAGE_BACKEND."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend(config.STORAGE_BACKEND)
+    return _backend
+
+def set_backend(backend: Optional[StorageBackend]):
+    """Replaces the process-wide backend (None re-reads the config on next use)."""
+    global _backend
+    _backend = backend
 
 # --- User Management ---
 
 def find_user_by_email(email: str) -> Optional[UserProfile]:
     """Finds a user by email by checking the global index."""
-    index = read_json(config.INDEX_FILE)
-    if not index or 'users' not in index:
+    backend = get_backend()
+    user_code = backend.find_user_code_by_email(email)
+    if user_code:
+        profile_data = backend.get_user_profile(user_code)
+        if profile_data:
+            return UserProfile(**profile_data)
+    return None
+
+def add_user_to_index(user_profile: UserProfile) -> bool:
+    """Claims the user's email in the global index. Returns False if it is already taken."""
+    return get_backend().add_user_to_index(user_profile.email, user_profile.user_code, user_profile.username)
+
+# --- Async API ---
+# Route handlers are `async def`, so they must not touch the disk directly.
+# These wrappers run the blocking backend methods on a bounded thread pool.
+# Writers to the same record are serialized with keyed asyncio locks first,
+# so contention inside this process queues on the event loop instead of
+# parking pool threads on a file or database lock (those are still taken
+# inside the worker thread and guard against other processes).
+
+_io_executor = ThreadPoolExecutor(
+    max_workers=config.STORAGE_IO_THREADS, thread_name_prefix="storage-io"
+)
+_key_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Runs a blocking function on the storage I/O thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, partial(func, *args, **kwargs))
+
+@asynccontextmanager
+async def key_lock(key: str):
+    """Keyed asyncio lock for read-modify-write sequences within this process."""
+    lock = _key_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _key_locks[key] = lock
+    start = time.perf_counter()
+    async with lock:
+        _LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, ("key",))
+        yield
+
+async def aread_json(file_path: Path) -> Optional[Any]:
+    return await run_blocking(read_json, file_path)
+
+async def awrite_json(file_path: Path, data: Any):
+    async with key_lock(str(file_path)):
+        await run_blocking(write_json, file_path, data)
+
+async def aupdate_json(file_path: Path, updater: Callable[[Optional[Any]], Any]) -> Any:
+    async with key_lock(str(file_path)):
+        return await run_blocking(update_json, file_path, updater)
+
+# Users
+async def auser_exists(user_code: str) -> bool:
+    return await run_blocking(get_backend().user_exists, user_code)
+
+async def aget_user_profile(user_code: str) -> Optional[Dict]:
+    return await run_blocking(get_backend().get_user_profile, user_code)
+
+async def asave_user_profile(profile: Dict):
+    async with key_lock(f"user:{profile['user_code']}"):
+        await run_blocking(get_backend().save_user_profile, profile)
+
+async def adelete_user_profile(user_code: str):
+    async with key_lock(f"user:{user_code}"):
+        await run_blocking(get_backend().delete_user_profile, user_code)
+
+async def afind_user_by_email(email: str) -> Optional[UserProfile]:
+    return await run_blocking(find_user_by_email, email)
+
+async def aadd_user_to_index(user_profile: UserProfile) -> bool:
+    async with key_lock(f"email:{user_profile.email}"):
+        return await run_blocking(add_user_to_index, user_profile)
+
+async def aget_user_settings(user_code: str) -> Optional[Dict]:
+    return await run_blocking(get_backend().get_user_settings, user_code)
+
+async def asave_user_settings(user_code: str, settings: Dict):
+    async with key_lock(f"settings:{user_code}"):
+        await run_blocking(get_backend().save_user_settings, user_code, settings)
+
+# Campaigns
+async def alist_campaign_metas(user_code: str) -> List[Dict]:
+    return await run_blocking(get_backend().list_campaign_metas, user_code)
+
+async def aquery_campaign_metas(user_code: str, **query) -> Tuple[List[Dict], Optional[str]]:
+    return await run_blocking(get_backend().query_campaign_metas, user_code, **query)
+
+async def aget_campaign_meta(user_code: str, campaign_id: str) -> Optional[Dict]:
+    return await run_blocking(get_backend().get_campaign_meta, user_code, campaign_id)
+
+async def asave_campaign_meta(user_code: str, meta: Dict):
+    async with key_lock(f"campaign:{meta['id']}"):
+        await run_blocking(get_backend().save_campaign_meta, user_code, meta)
+
+async def aupdate_campaign_meta(user_code: str, campaign_id: str, changes: Dict) -> Optional[Dict]:
+    """Applies `changes` to a campaign's meta. Returns the new meta, or None if there is no such campaign."""
+    async with key_lock(f"campaign:{campaign_id}"):
+        backend = get_backend()
+        meta = await run_blocking(backend.get_campaign_meta, user_code, campaign_id)
+        if meta is None:
+            return None
+        meta = {**meta, **changes}
+        await run_blocking(backend.save_campaign_meta, user_code, meta)
+        return meta
+
+# Restoring or deleting a campaign also waits for summary and state updates
+# in flight: a summary or snapshot built from entries that were just rolled
+# back would otherwise be saved after the rollback trimmed it. Locks are
+# always taken in this order.
+
+async def adelete_campaign(user_code: str, campaign_id: str) -> bool:
+    async with key_lock(f"campaign:{campaign_id}"), key_lock(f"journal:{campaign_id}"), \
+            key_lock(f"summary:{campaign_id}"), key_lock(f"state:{campaign_id}"):
+        return await run_blocking(get_backend().delete_campaign, user_code, campaign_id)
+
+async def acreate_checkpoint(user_code: str, campaign_id: str) -> Optional[Tuple[Dict, str]]:
+    async with key_lock(f"journal:{campaign_id}"):
+        return await run_blocking(checkpoints.create_checkpoint, get_backend(), user_code, campaign_id)
+
+async def alist_checkpoints(user_code: str, campaign_id: str) -> List[Dict]:
+    return await run_blocking(get_backend().list_checkpoints, user_code, campaign_id)
+
+async def arestore_checkpoint(user_code: str, campaign_id: str, name: str) -> Optional[Dict]:
+    async with key_lock(f"campaign:{campaign_id}"), key_lock(f"journal:{campaign_id}"), \
+            key_lock(f"summary:{campaign_id}"), key_lock(f"state:{campaign_id}"):
+        return await run_blocking(checkpoints.restore_checkpoint, get_backend(), user_code, campaign_id, name)
+
+# Journals
+async def acreate_journal(user_code: str, campaign_id: str):
+    await run_blocking(get_backend().create_journal, user_code, campaign_id)
+
+async def aread_journal(user_code: str, campaign_id: str,
+                        start: int = 0, stop: Optional[int] = None) -> Optional[List[Dict]]:
+    return await run_blocking(get_backend().read_journal, user_code, campaign_id, start, stop)
+
+async def ajournal_length(user_code: str, campaign_id: str) -> Optional[int]:
+    return await run_blocking(get_backend().journal_length, user_code, campaign_id)
+
+async def aread_journal_tail(user_code: str, campaign_id: str, count: int) -> Optional[Tuple[int, List[Dict]]]:
+    """Returns (seq of the first entry, entries) for the last `count` entries, or None if there is no journal."""
+    length = await ajournal_length(user_code, campaign_id)
+    if length is None:
         return None
+    start = max(0, length - count)
+    entries = await aread_journal(user_code, campaign_id, start, length)
+    return (start, entries) if entries is not None else None
 
-    user_email_map = index['users']
-    if email in user_email_map:
-        user_code = user_email_map[email].get("user_code")
-        profile_path = get_user_profile_file(user_code)
-        if profile_path:
-            profile_data = read_json(profile_path)
-            if profile_data:
-                return UserProfile(**profile_data)
-    return None
+def _entry_time(entry: Dict) -> str:
+    return sort_timestamp(entry.get("timestamp")) or ""
+
+async def aread_journal_since(user_code: str, campaign_id: str, since: datetime) -> Optional[Tuple[int, List[Dict]]]:
+    """
+    Returns (seq of the first entry, entries) for the entries stamped after
+    `since`, or None if there is no journal. Entries are appended in time
+    order, so this reads backwards from the end in growing windows and the
+    cost depends on how much is new, not on the length of the journal.
+    """
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    since_key = sort_timestamp(since)
+
+    length = await ajournal_length(user_code, campaign_id)
+    if length is None:
+        return None
+    window, start, entries = 64, length, []
+    while start > 0:
+        lo = max(0, start - window)
+        older = await aread_journal(user_code, campaign_id, lo, start)
+        if older is None:
+            return None
+        entries = older + entries
+        start = lo
+        if _entry_time(older[0]) <= since_key:
+            break
+        window *= 2
+
+    skip = bisect.bisect_right(entries, since_key, key=_entry_time)
+    return start + skip, entries[skip:]
+
+async def aappend_journal_entry(user_code: str, campaign_id: str, entry: Dict) -> Optional[Dict]:
+    async with key_lock(f"journal:{campaign_id}"):
+        return await run_blocking(get_backend().append_journal_entry, user_code, campaign_id, entry)
+
+async def aappend_journal_entries(user_code: str, campaign_id: str, entries: List[Dict]) -> Optional[Dict]:
+    async with key_lock(f"journal:{campaign_id}"):
+        return await run_blocking(get_backend().append_journal_entries, user_code, campaign_id, entries)
+
+async def aupdate_journal_summary(user_code: str, campaign_id: str, upto: int) -> Dict:
+    async with key_lock(f"summary:{campaign_id}"):
+        return await run_blocking(summaries.update_summary, get_backend(), user_code, campaign_id, upto)
+
+async def areserve_rolls(user_code: str, campaign_id: str, count: int, new_key: str) -> Optional[Dict]:
+    async with key_lock(f"rng:{campaign_id}"):
+        return await run_blocking(get_backend().reserve_rolls, user_code, campaign_id, count, new_key)
+
+async def aget_rng_stream(user_code: str, campaign_id: str) -> Optional[Dict]:
+    return await run_blocking(get_backend().get_rng_stream, user_code, campaign_id)
+
+async def aupdate_campaign_state(user_code: str, campaign_id: str) -> Optional[Dict]:
+    async with key_lock(f"state:{campaign_id}"):
+        return await run_blocking(game_state.update_state, get_backend(), user_code, campaign_id)
+
+def compact_journal(user_code: str, campaign_id: str):
+    """Journal maintenance; meant to be scheduled as a background task."""
+    get_backend().compact_journal(user_code, campaign_id)
 
-def add_user_to_index(user_profile: UserProfile):
-    """Adds a user's email and code to the global index."""
-    index = read_json(config.INDEX_FILE) or {"users": {}, "campaigns": {}}
-    index["users"][user_profile.email] = {
-        "user_code": user_profile.user_code,
-        "username": user_profile.username
-    }
-    write_json(config.INDEX_FILE, index)
+# Rooms
+async def alist_rooms() -> List[Dict]:
+    return await run_blocking(get_backend().list_rooms)
 
-# --- Room Management ---
+async def asave_room(room: Dict):
+    await run_blocking(get_backend().save_room, room)
 
-def get_all_rooms() -> List[Dict]:
-    """Reads the list of all rooms."""
-    return read_json(config.ROOMS_FILE) or []
+async def adelete_room(room_code: str):
+    await run_blocking(get_backend().delete_room, room_code)
 
-def write_all_rooms(rooms: List[Dict]):
-    """Writes the list of all rooms."""
-    write_json(config.ROOMS_FILE, rooms)
+async def acompact_rooms(rooms: Optional[List[Dict]] = None):
+    await run_blocking(get_backend().compact_rooms, rooms)
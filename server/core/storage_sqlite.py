@@ -0,0 +1,454 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from server.core import serialization, summaries
+from server.core.storage import (
+    CAMPAIGN_SORT_FIELDS, StorageBackend, decode_campaign_cursor, encode_campaign_cursor, sort_timestamp,
+)
+
+# --- SQLite Storage Backend ---
+# One database file in WAL mode, so readers never block the (single) writer.
+# Records keep the same JSON shape as the file backend; columns that are
+# filtered or sorted on are duplicated out of the JSON document and indexed.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_code   TEXT PRIMARY KEY,
+    profile     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS email_index (
+    email       TEXT PRIMARY KEY,
+    user_code   TEXT NOT NULL,
+    username    TEXT
+);
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_code   TEXT PRIMARY KEY,
+    settings    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaigns (
+    id          TEXT PRIMARY KEY,
+    user_code   TEXT NOT NULL,
+    status      TEXT,
+    tone        TEXT,
+    created_at  TEXT,
+    meta        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_campaigns_user ON campaigns (user_code, created_at);
+CREATE INDEX IF NOT EXISTS idx_campaigns_user_status ON campaigns (user_code, status, created_at);
+CREATE TABLE IF NOT EXISTS journals (
+    campaign_id TEXT PRIMARY KEY,
+    user_code   TEXT NOT NULL,
+    next_seq    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS journal_entries (
+    campaign_id TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    entry       TEXT NOT NULL,
+    PRIMARY KEY (campaign_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS journal_checkpoints (
+    campaign_id TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    created_at  TEXT NOT NULL,
+    info        TEXT NOT NULL,
+    payload     BLOB NOT NULL,
+    PRIMARY KEY (campaign_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_journal_checkpoints_seq ON journal_checkpoints (campaign_id, seq, created_at);
+CREATE TABLE IF NOT EXISTS journal_summaries (
+    campaign_id TEXT PRIMARY KEY,
+    summary     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rng_streams (
+    campaign_id TEXT PRIMARY KEY,
+    key         TEXT NOT NULL,
+    counter     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaign_states (
+    campaign_id TEXT PRIMARY KEY,
+    version     INTEGER NOT NULL,
+    snapshot    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_code   TEXT PRIMARY KEY,
+    is_public   INTEGER NOT NULL,
+    created_at  TEXT,
+    room        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_public ON rooms (is_public, created_at);
+"""
+
+
+# Journal entries, checkpoints, summaries, states and dice streams are keyed
+# by campaign ID alone; these conditions tie them to the campaign's owner.
+# Both take the named parameters :campaign_id and :user_code.
+_OWNED = ("(EXISTS (SELECT 1 FROM campaigns WHERE id = :campaign_id AND user_code = :user_code) "
+          "OR EXISTS (SELECT 1 FROM journals WHERE campaign_id = :campaign_id AND user_code = :user_code))")
+_OWNED_BY_OTHER = ("(EXISTS (SELECT 1 FROM campaigns WHERE id = :campaign_id AND user_code != :user_code) "
+                   "OR EXISTS (SELECT 1 FROM journals WHERE campaign_id = :campaign_id AND user_code != :user_code))")
+
+
+def _dumps(data: Any) -> str:
+    return serialization.dumps_str(data)
+
+
+def _timestamp(value: Any) -> Optional[str]:
+    """Normalizes datetimes and ISO strings so indexed columns sort consistently."""
+    return sort_timestamp(value)
+
+
+class SqliteBackend(StorageBackend):
+    """Stores users, settings, campaigns, journals and rooms in one SQLite database."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 connections must stay on the thread that created them,
+        # so every storage I/O thread gets its own.
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction. BEGIN IMMEDIATE takes the write lock up front."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _fetch_json(self, query: str, params: tuple) -> Optional[Dict]:
+        row = self._connect().execute(query, params).fetchone()
+        return serialization.loads(row[0]) if row else None
+
+    # Users
+    def user_exists(self, user_code: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM users WHERE user_code = ?", (user_code,)
+        ).fetchone() is not None
+
+    def get_user_profile(self, user_code: str) -> Optional[Dict]:
+        return self._fetch_json("SELECT profile FROM users WHERE user_code = ?", (user_code,))
+
+    def save_user_profile(self, profile: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_code, profile) VALUES (?, ?)",
+                (profile["user_code"], _dumps(profile)),
+            )
+
+    def delete_user_profile(self, user_code: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users WHERE user_code = ?", (user_code,))
+
+    def find_user_code_by_email(self, email: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT user_code FROM email_index WHERE email = ?", (email,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_user_to_index(self, email: str, user_code: str, username: str) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO email_index (email, user_code, username) VALUES (?, ?, ?)",
+                (email, user_code, username),
+            )
+            return cursor.rowcount == 1
+
+    def get_user_settings(self, user_code: str) -> Optional[Dict]:
+        return self._fetch_json("SELECT settings FROM user_settings WHERE user_code = ?", (user_code,))
+
+    def save_user_settings(self, user_code: str, settings: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_settings (user_code, settings) VALUES (?, ?)",
+                (user_code, _dumps(settings)),
+            )
+
+    # Campaigns
+    def list_campaign_metas(self, user_code: str) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT meta FROM campaigns WHERE user_code = ? ORDER BY created_at", (user_code,)
+        ).fetchall()
+        return [serialization.loads(row[0]) for row in rows]
+
+    def query_campaign_metas(self, user_code: str, status: Optional[str] = None, tone: Optional[str] = None,
+                             sort: str = "created_at", descending: bool = True,
+                             cursor: Optional[str] = None, limit: int = 50) -> Tuple[List[Dict], Optional[str]]:
+        if sort not in CAMPAIGN_SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort!r}")
+        where, params = ["user_code = ?"], [user_code]
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if tone is not None:
+            where.append("tone = ?")
+            params.append(tone)
+        if cursor:
+            where.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_campaign_cursor(cursor, sort, descending))
+        order = "DESC" if descending else "ASC"
+        rows = self._connect().execute(
+            f"SELECT meta, {sort}, id FROM campaigns WHERE {' AND '.join(where)} "
+            f"ORDER BY {sort} {order}, id {order} LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit and limit > 0:
+            _, value, campaign_id = rows[limit - 1]
+            next_cursor = encode_campaign_cursor(sort, descending, value, campaign_id)
+        return [serialization.loads(row[0]) for row in rows[:limit]], next_cursor
+
+    def get_campaign_meta(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        return self._fetch_json(
+            "SELECT meta FROM campaigns WHERE id = ? AND user_code = ?", (campaign_id, user_code)
+        )
+
+    def save_campaign_meta(self, user_code: str, meta: Dict):
+        # Campaign IDs are global here, so never take over another user's campaign.
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO campaigns (id, user_code, status, tone, created_at, meta) "
+                "SELECT :campaign_id, :user_code, :status, :tone, :created_at, :meta WHERE NOT " + _OWNED_BY_OTHER,
+                {"campaign_id": str(meta["id"]), "user_code": user_code, "status": meta.get("status"),
+                 "tone": meta.get("tone"), "created_at": _timestamp(meta.get("created_at")), "meta": _dumps(meta)},
+            )
+
+    def delete_campaign(self, user_code: str, campaign_id: str) -> bool:
+        with self._transaction() as conn:
+            owned = conn.execute(
+                "SELECT 1 FROM campaigns WHERE id = ? AND user_code = ? "
+                "UNION SELECT 1 FROM journals WHERE campaign_id = ? AND user_code = ?",
+                (campaign_id, user_code, campaign_id, user_code),
+            ).fetchone()
+            if not owned:
+                return False
+            conn.execute("DELETE FROM campaigns WHERE id = ?", (campaign_id,))
+            conn.execute("DELETE FROM journals WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM journal_entries WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM journal_checkpoints WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM journal_summaries WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM campaign_states WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM rng_streams WHERE campaign_id = ?", (campaign_id,))
+            return True
+
+    # Checkpoints
+    def list_checkpoints(self, user_code: str, campaign_id: str) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT info FROM journal_checkpoints WHERE campaign_id = :campaign_id AND " + _OWNED +
+            " ORDER BY seq, created_at",
+            {"campaign_id": campaign_id, "user_code": user_code},
+        ).fetchall()
+        return [serialization.loads(row[0]) for row in rows]
+
+    def save_checkpoint(self, user_code: str, campaign_id: str, info: Dict, payload: bytes) -> str:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_checkpoints (campaign_id, name, seq, created_at, info, payload) "
+                "SELECT :campaign_id, :name, :seq, :created_at, :info, :payload WHERE " + _OWNED,
+                {"campaign_id": campaign_id, "user_code": user_code, "name": info["name"], "seq": info["seq"],
+                 "created_at": info["created_at"], "info": _dumps(info), "payload": payload},
+            )
+        return self.checkpoint_location(user_code, campaign_id, info["name"])
+
+    def read_checkpoint(self, user_code: str, campaign_id: str, name: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT payload FROM journal_checkpoints WHERE campaign_id = :campaign_id AND name = :name AND " + _OWNED,
+            {"campaign_id": campaign_id, "user_code": user_code, "name": name},
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def delete_checkpoints(self, user_code: str, campaign_id: str, names: List[str]):
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM journal_checkpoints WHERE campaign_id = :campaign_id AND name = :name AND " + _OWNED,
+                ({"campaign_id": campaign_id, "user_code": user_code, "name": name} for name in names),
+            )
+
+    def checkpoint_location(self, user_code: str, campaign_id: str, name: str) -> str:
+        return f"{self.db_path}#checkpoints/{campaign_id}/{name}"
+
+    # Journals
+    def create_journal(self, user_code: str, campaign_id: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO journals (campaign_id, user_code) VALUES (?, ?)",
+                (campaign_id, user_code),
+            )
+
+    def read_journal(self, user_code: str, campaign_id: str,
+                     start: int = 0, stop: Optional[int] = None) -> Optional[List[Dict]]:
+        conn = self._connect()
+        # Read the journal row and its entries from the same snapshot.
+        conn.execute("BEGIN")
+        try:
+            journal_row = conn.execute(
+                "SELECT next_seq FROM journals WHERE campaign_id = ? AND user_code = ?",
+                (campaign_id, user_code),
+            ).fetchone()
+            if journal_row is None:
+                return None
+            rows = conn.execute(
+                "SELECT entry FROM journal_entries WHERE campaign_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (campaign_id, start, journal_row[0] if stop is None else stop),
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return [serialization.loads(row[0]) for row in rows]
+
+    def journal_length(self, user_code: str, campaign_id: str) -> Optional[int]:
+        row = self._connect().execute(
+            "SELECT next_seq FROM journals WHERE campaign_id = ? AND user_code = ?",
+            (campaign_id, user_code),
+        ).fetchone()
+        return row[0] if row else None
+
+    def append_journal_entries(self, user_code: str, campaign_id: str, entries: List[Dict]) -> Optional[Dict]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT next_seq FROM journals WHERE campaign_id = ? AND user_code = ?",
+                (campaign_id, user_code),
+            ).fetchone()
+            if row is None:
+                return None
+            seq = row[0]
+            conn.executemany(
+                "INSERT INTO journal_entries (campaign_id, seq, entry) VALUES (?, ?, ?)",
+                ((campaign_id, seq + i, _dumps(entry)) for i, entry in enumerate(entries)),
+            )
+            conn.execute("UPDATE journals SET next_seq = ? WHERE campaign_id = ? AND user_code = ?",
+                         (seq + len(entries), campaign_id, user_code))
+        return {"seq": seq, "needs_compaction": False}
+
+    def truncate_journal(self, user_code: str, campaign_id: str, length: int):
+        with self._transaction() as conn:
+            if not conn.execute(
+                "UPDATE journals SET next_seq = MIN(next_seq, ?) WHERE campaign_id = ? AND user_code = ?",
+                (length, campaign_id, user_code),
+            ).rowcount:
+                return
+            conn.execute("DELETE FROM journal_entries WHERE campaign_id = ? AND seq >= ?", (campaign_id, length))
+            row = conn.execute("SELECT summary FROM journal_summaries WHERE campaign_id = ?", (campaign_id,)).fetchone()
+            if row:
+                summary = serialization.loads(row[0])
+                trimmed = summaries.trim(summary, length)
+                if trimmed is not summary:
+                    conn.execute("UPDATE journal_summaries SET summary = ? WHERE campaign_id = ?",
+                                 (_dumps(trimmed), campaign_id))
+            # A snapshot that is ahead of the journal can't be rolled back; drop it to be rebuilt.
+            conn.execute("DELETE FROM campaign_states WHERE campaign_id = ? AND version > ?", (campaign_id, length))
+
+    def replace_journal(self, user_code: str, campaign_id: str, entries: List[Dict]):
+        """Bulk-loads a whole journal in one transaction."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT " + _OWNED_BY_OTHER,
+                            {"campaign_id": campaign_id, "user_code": user_code}).fetchone()[0]:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO journals (campaign_id, user_code, next_seq) VALUES (?, ?, ?)",
+                (campaign_id, user_code, len(entries)),
+            )
+            conn.execute("DELETE FROM journal_entries WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM journal_summaries WHERE campaign_id = ?", (campaign_id,))
+            conn.execute("DELETE FROM campaign_states WHERE campaign_id = ?", (campaign_id,))
+            conn.executemany(
+                "INSERT INTO journal_entries (campaign_id, seq, entry) VALUES (?, ?, ?)",
+                ((campaign_id, seq, _dumps(entry)) for seq, entry in enumerate(entries)),
+            )
+
+    # Journal summaries
+    def get_journal_summary(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT summary FROM journal_summaries WHERE campaign_id = :campaign_id AND " + _OWNED,
+            {"campaign_id": campaign_id, "user_code": user_code},
+        ).fetchone()
+        return serialization.loads(row[0]) if row else None
+
+    def save_journal_summary(self, user_code: str, campaign_id: str, summary: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_summaries (campaign_id, summary) "
+                "SELECT :campaign_id, :summary WHERE " + _OWNED,
+                {"campaign_id": campaign_id, "user_code": user_code, "summary": _dumps(summary)},
+            )
+
+    # Campaign state
+    def get_campaign_state(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT snapshot FROM campaign_states WHERE campaign_id = :campaign_id AND " + _OWNED,
+            {"campaign_id": campaign_id, "user_code": user_code},
+        ).fetchone()
+        return serialization.loads(row[0]) if row else None
+
+    def save_campaign_state(self, user_code: str, campaign_id: str, snapshot: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO campaign_states (campaign_id, version, snapshot) "
+                "SELECT :campaign_id, :version, :snapshot WHERE " + _OWNED,
+                {"campaign_id": campaign_id, "user_code": user_code, "version": snapshot["version"],
+                 "snapshot": _dumps(snapshot)},
+            )
+
+    # Dice streams
+    def reserve_rolls(self, user_code: str, campaign_id: str, count: int, new_key: str) -> Optional[Dict]:
+        with self._transaction() as conn:
+            if not conn.execute("SELECT 1 FROM campaigns WHERE id = ? AND user_code = ?",
+                                (campaign_id, user_code)).fetchone():
+                return None
+            conn.execute("INSERT OR IGNORE INTO rng_streams (campaign_id, key, counter) VALUES (?, ?, 0)",
+                         (campaign_id, new_key))
+            key, counter = conn.execute(
+                "UPDATE rng_streams SET counter = counter + ? WHERE campaign_id = ? RETURNING key, counter",
+                (count, campaign_id),
+            ).fetchone()
+        return {"key": key, "first": counter - count}
+
+    def get_rng_stream(self, user_code: str, campaign_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT key, counter FROM rng_streams WHERE campaign_id = :campaign_id AND " + _OWNED,
+            {"campaign_id": campaign_id, "user_code": user_code},
+        ).fetchone()
+        return {"key": row[0], "counter": row[1]} if row else None
+
+    def save_rng_stream(self, user_code: str, campaign_id: str, stream: Dict):
+        """Imports a stream as-is (used by server/core/migrate.py)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rng_streams (campaign_id, key, counter) "
+                "SELECT :campaign_id, :key, :counter WHERE " + _OWNED,
+                {"campaign_id": campaign_id, "user_code": user_code, "key": stream["key"],
+                 "counter": stream["counter"]},
+            )
+
+    # Rooms
+    def list_rooms(self) -> List[Dict]:
+        rows = self._connect().execute("SELECT room FROM rooms ORDER BY created_at").fetchall()
+        return [serialization.loads(row[0]) for row in rows]
+
+    def save_room(self, room: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rooms (room_code, is_public, created_at, room) VALUES (?, ?, ?, ?)",
+                (room["room_code"], int(bool(room.get("is_public"))), _timestamp(room.get("created_at")), _dumps(room)),
+            )
+
+    def delete_room(self, room_code: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rooms WHERE room_code = ?", (room_code,))
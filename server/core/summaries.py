@@ -0,0 +1,105 @@
+import re
+from typing import Dict, List, Optional
+
+from server.core import config
+
+# --- Rolling journal summaries ---
+#
+# The AI context keeps only the last few journal entries verbatim; everything
+# older is represented by summaries. The journal is cut into fixed segments
+# of AI_SUMMARY_SEGMENT_ENTRIES entries and each segment, once it is entirely
+# older than the verbatim window, is summarized exactly once. The summary
+# document lives next to the journal:
+#
+#   {"version": 1, "segment_entries": S,
+#    "segments": [{"start", "stop", "text", "chars"}, ...]}
+#
+# where [start, stop) is the journal range a segment covers and "chars" is
+# the length of the original entries' content (used to report how much
+# smaller the prompt got). Segments are contiguous from 0. Summaries are
+# derived data: backends drop segments a truncation invalidates, and a lost
+# document is simply rebuilt.
+#
+# Summaries are extractive (the opening sentence of each turn), so they cost
+# no model calls and are deterministic.
+
+SUMMARY_VERSION = 1
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+_PROMPTS_HEADER = re.compile(r"^\s*\*?(prompts|подсказки)\b", re.IGNORECASE)
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    lines = []
+    for line in text.strip().splitlines():
+        if _PROMPTS_HEADER.match(line): # The numbered action suggestions aren't story
+            break
+        lines.append(line.strip())
+    text = " ".join(line for line in lines if line)
+    sentence = _SENTENCE_END.split(text, 1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + "…"
+
+
+def summarize_entries(entries: List[Dict]) -> str:
+    """A compact digest of journal entries: the opening sentence of each turn."""
+    parts = []
+    for entry in entries:
+        if entry.get("role") == "user":
+            parts.append(f"Player: {_first_sentence(entry.get('content', ''), 100)}")
+        elif entry.get("role") == "assistant":
+            parts.append(f"DM: {_first_sentence(entry.get('content', ''), 160)}")
+    return "\n".join(parts)
+
+
+def empty_summary() -> Dict:
+    return {"version": SUMMARY_VERSION, "segment_entries": config.AI_SUMMARY_SEGMENT_ENTRIES, "segments": []}
+
+
+def covered(summary: Optional[Dict]) -> int:
+    """Number of leading journal entries the summary covers."""
+    return summary["segments"][-1]["stop"] if summary and summary["segments"] else 0
+
+
+def trim(summary: Optional[Dict], length: int) -> Optional[Dict]:
+    """Drops segments that reach past a journal cut back to `length` entries."""
+    if summary is None or covered(summary) <= length:
+        return summary
+    return {**summary, "segments": [s for s in summary["segments"] if s["stop"] <= length]}
+
+
+def summarizable_length(journal_length: int) -> int:
+    """How far summaries should reach: whole segments older than the verbatim window."""
+    size = config.AI_SUMMARY_SEGMENT_ENTRIES
+    return max(0, (journal_length - config.AI_CONTEXT_RECENT_TURNS) // size * size)
+
+
+def update_summary(backend, user_code: str, campaign_id: str, upto: int) -> Dict:
+    """
+    Brings the campaign's summary up to `upto` entries (rounded down to whole
+    segments), summarizing only segments it doesn't cover yet, and returns it.
+    """
+    summary = backend.get_journal_summary(user_code, campaign_id)
+    if (summary is None or summary.get("version") != SUMMARY_VERSION
+            or summary.get("segment_entries") != config.AI_SUMMARY_SEGMENT_ENTRIES):
+        summary = empty_summary()
+
+    size = summary["segment_entries"]
+    start = covered(summary)
+    if start + size > upto:
+        return summary
+
+    entries = backend.read_journal(user_code, campaign_id, start, upto // size * size) or []
+    segments = list(summary["segments"])
+    for offset in range(0, len(entries) - size + 1, size):
+        chunk = entries[offset:offset + size]
+        segments.append({
+            "start": start + offset,
+            "stop": start + offset + size,
+            "text": summarize_entries(chunk),
+            "chars": sum(len(entry.get("content", "")) for entry in chunk),
+        })
+    if len(segments) == len(summary["segments"]):
+        return summary
+    summary = {**summary, "segments": segments}
+    backend.save_journal_summary(user_code, campaign_id, summary)
+    return summary
@@ -23,12 +23,11 @@ def roll_d100(seed: Optional[int] = None) -> Dict[str, int]:
     A roll of 00 and 0 is treated as 100.
     """
     if seed is not None:
-        # Create two distinct seeds from the original seed for reproducible but different rolls
-        rng_tens = random.Random(seed)
-        rng_ones = random.Random(seed + 1)
-
-        tens_roll = rng_tens.randint(0, 9)
-        ones_roll = rng_ones.randint(0, 9)
+        # Both dice come from one generator. (Seeding the ones die with seed + 1
+        # made seed N's ones die always equal seed N + 1's tens die.)
+        rng = random.Random(seed)
+        tens_roll = rng.randint(0, 9)
+        ones_roll = rng.randint(0, 9)
     else:
         tens_roll = random.randint(0, 9)
         ones_roll = random.randint(0, 9)
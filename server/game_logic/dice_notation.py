@@ -0,0 +1,199 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from server.core import config
+from server.core.cache import LRUCache
+
+# --- Dice notation ---
+#
+#   expression := term (("+" | "-") term)*
+#   term       := [count] "d" (sides | "%") modifier* | integer
+#   modifier   := "kh"N | "kl"N | "k"N     keep the N highest/lowest ("k" = "kh")
+#               | "dh"N | "dl"N            drop the N highest/lowest
+#               | "adv" | "dis"            advantage/disadvantage (1dS becomes 2dSkh1/kl1)
+#               | "!"                      exploding: a die showing its maximum is rolled
+#                                          again and added, up to MAX_EXPLOSIONS times
+#
+# e.g. "8d6", "4d6kh3", "d20adv+5", "2d10!-1", "d%". Whitespace and case are
+# ignored. Explosions happen before keep/drop, which then sees each die's
+# exploded total.
+#
+# One "dS" term rolls like dice.roll(S), and "d100"/"d%" has the same uniform
+# 1..100 distribution as dice.roll_d100 (which stays the API for the
+# tens/ones breakdown).
+
+MAX_COUNT = 1000        # Dice in one term
+MAX_SIDES = 1000
+MAX_TERMS = 20
+MAX_LENGTH = 200
+MAX_EXPLOSIONS = 100    # Re-rolls per exploding die
+
+_TERM = re.compile(r"([+-]?)(?:(\d*)d(\d+|%)((?:kh\d+|kl\d+|k\d+|dh\d+|dl\d+|adv|dis|!)*)|(\d+))")
+_MODIFIER = re.compile(r"(kh|kl|k|dh|dl)(\d+)|adv|dis|!")
+_SPLIT_NUMBER = re.compile(r"\d\s+\d")
+
+
+class DiceTerm(NamedTuple):
+    """`count` dice with `sides` faces, keeping `keep` of them (all if None). `sign` is +1 or -1."""
+    count: int
+    sides: int
+    keep: Optional[int] = None
+    keep_highest: bool = True
+    explode: bool = False
+    sign: int = 1
+
+    @property
+    def notation(self) -> str:
+        keep = f"k{'h' if self.keep_highest else 'l'}{self.keep}" if self.keep is not None else ""
+        return f"{self.count}d{self.sides}{'!' if self.explode else ''}{keep}"
+
+
+class DiceExpression(NamedTuple):
+    terms: Tuple[DiceTerm, ...]
+    modifier: int = 0
+
+    @property
+    def notation(self) -> str:
+        """The canonical form, e.g. "d20 adv + 5" -> "2d20kh1+5"."""
+        parts = [("-" if term.sign < 0 else "+") + term.notation for term in self.terms]
+        if self.modifier or not parts:
+            parts.append(f"{self.modifier:+d}")
+        return "".join(parts).lstrip("+")
+
+    @property
+    def dice_count(self) -> int:
+        return sum(term.count for term in self.terms)
+
+
+def _parse_term(count: str, sides: str, modifiers: str, sign: int) -> DiceTerm:
+    count = int(count) if count else 1
+    sides = 100 if sides == "%" else int(sides)
+    if not 1 <= count <= MAX_COUNT:
+        raise ValueError(f"Dice count must be between 1 and {MAX_COUNT}.")
+    if not 2 <= sides <= MAX_SIDES:
+        raise ValueError(f"Dice sides must be between 2 and {MAX_SIDES}.")
+
+    keep, keep_highest, explode = None, True, False
+    for match in _MODIFIER.finditer(modifiers):
+        name, value = match.group(1), match.group(2)
+        if match.group(0) == "!":
+            if explode:
+                raise ValueError("'!' given twice.")
+            explode = True
+            continue
+        if keep is not None:
+            raise ValueError("Only one keep/drop/advantage modifier per term.")
+        if match.group(0) in ("adv", "dis"):
+            if count != 1:
+                raise ValueError("Advantage/disadvantage apply to a single die.")
+            count, keep, keep_highest = 2, 1, match.group(0) == "adv"
+            continue
+        n = int(value)
+        if name in ("dh", "dl"):
+            if not 0 <= n < count:
+                raise ValueError("Can't drop that many dice.")
+            keep, keep_highest = count - n, name == "dl"
+        else:
+            if not 1 <= n <= count:
+                raise ValueError("Can't keep that many dice.")
+            keep, keep_highest = n, name != "kl"
+    if keep == count:
+        keep = None
+    return DiceTerm(count, sides, keep, keep_highest, explode, sign)
+
+
+def _parse(text: str) -> DiceExpression:
+    if _SPLIT_NUMBER.search(text):
+        raise ValueError("Invalid dice expression: numbers split by whitespace.")
+    source = "".join(text.split()).lower()
+    if not source or len(source) > MAX_LENGTH:
+        raise ValueError("Empty or overlong dice expression.")
+
+    terms, modifier, position = [], 0, 0
+    while position < len(source):
+        match = _TERM.match(source, position)
+        if not match or match.end() == position or (position and not match.group(1)):
+            raise ValueError(f"Invalid dice expression at {source[position:]!r}.")
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(5) is not None:
+            modifier += sign * int(match.group(5))
+        else:
+            terms.append(_parse_term(match.group(2), match.group(3), match.group(4), sign))
+        position = match.end()
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"At most {MAX_TERMS} dice terms per expression.")
+    return DiceExpression(tuple(terms), modifier)
+
+
+_parsed = LRUCache(config.DICE_EXPRESSION_CACHE_ENTRIES)
+
+
+def parse(text: str) -> DiceExpression:
+    """Parses dice notation (cached). Raises ValueError for invalid expressions."""
+    expression = _parsed.get(text)
+    if expression is None:
+        expression = _parse(text)
+        _parsed.set(text, expression)
+    return expression
+
+
+def get_parse_cache_stats() -> Dict[str, int]:
+    return _parsed.stats()
+
+
+# --- Rolling ---
+
+def _roll_term(term: DiceTerm, times: int, rng: np.random.Generator) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Rolls a term `times` times: each die's value, shape (times, count), and the kept mask (None = all)."""
+    values = rng.integers(1, term.sides + 1, size=(times, term.count), dtype=np.int64)
+    if term.explode:
+        exploding = np.flatnonzero(values == term.sides)
+        flat = values.reshape(-1)
+        for _ in range(MAX_EXPLOSIONS):
+            if not exploding.size:
+                break
+            extra = rng.integers(1, term.sides + 1, size=exploding.size, dtype=np.int64)
+            flat[exploding] += extra
+            exploding = exploding[extra == term.sides]
+    if term.keep is None:
+        return values, None
+
+    order = np.argsort(values, axis=1, kind="stable")
+    kept = order[:, -term.keep:] if term.keep_highest else order[:, :term.keep]
+    mask = np.zeros(values.shape, dtype=bool)
+    np.put_along_axis(mask, kept, True, axis=1)
+    return values, mask
+
+
+def roll(expression: DiceExpression, times: int = 1, rng: Optional[np.random.Generator] = None,
+         breakdown: bool = False) -> Dict[str, Any]:
+    """
+    Rolls `expression` `times` times, vectorized over all the dice at once.
+    Returns {"totals": [...]}, plus with `breakdown` a "rolls" list with each
+    roll's dice per term: [{"total", "terms": [{"notation", "sign", "rolls",
+    "kept", "subtotal"}]}], where "kept" is only present for keep/drop terms.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    totals = np.full(times, expression.modifier, dtype=np.int64)
+    rolled = []
+    for term in expression.terms:
+        values, mask = _roll_term(term, times, rng)
+        subtotals = (values if mask is None else values * mask).sum(axis=1)
+        totals += term.sign * subtotals
+        rolled.append((term, values, mask, subtotals))
+
+    result: Dict[str, Any] = {"totals": totals.tolist()}
+    if breakdown:
+        rolls: List[Dict[str, Any]] = [{"total": total, "terms": []} for total in result["totals"]]
+        for term, values, mask, subtotals in rolled:
+            value_lists = values.tolist()
+            mask_lists = mask.tolist() if mask is not None else None
+            for i, subtotal in enumerate(subtotals.tolist()):
+                part = {"notation": term.notation, "sign": term.sign, "rolls": value_lists[i], "subtotal": subtotal}
+                if mask_lists is not None:
+                    part["kept"] = mask_lists[i]
+                rolls[i]["terms"].append(part)
+        result["rolls"] = rolls
+    return result
@@ -1,50 +1,90 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
+from server.core import config, summaries
 from server.core.models import Message, CampaignMeta
 
-# This is a placeholder for the main game engine logic.
-# In a more complex implementation, this engine would manage state,
-# process events, and interact with the AI and storage layers.
+
+def estimate_tokens(text: str) -> int:
+    """A cheap token estimate (~4 characters per token), good enough for budgeting."""
+    return (len(text) + 3) // 4
+
+
+def _message_tokens(message: Message) -> int:
+    return estimate_tokens(message.content) + 4 # Role label and separators
+
+
+def _fit_newest(lines: List[str], budget: int) -> List[str]:
+    """The newest of `lines` that fit in `budget` tokens, in their original order."""
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += estimate_tokens(line) + 1
+        if used > budget:
+            break
+        kept.append(line)
+    return kept[::-1]
+
 
 def process_player_action(
     action: Message,
     campaign_meta: CampaignMeta,
     campaign_journal: list[Message],
-    user_settings: Dict[str, Any]
+    user_settings: Dict[str, Any],
+    journal_summaries: Optional[List[str]] = None,
+    summarized_chars: int = 0,
 ) -> Dict[str, Any]:
     """
-    Processes a player's action, prepares the context for the AI,
-    and returns the data needed for the AI completion call.
+    Processes a player's action and prepares the context for the AI call.
 
-    This function will be the bridge between the API layer and the AI call.
-    """
-
-    # 1. Prepare context for the AI
-    #    - Get system prompt
-    #    - Get recent journal entries
-    #    - Format everything into a list of messages
-
-    # 2. (Optional) Perform game rule checks based on the action
-    #    - e.g., if action is "I attack the goblin", roll dice here.
+    `campaign_journal` is the part of the journal not yet covered by the
+    stored rolling summaries (`journal_summaries`, oldest first, whose
+    source entries totalled `summarized_chars` characters).
 
-    # 3. Call the AI completion service
-    #    - This will be handled in the API layer for now (api/ai.py)
+    The last AI_CONTEXT_RECENT_TURNS journal entries are kept verbatim, as
+    many as fit AI_CONTEXT_TOKEN_BUDGET together with the action. Older
+    unsummarized entries are summarized on the spot, and the summaries are
+    cut to the newest lines that fit AI_CONTEXT_SUMMARY_TOKEN_BUDGET.
 
-    # 4. Process the AI's response
-    #    - Parse structured data
-    #    - Update journal
-
-    # For now, this is just a placeholder. The logic will be built out
-    # in the api/ai.py file initially.
+    Returns {"messages", "summary", "context", "stats"}; "stats" compares
+    the context's estimated size with sending the whole history.
+    """
+    # 1. The most recent turns, verbatim
+    budget = config.AI_CONTEXT_TOKEN_BUDGET - _message_tokens(action)
+    window = campaign_journal[-config.AI_CONTEXT_RECENT_TURNS:] if config.AI_CONTEXT_RECENT_TURNS > 0 else []
+    split = len(campaign_journal)
+    for message in reversed(window):
+        budget -= _message_tokens(message)
+        if budget < 0:
+            break
+        split -= 1
+    recent = campaign_journal[split:]
 
-    print(f"Engine processing action for campaign {campaign_meta.id}: {action.content}")
+    # 2. Everything older, summarized
+    parts = list(journal_summaries or [])
+    if split:
+        parts.append(summaries.summarize_entries(
+            [{"role": m.role, "content": m.content} for m in campaign_journal[:split]]
+        ))
+    lines = [line for part in parts for line in part.splitlines() if line]
+    kept = _fit_newest(lines, config.AI_CONTEXT_SUMMARY_TOKEN_BUDGET)
+    if len(kept) < len(lines):
+        kept.insert(0, "(Earlier events omitted.)")
+    summary = "\n".join(kept) or None
 
-    # This function would return the context payload for the AI
+    messages = recent + [action]
+    context_tokens = sum(_message_tokens(m) for m in messages) + (estimate_tokens(summary) if summary else 0)
+    full_tokens = ((summarized_chars + 3) // 4
+                   + sum(_message_tokens(m) for m in campaign_journal) + _message_tokens(action))
     return {
-        "messages": campaign_journal + [action],
+        "messages": messages,
+        "summary": summary,
         "context": {
             "tone": campaign_meta.tone,
             "difficulty": campaign_meta.difficulty,
             "language": user_settings.get("language", "en")
-        }
+        },
+        "stats": {
+            "recent_turns": len(recent),
+            "context_tokens": context_tokens,
+            "full_tokens": full_tokens,
+        },
     }
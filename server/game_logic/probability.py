@@ -0,0 +1,207 @@
+import math
+from math import comb
+from typing import Dict, Optional
+
+import numpy as np
+
+from server.core import config
+from server.core.cache import LRUCache
+from server.game_logic import rules
+from server.game_logic.dice_notation import DiceExpression, DiceTerm, MAX_EXPLOSIONS
+
+# --- Exact distributions of dice expressions ---
+#
+# A distribution is an array of probabilities for the consecutive totals
+# `offset`, `offset + 1`, ... A term of plain dice is the single die's
+# distribution convolved with itself `count` times, and an expression is the
+# convolution of its terms, shifted by the modifier. Keep-highest/lowest
+# (including advantage/disadvantage, which parse to 2dSkh1/kl1) needs order
+# statistics and is computed by dynamic programming over face values.
+#
+# Exploding dice have unbounded totals; their tail is cut where probabilities
+# drop below EXPLOSION_TAIL (or at MAX_EXPLOSIONS, like the roller), with the
+# cut-off mass kept on the last value.
+#
+# Distributions are memoized per term and per expression, and their arrays
+# are read-only.
+
+EXPLOSION_TAIL = 1e-15
+MAX_SUPPORT = 200_000 # Distinct totals one distribution may have
+MAX_KEEP_WORK = 50_000_000 # Rough cost bound (face values x dice^2 x kept-sum range) for keep-N
+FFT_THRESHOLD = 10_000_000 # Convolve by FFT above this many multiply-adds
+
+
+class Distribution:
+    """The exact probability of each total of a dice expression."""
+
+    __slots__ = ("offset", "pmf", "cdf")
+
+    def __init__(self, offset: int, pmf: np.ndarray):
+        pmf = np.clip(pmf, 0.0, None)
+        pmf /= pmf.sum()
+        pmf.flags.writeable = False
+        cdf = np.cumsum(pmf)
+        cdf.flags.writeable = False
+        self.offset = offset
+        self.pmf = pmf
+        self.cdf = cdf
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.pmf) - 1
+
+    @property
+    def values(self) -> np.ndarray:
+        return np.arange(self.offset, self.offset + len(self.pmf))
+
+    @property
+    def mean(self) -> float:
+        return float(self.values @ self.pmf)
+
+    @property
+    def stdev(self) -> float:
+        deviation = self.values - self.mean
+        return math.sqrt(float(deviation * deviation @ self.pmf))
+
+    def probability(self, total: int) -> float:
+        index = total - self.offset
+        return float(self.pmf[index]) if 0 <= index < len(self.pmf) else 0.0
+
+    def at_most(self, total: int) -> float:
+        index = total - self.offset
+        if index < 0:
+            return 0.0
+        return float(self.cdf[min(index, len(self.cdf) - 1)])
+
+    def at_least(self, total: int) -> float:
+        return max(0.0, 1.0 - self.at_most(total - 1))
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) + len(b) - 1 > MAX_SUPPORT:
+        raise ValueError("Too many possible totals for an exact distribution.")
+    if len(a) * len(b) <= FFT_THRESHOLD:
+        return np.convolve(a, b)
+    size = len(a) + len(b) - 1
+    return np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)
+
+
+def _power(pmf: np.ndarray, count: int) -> np.ndarray:
+    """`pmf` convolved with itself `count` times, by repeated squaring."""
+    result, base = np.ones(1), pmf
+    while count:
+        if count & 1:
+            result = _convolve(result, base)
+        count >>= 1
+        if count:
+            base = _convolve(base, base)
+    return result
+
+
+def _die(term: DiceTerm) -> np.ndarray:
+    """One die's distribution over 1, 2, ... (including explosions)."""
+    sides = term.sides
+    if not term.explode:
+        return np.full(sides, 1.0 / sides)
+    # Re-rolls counted until a whole chain is below EXPLOSION_TAIL.
+    depth = min(MAX_EXPLOSIONS, max(1, math.ceil(math.log(EXPLOSION_TAIL) / math.log(1.0 / sides))))
+    pmf = np.zeros(sides * (depth + 1))
+    for k in range(depth + 1):
+        chain = (1.0 / sides) ** (k + 1)
+        # k maxima, then a non-maximum (or anything at all on the last re-roll)
+        last = sides if k == depth else sides - 1
+        pmf[k * sides:k * sides + last] = chain
+    return pmf
+
+
+def _keep(pmf: np.ndarray, count: int, keep: int, highest: bool) -> np.ndarray:
+    """
+    Distribution (over sums from 0) of the `keep` highest/lowest of `count`
+    dice with face distribution `pmf` (faces 1, 2, ...).
+
+    Faces are visited from the kept end. The state is how many dice have been
+    assigned a face so far and the sum of the kept ones; the first `keep`
+    dice assigned are the kept ones. Choosing j of the remaining dice to show
+    face v has weight C(remaining, j) * p_v^j.
+    """
+    faces = [(v + 1, p) for v, p in enumerate(pmf) if p > 0]
+    size = keep * len(pmf) + 1
+    if len(faces) * count * count * size > MAX_KEEP_WORK:
+        raise ValueError("Too many dice to keep for an exact distribution.")
+    if highest:
+        faces.reverse()
+    dp = [np.zeros(size) for _ in range(count + 1)]
+    dp[0][0] = 1.0
+    for face, p in faces:
+        new = [np.zeros(size) for _ in range(count + 1)]
+        powers = [p ** j for j in range(count + 1)]
+        for assigned in range(count + 1):
+            current = dp[assigned]
+            if not current.any():
+                continue
+            remaining = count - assigned
+            for j in range(remaining + 1):
+                weight = comb(remaining, j) * powers[j]
+                if weight == 0.0:
+                    break
+                shift = face * max(0, min(j, keep - assigned))
+                target = new[assigned + j]
+                if shift:
+                    target[shift:] += weight * current[:size - shift]
+                else:
+                    target += weight * current
+        dp = new
+    return dp[count]
+
+
+_terms = LRUCache(config.DICE_DISTRIBUTION_CACHE_ENTRIES)
+_expressions = LRUCache(config.DICE_DISTRIBUTION_CACHE_ENTRIES)
+
+
+def _term_distribution(term: DiceTerm) -> Distribution:
+    unsigned = term._replace(sign=1)
+    cached = _terms.get(unsigned)
+    if cached is None:
+        die = _die(unsigned)
+        if unsigned.keep is None:
+            cached = Distribution(unsigned.count, _power(die, unsigned.count))
+        else:
+            sums = _keep(die, unsigned.count, unsigned.keep, unsigned.keep_highest)
+            cached = Distribution(unsigned.keep, sums[unsigned.keep:])
+        _terms.set(unsigned, cached)
+    return cached
+
+
+def distribution(expression: DiceExpression) -> Distribution:
+    """The exact (memoized) distribution of an expression's totals. Raises ValueError if it is too large."""
+    cached = _expressions.get(expression)
+    if cached is not None:
+        return cached
+    offset, pmf = expression.modifier, np.ones(1)
+    for term in expression.terms:
+        part = _term_distribution(term)
+        if term.sign > 0:
+            offset += part.offset
+            pmf = _convolve(pmf, part.pmf)
+        else:
+            offset -= part.max
+            pmf = _convolve(pmf, part.pmf[::-1])
+    cached = Distribution(offset, pmf)
+    _expressions.set(expression, cached)
+    return cached
+
+
+def success_chances(dist: Distribution, modifier: int = 0,
+                    difficulty_classes: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+    """Chance that total + modifier meets each DC, as in rules.check_success."""
+    difficulty_classes = difficulty_classes or rules.DIFFICULTY_CLASSES
+    return {name: {"dc": dc, "probability": round(dist.at_least(dc - modifier), 12)}
+            for name, dc in difficulty_classes.items()}
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"terms": _terms.stats(), "expressions": _expressions.stats()}
@@ -0,0 +1,27 @@
+import secrets
+
+import numpy as np
+
+# --- Per-campaign RNG streams ---
+#
+# Every campaign has a secret 128-bit key and a roll counter, stored by the
+# storage backend. Each roll reserves the next counter value and draws its
+# dice from a Philox generator keyed with the campaign key and started at
+# block counter (0, roll, 0, 0). Philox is counter-based, so any roll can be
+# regenerated from (key, roll) alone, without replaying the rolls before it,
+# and the streams of different rolls (up to 2**64 blocks of 4 draws each)
+# never overlap. One roll can draw as many dice as it needs.
+#
+# Only rolls that were already issued may be replayed; the key never leaves
+# the server, so future rolls can't be predicted.
+
+KEY_BYTES = 16
+
+
+def new_key() -> str:
+    return secrets.token_hex(KEY_BYTES)
+
+
+def generator(key: str, roll: int) -> np.random.Generator:
+    """The generator for roll number `roll` of the stream with `key`."""
+    return np.random.Generator(np.random.Philox(key=int(key, 16), counter=[0, roll, 0, 0]))
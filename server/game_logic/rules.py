@@ -11,6 +11,10 @@ DIFFICULTY_CLASSES: Dict[str, int] = {
     "nearly_impossible": 30,
 }
 
+# --- Character Defaults ---
+# Hit points a player character starts a campaign with.
+STARTING_HP: int = 20
+
 def check_success(roll: int, modifier: int, dc: int) -> bool:
     """
     Performs a basic success check for an action.
@@ -0,0 +1,189 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from server.game_logic import rules
+
+# --- Campaign state ---
+#
+# The DM ends every reply with a metadata block (`hp_change`, `item_found`,
+# `location`, `new_npc_introduced`, ...), which ai.py stores as the "meta" of
+# the assistant's journal entry. Those entries are the event log; the state
+# is a fold over them. To avoid replaying the whole journal, a snapshot of the
+# fold is kept next to the journal:
+#
+#   {"schema": 1, "version": N, "events": E, "state": {...}}
+#
+# where `version` is the number of journal entries folded in (so the tail
+# still to apply is journal[version:]) and `events` how many of them carried
+# metadata. Snapshots are derived data: backends reset them when the journal
+# is cut back past `version`, and a lost snapshot is rebuilt from the journal.
+#
+# Model output is not validated, so events are applied leniently: unknown
+# keys are ignored and malformed values skipped.
+
+SNAPSHOT_SCHEMA = 1
+
+
+def initial_state() -> Dict[str, Any]:
+    return {
+        "hp": rules.STARTING_HP,
+        "max_hp": rules.STARTING_HP,
+        "location": None,
+        "mood": None,
+        "inventory": {},     # Item name -> count
+        "npcs": {},          # NPC name -> {"introduced_seq"}
+        "status_effects": [],
+        "last_action_result": None,
+    }
+
+
+def empty_snapshot() -> Dict[str, Any]:
+    return {"schema": SNAPSHOT_SCHEMA, "version": 0, "events": 0, "state": initial_state()}
+
+
+def trim(snapshot: Optional[Dict], length: int) -> Optional[Dict]:
+    """A snapshot still valid for a journal cut back to `length` entries (the same object if unchanged)."""
+    if snapshot is None or snapshot.get("version", 0) <= length:
+        return snapshot
+    return empty_snapshot()
+
+
+# --- Event handlers ---
+# Each takes (state, value, seq) and updates `state` in place.
+
+def _names(value: Any) -> List[str]:
+    """Item/NPC fields may hold one name or a list of them."""
+    values = value if isinstance(value, list) else [value]
+    return [v.strip() for v in values if isinstance(v, str) and v.strip()]
+
+
+def _number(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _hp_change(state: Dict, value: Any, seq: int):
+    change = _number(value)
+    if change is not None:
+        state["hp"] = max(0, min(state["max_hp"], state["hp"] + change))
+
+
+def _max_hp_change(state: Dict, value: Any, seq: int):
+    change = _number(value)
+    if change is not None:
+        state["max_hp"] = max(1, state["max_hp"] + change)
+        state["hp"] = min(state["hp"], state["max_hp"])
+
+
+def _item_found(state: Dict, value: Any, seq: int):
+    for name in _names(value):
+        state["inventory"][name] = state["inventory"].get(name, 0) + 1
+
+
+def _item_lost(state: Dict, value: Any, seq: int):
+    for name in _names(value):
+        count = state["inventory"].get(name, 0) - 1
+        if count > 0:
+            state["inventory"][name] = count
+        else:
+            state["inventory"].pop(name, None)
+
+
+def _npc_introduced(state: Dict, value: Any, seq: int):
+    for name in _names(value):
+        state["npcs"].setdefault(name, {"introduced_seq": seq})
+
+
+def _status_applied(state: Dict, value: Any, seq: int):
+    for name in _names(value):
+        if name not in state["status_effects"]:
+            state["status_effects"].append(name)
+
+
+def _status_removed(state: Dict, value: Any, seq: int):
+    removed = set(_names(value))
+    state["status_effects"] = [name for name in state["status_effects"] if name not in removed]
+
+
+def _text_field(field: str) -> Callable[[Dict, Any, int], None]:
+    def apply(state: Dict, value: Any, seq: int):
+        if isinstance(value, str) and value.strip():
+            state[field] = value.strip()
+    return apply
+
+
+EVENT_HANDLERS: Dict[str, Callable[[Dict, Any, int], None]] = {
+    "hp_change": _hp_change,
+    "max_hp_change": _max_hp_change,
+    "item_found": _item_found,
+    "items_found": _item_found,
+    "item_lost": _item_lost,
+    "item_used": _item_lost,
+    "new_npc_introduced": _npc_introduced,
+    "status_effect": _status_applied,
+    "status_removed": _status_removed,
+    "location": _text_field("location"),
+    "mood": _text_field("mood"),
+    "action_result": _text_field("last_action_result"),
+}
+
+# Keys that only apply when they target the player (the prompt asks for
+# `"target": "player"`; other targets aren't tracked yet).
+PLAYER_TARGETED = {"hp_change", "max_hp_change", "status_effect", "status_removed"}
+
+
+def apply_event(state: Dict, meta: Dict, seq: int):
+    """Applies one turn's metadata to `state` in place."""
+    on_player = meta.get("target") in (None, "player")
+    for key, value in meta.items():
+        handler = EVENT_HANDLERS.get(key)
+        if handler and (on_player or key not in PLAYER_TARGETED):
+            handler(state, value, seq)
+
+
+def _copy_state(state: Dict) -> Dict:
+    return {
+        **state,
+        "inventory": dict(state["inventory"]),
+        "npcs": dict(state["npcs"]),
+        "status_effects": list(state["status_effects"]),
+    }
+
+
+def apply_entries(snapshot: Dict, entries: Iterable[Dict]) -> Dict:
+    """A new snapshot with the journal entries following `snapshot` folded in."""
+    state, version, events = None, snapshot["version"], snapshot["events"]
+    for entry in entries:
+        meta = entry.get("meta") if entry.get("role") == "assistant" else None
+        if isinstance(meta, dict) and "error" not in meta:
+            if state is None:
+                state = _copy_state(snapshot["state"])
+            apply_event(state, meta, version)
+            events += 1
+        version += 1
+    return {**snapshot, "version": version, "events": events, "state": state or snapshot["state"]}
+
+
+def update_state(backend, user_code: str, campaign_id: str) -> Optional[Dict]:
+    """
+    Brings the campaign's state snapshot up to the end of its journal, applying
+    only the entries after the snapshot's version, and returns it. Returns None
+    if the campaign has no journal.
+    """
+    length = backend.journal_length(user_code, campaign_id)
+    if length is None:
+        return None
+    snapshot = backend.get_campaign_state(user_code, campaign_id)
+    if (snapshot is None or snapshot.get("schema") != SNAPSHOT_SCHEMA
+            or snapshot.get("version", 0) > length):
+        snapshot = empty_snapshot()
+    if snapshot["version"] == length:
+        return snapshot
+
+    entries = backend.read_journal(user_code, campaign_id, snapshot["version"], length) or []
+    snapshot = apply_entries(snapshot, entries)
+    backend.save_campaign_state(user_code, campaign_id, snapshot)
+    return snapshot
@@ -1,16 +1,34 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
-from server.api import auth, users, rooms, campaigns, dice, ai
+from server.api import auth, users, rooms, campaigns, dice, ai, cluster as cluster_api, metrics as metrics_api
+from server.api.compression import APICompressionMiddleware, PrecompressedStaticFiles
+from server.core import cluster, storage
+from server.core.ai_client import client as ai_client
 from server.core.config import ROOT_DIR
+from server.core.room_hub import hub as room_hub
+from server.core.room_registry import registry as room_registry
+
+# --- Startup & Shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ai_client.start()
+    await storage.run_blocking(frontend.precompress)
+    room_registry.start()
+    room_hub.start()
+    yield
+    await room_hub.stop()
+    await room_registry.stop()
+    await cluster.stop()
 
 # --- App Initialization ---
 app = FastAPI(
     title="Neuro D&D API",
     description="The backend server for the Neuro D&D project.",
     version="1.0.a",
+    lifespan=lifespan,
 )
 
 # --- CORS Middleware ---
@@ -21,8 +39,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],   # Allow all methods
     allow_headers=["*"],   # Allow all headers
+    expose_headers=["X-Next-Cursor"],  # Campaign list pagination
 )
 
+# --- Response Compression ---
+# Gzips large API responses, streaming ones included. Inside the worker
+# routing, so the owning worker compresses what it sends.
+app.add_middleware(APICompressionMiddleware)
+
+# --- Metrics ---
+# Per-route request counts and latencies (GET /api/metrics). Outside the
+# compression, so durations include it; inside the worker routing, so each
+# request is counted once, by the worker that serves it.
+app.add_middleware(metrics_api.MetricsMiddleware)
+
+# --- Worker Routing ---
+# With several workers (server/core/cluster.py), requests for rooms and
+# campaigns go to the worker that owns them. Outermost, so forwarded
+# responses come back exactly as the owner produced them.
+app.add_middleware(cluster_api.ClusterRouter)
+
 # --- API Routers ---
 # Include all the API endpoints from the /api directory
 app.include_router(auth.router, prefix="/api")
@@ -31,6 +67,8 @@ app.include_router(rooms.router, prefix="/api")
 app.include_router(campaigns.router, prefix="/api")
 app.include_router(dice.router, prefix="/api")
 app.include_router(ai.router, prefix="/api")
+app.include_router(metrics_api.router, prefix="/api")
+app.include_router(cluster_api.router)
 
 
 # --- Health Check Endpoint ---
@@ -42,6 +80,7 @@ async def health_check():
 
 # --- Static Files Mounting ---
 # This must be placed last, as it will catch all other routes.
-# It serves the frontend application (index.html, css, js).
+# It serves the frontend application (index.html, css, js), precompressed at startup.
 frontend_path = ROOT_DIR / "frontend"
-app.mount("/", StaticFiles(directory=frontend_path, html=True), name="static")
+frontend = PrecompressedStaticFiles(directory=frontend_path, html=True)
+app.mount("/", frontend, name="static")
@@ -0,0 +1,56 @@
+import sys
+import os
+import warnings
+
+import pytest
+
+# Add the project root to the Python path to allow for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.api import auth
+from server.core import config, storage
+from server.core.room_hub import hub as room_hub
+from server.core.room_registry import registry as room_registry
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Points the storage layer at an empty, temporary data directory."""
+    for name in config.DATA_DIR_SETTINGS:
+        monkeypatch.setattr(config, name, getattr(config, name))  # restored after the test
+    config.use_data_dir(tmp_path)
+    storage.clear_read_cache()
+    storage.set_backend(None)
+    room_registry.reset()
+    room_hub.reset()
+    auth._principal_cache.clear()
+    yield tmp_path
+    auth._principal_cache.clear()
+    room_hub.reset()
+    room_registry.reset()
+    storage.set_backend(None)
+    storage.clear_read_cache()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, data_dir, monkeypatch):
+    """Runs the test once per storage backend."""
+    monkeypatch.setattr(config, "STORAGE_BACKEND", request.param)
+    storage.set_backend(None)
+    room_registry.reset()
+    return storage.get_backend()
+
+
+@pytest.fixture
+def app(backend):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)  # google.generativeai deprecation notice
+        from server.main import app
+    return app
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+    with TestClient(app) as test_client:
+        yield test_client
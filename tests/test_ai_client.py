@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.core import config
+from server.core.ai_client import PromptTemplate, build_prompt
+from server.core.models import CampaignMeta, Message
+
+
+def test_prompt_template_reloads_on_change(tmp_path):
+    print("Testing prompt template caching and reload...")
+    system_file, examples_file = tmp_path / "system_prompt.txt", tmp_path / "examples.md"
+    system_file.write_text("You are the DM.", encoding="utf-8")
+    examples_file.write_text("## Example 1", encoding="utf-8")
+    template = PromptTemplate(system_file, examples_file)
+
+    head = template.head()
+    assert "You are the DM." in head and "## Example 1" in head
+    assert template.head() is head and template.compiles == 1
+
+    examples_file.write_text("## Example 2", encoding="utf-8")
+    os.utime(examples_file, ns=(1, 1)) # Force a different mtime even on coarse clocks
+    assert "## Example 2" in template.head() and template.compiles == 2
+    print("OK")
+
+
+def test_build_prompt_single_pass():
+    print("Testing prompt assembly...")
+    template = PromptTemplate(config.SYSTEM_PROMPT_FILE, config.EXAMPLES_FILE)
+    meta = CampaignMeta(name="Crypt", tone="cosmic_horror", host_user_code="host")
+    messages = [Message(role="user", content="I open the door."),
+                Message(role="assistant", content="It creaks.")]
+
+    prompt, cost = build_prompt(template, meta, "en", messages)
+    assert prompt.startswith(template.head())
+    assert "Few-shot Examples" in prompt # examples.md is part of the template
+    assert "- Tone: cosmic_horror\n" in prompt and "- Language: en\n" in prompt
+    assert prompt.endswith("**User:** I open the door.\n**Assistant:** It creaks.\n")
+    assert cost["chars"] == len(prompt) and cost["messages"] == 2 and cost["build_ms"] >= 0
+    print("OK")
+
+
+def test_streaming_parser_holds_back_metadata():
+    print("Testing the incremental response parser...")
+    from server.api.ai import StreamingResponseParser, parse_ai_response
+
+    reply = '  The door opens.\n\nA draft.\n\n```json\n{"mood": "tense", "note": "``"}\n```\n'
+    expected = parse_ai_response(reply)
+    for size in (1, 2, 3, 7, len(reply)):
+        parser = StreamingResponseParser()
+        shown = [parser.feed(reply[i:i + size]) for i in range(0, len(reply), size)] + [parser.close()]
+        assert "".join(shown) == parser.text == expected.text
+        assert not any("`" in text for text in shown)
+        assert parser.meta == expected.meta == {"mood": "tense", "note": "``"}
+
+    parser = StreamingResponseParser() # An unterminated block is narrative after all
+    assert parser.feed("Hi ```json\n{") == "Hi"
+    assert parser.close() == " ```json\n{" and parser.meta is None
+    print("OK")
@@ -0,0 +1,585 @@
+import asyncio
+import time
+
+import httpx
+
+
+def _register(client, email="player@example.com", username="player"):
+    response = client.post("/api/auth/register", json={"email": email, "password": "pw", "username": username})
+    assert response.status_code == 200
+    return {"X-User-Code": response.json()["user_code"]}
+
+
+def test_campaign_lifecycle(client):
+    print("Testing campaign create/append/read/delete...")
+    headers = _register(client)
+
+    campaign = client.post("/api/campaigns", json={"name": "Test"}, headers=headers).json()
+    for i in range(3):
+        response = client.post(
+            f"/api/campaigns/{campaign['id']}/journal",
+            json={"message": {"role": "user", "content": f"turn {i}"}},
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+    details = client.get(f"/api/campaigns/{campaign['id']}", headers=headers).json()
+    assert [e["content"] for e in details["journal"]["entries"]] == ["turn 0", "turn 1", "turn 2"]
+    assert [c["id"] for c in client.get("/api/campaigns", headers=headers).json()] == [campaign["id"]]
+
+    assert client.delete(f"/api/campaigns/{campaign['id']}", headers=headers).status_code == 204
+    assert client.get(f"/api/campaigns/{campaign['id']}", headers=headers).status_code == 404
+    print("OK")
+
+
+def test_campaign_listing_pages(client):
+    print("Testing campaign listing pagination...")
+    headers = _register(client)
+    ids = [client.post("/api/campaigns", json={"name": f"c{i}", "tone": "grim" if i % 2 else "epic_fantasy"},
+                       headers=headers).json()["id"] for i in range(5)]
+    client.patch(f"/api/campaigns/{ids[0]}", json={"status": "archived"}, headers=headers)
+    assert client.patch(f"/api/campaigns/{ids[0]}", json={"status": "bogus"}, headers=headers).status_code == 400
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "order": "asc", **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/campaigns", params=params, headers=headers)
+        seen += [c["id"] for c in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ids
+    # Cross-origin pages can read the cursor too.
+    response = client.get("/api/campaigns", params={"limit": 2}, headers={**headers, "Origin": "http://elsewhere.test"})
+    assert "X-Next-Cursor" in response.headers["access-control-expose-headers"]
+
+    archived = client.get("/api/campaigns", params={"status": "archived"}, headers=headers).json()
+    assert [c["id"] for c in archived] == [ids[0]]
+    grim = client.get("/api/campaigns", params={"tone": "grim"}, headers=headers).json()
+    assert [c["id"] for c in grim] == [ids[3], ids[1]]
+    assert client.get("/api/campaigns", params={"cursor": "nonsense"}, headers=headers).status_code == 400
+    print("OK")
+
+
+def test_checkpoint_and_restore(client):
+    print("Testing checkpoint and restore endpoints...")
+    headers = _register(client)
+    campaign_id = client.post("/api/campaigns", json={"name": "Saga"}, headers=headers).json()["id"]
+    url = f"/api/campaigns/{campaign_id}"
+    client.post(f"{url}/journal", json={"message": {"role": "user", "content": "kept"}}, headers=headers)
+    saved = client.post(f"{url}/checkpoint", headers=headers).json()["checkpoint"]
+    client.post(f"{url}/journal", json={"message": {"role": "user", "content": "undone"}}, headers=headers)
+
+    assert [c["name"] for c in client.get(f"{url}/checkpoints", headers=headers).json()] == [saved["name"]]
+    restored = client.post(f"{url}/checkpoints/{saved['name']}/restore", headers=headers)
+    assert restored.status_code == 200 and restored.json()["next_seq"] == 1
+    assert [e["content"] for e in client.get(url, headers=headers).json()["journal"]["entries"]] == ["kept"]
+    assert client.post(f"{url}/checkpoints/nope/restore", headers=headers).status_code == 404
+
+    # A journal cut short behind the checkpoints' back can't be checkpointed on top of them.
+    from server.core import storage
+    storage.get_backend().truncate_journal(headers["X-User-Code"], campaign_id, 0)
+    assert client.post(f"{url}/checkpoint", headers=headers).status_code == 409
+    print("OK")
+
+
+def test_restore_requires_ownership(client, backend):
+    print("Testing that only the owner can restore a campaign's checkpoints...")
+    from server.core import checkpoints
+
+    owner = _register(client)
+    other = _register(client, email="other@example.com", username="other")
+    campaign_id = client.post("/api/campaigns", json={"name": "Saga"}, headers=owner).json()["id"]
+    url = f"/api/campaigns/{campaign_id}"
+    client.post(f"{url}/journal", json={"message": {"role": "user", "content": "kept"}}, headers=owner)
+    saved = client.post(f"{url}/checkpoint", headers=owner).json()["checkpoint"]
+    client.post(f"{url}/journal", json={"message": {"role": "user", "content": "later"}}, headers=owner)
+
+    assert client.post(f"{url}/checkpoints/{saved['name']}/restore", headers=other).status_code == 404
+    assert client.get(f"{url}/checkpoints", headers=other).status_code == 404
+    # Below the API too: another user's checkpoints, summaries and dice streams aren't visible.
+    other_code = other["X-User-Code"]
+    assert checkpoints.restore_checkpoint(backend, other_code, campaign_id, saved["name"]) is None
+    assert backend.read_checkpoint(other_code, campaign_id, saved["name"]) is None
+    assert backend.get_rng_stream(other_code, campaign_id) is None
+    assert backend.get_campaign_meta(other_code, campaign_id) is None
+
+    entries = client.get(url, headers=owner).json()["journal"]["entries"]
+    assert [e["content"] for e in entries] == ["kept", "later"]
+    print("OK")
+
+
+def test_concurrent_registrations_keep_index(app):
+    print("Testing concurrent registrations...")
+
+    async def register_many():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*[
+                client.post("/api/auth/register", json={"email": f"u{i}@example.com", "password": "pw", "username": f"u{i}"})
+                for i in range(20)
+            ])
+            assert all(r.status_code == 200 for r in responses)
+            logins = await asyncio.gather(*[
+                client.post("/api/auth/login", json={"email": f"u{i}@example.com", "password": "pw"})
+                for i in range(20)
+            ])
+            assert all(r.status_code == 200 for r in logins)
+
+            duplicates = await asyncio.gather(*[
+                client.post("/api/auth/register", json={"email": "same@example.com", "password": "pw", "username": f"d{i}"})
+                for i in range(5)
+            ])
+            assert sorted(r.status_code for r in duplicates) == [200, 409, 409, 409, 409]
+
+    asyncio.run(register_many())
+    print("OK")
+
+
+def test_failed_registration_frees_email(client, backend, monkeypatch):
+    print("Testing that a failed registration doesn't lock the email out...")
+    import pytest
+    from server.core import config, storage
+
+    save_user_profile = storage.asave_user_profile
+
+    async def failing_save(profile):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage, "asave_user_profile", failing_save)
+    with pytest.raises(OSError):
+        client.post("/api/auth/register", json={"email": "late@example.com", "password": "pw", "username": "late"})
+    monkeypatch.setattr(storage, "asave_user_profile", save_user_profile)
+
+    headers = _register(client, email="late@example.com", username="late")
+    login = client.post("/api/auth/login", json={"email": "late@example.com", "password": "pw"})
+    assert login.status_code == 200 and login.json()["user_code"] == headers["X-User-Code"]
+
+    # The loser of an email conflict leaves no profile behind.
+    if isinstance(backend, storage.JsonFileBackend):
+        users_before = len(list(config.USERS_DIR.iterdir()))
+        assert client.post("/api/auth/register", json={
+            "email": "late@example.com", "password": "pw", "username": "again"}).status_code == 409
+        assert len(list(config.USERS_DIR.iterdir())) == users_before
+    print("OK")
+
+
+def test_rooms_create_and_join(client):
+    print("Testing room create/join...")
+    host = _register(client, "host@example.com", "host")
+    guest = _register(client, "guest@example.com", "guest")
+
+    room = client.post("/api/rooms", json={"is_public": True, "name": "Tavern"}, headers=host).json()
+    response = client.post("/api/rooms/join", json={"room_code": room["room_code"].lower()}, headers=guest)
+    assert response.status_code == 200
+
+    details = client.get(f"/api/rooms/{room['room_code']}").json()
+    assert details["players"] == [host["X-User-Code"], guest["X-User-Code"]]
+    assert client.post("/api/rooms/join", json={"room_code": "ZZZZZ"}, headers=guest).status_code == 404
+    print("OK")
+
+
+def test_session_token_auth(client):
+    print("Testing session token authentication...")
+    response = client.post("/api/auth/register", json={"email": "token@example.com", "password": "pw", "username": "token"})
+    token = response.json()["session_token"]
+    bearer = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/api/auth/me", headers=bearer).json()["username"] == "token"
+    assert client.put("/api/users/profile", json={"username": "renamed"}, headers=bearer).status_code == 200
+    assert client.get("/api/auth/me", headers=bearer).json()["username"] == "renamed"
+
+    renewed = client.post("/api/auth/session", headers=bearer).json()
+    assert client.get("/api/auth/me", headers={"Authorization": f"Bearer {renewed['session_token']}"}).status_code == 200
+    assert client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}x"}).status_code == 401
+    print("OK")
+
+
+def test_journal_ranged_reads(client):
+    print("Testing ranged and delta journal reads...")
+    headers = _register(client)
+    campaign_id = client.post("/api/campaigns", json={"name": "Long"}, headers=headers).json()["id"]
+    url = f"/api/campaigns/{campaign_id}/journal"
+    for i in range(10):
+        appended = client.post(url, json={"message": {"role": "user", "content": f"turn {i}"}}, headers=headers).json()
+        assert appended["seq"] == i and appended["entry"]["content"] == f"turn {i}"
+
+    tail = client.get(url, params={"tail": 3}, headers=headers).json()
+    assert [e["seq"] for e in tail["entries"]] == [7, 8, 9] and tail["next_seq"] == 10
+    page = client.get(url, params={"offset": 2, "limit": 3}, headers=headers).json()
+    assert [e["content"] for e in page["entries"]] == ["turn 2", "turn 3", "turn 4"] and page["next_seq"] == 10
+    delta = client.get(url, params={"since_seq": 8}, headers=headers).json()
+    assert [e["seq"] for e in delta["entries"]] == [9]
+
+    since = tail["entries"][0]["timestamp"]
+    by_time = client.get(url, params={"since": since}, headers=headers).json()
+    assert [e["seq"] for e in by_time["entries"]] == [8, 9]
+    first = client.get(url, params={"since": since, "limit": 1}, headers=headers).json()
+    assert [e["seq"] for e in first["entries"]] == [8] and first["next_seq"] == 9
+
+    details = client.get(f"/api/campaigns/{campaign_id}", params={"tail": 1}, headers=headers).json()
+    assert [e["seq"] for e in details["journal"]["entries"]] == [9]
+    assert client.get(url, params={"tail": -1}, headers=headers).status_code == 400
+    print("OK")
+
+
+def test_dice_bulk(client):
+    print("Testing bulk dice expression rolls...")
+    from server.core import config
+
+    headers = _register(client)
+    response = client.post("/api/dice/bulk", headers=headers, json={
+        "rolls": [{"expression": "8d6", "times": 1000}, {"expression": "d20 adv + 5"}], "seed": 42})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["dice_rolled"] == 8002
+    fireballs, attack = body["results"]
+    assert fireballs["expression"] == "8d6" and len(fireballs["totals"]) == 1000 and fireballs.get("rolls") is None
+    assert attack["expression"] == "2d20kh1+5" and 6 <= attack["totals"][0] <= 25
+    assert client.post("/api/dice/bulk", headers=headers, json={
+        "rolls": [{"expression": "8d6", "times": 1000}, {"expression": "d20 adv + 5"}], "seed": 42}).json() == body
+
+    breakdown = client.post("/api/dice/bulk", headers=headers, json={
+        "rolls": [{"expression": "4d6kh3", "times": 2}], "breakdown": True}).json()["results"][0]
+    assert [len(roll["terms"][0]["rolls"]) for roll in breakdown["rolls"]] == [4, 4]
+    assert [roll["total"] for roll in breakdown["rolls"]] == breakdown["totals"]
+
+    for bad in ({"rolls": [{"expression": "2d6x"}]}, {"rolls": [{"expression": "d6", "times": 0}]}, {"rolls": []},
+                {"rolls": [{"expression": "1000d6", "times": config.DICE_MAX_DICE_PER_REQUEST}]},
+                {"rolls": [{"expression": "100d6", "times": 1000}], "breakdown": True}):
+        assert client.post("/api/dice/bulk", headers=headers, json=bad).status_code == 400, bad
+    print("OK")
+
+
+def test_campaign_roll_replay(client):
+    print("Testing campaign RNG streams and roll replay...")
+    headers = _register(client)
+    campaign = client.post("/api/campaigns", json={"name": "Dice"}, headers=headers).json()
+
+    rolled = []
+    for _ in range(3):
+        body = client.post("/api/dice/bulk", headers=headers, json={
+            "campaign_id": campaign["id"], "rolls": [{"expression": "8d6", "times": 10}, {"expression": "d20adv"}]}).json()
+        rolled.extend(body["results"])
+    assert [result["roll"] for result in rolled] == list(range(6))
+
+    # Every logged roll is regenerated, in any order and in one call
+    log = [{"roll": r["roll"], "expression": r["expression"], "times": r["times"], "totals": r["totals"]}
+           for r in reversed(rolled)]
+    replay = client.post("/api/dice/replay", headers=headers, json={"campaign_id": campaign["id"], "rolls": log}).json()
+    assert replay["verified"] and [r["totals"] for r in replay["results"]] == [r["totals"] for r in reversed(rolled)]
+
+    log[0]["totals"] = [0]
+    replay = client.post("/api/dice/replay", headers=headers, json={"campaign_id": campaign["id"], "rolls": log}).json()
+    assert not replay["verified"] and replay["results"][0]["matches"] is False and replay["results"][1]["matches"]
+
+    # Future rolls can't be previewed, and a stream belongs to its campaign
+    future = {"campaign_id": campaign["id"], "rolls": [{"roll": 6, "expression": "d20"}]}
+    assert client.post("/api/dice/replay", headers=headers, json=future).status_code == 400
+    other = _register(client, email="other@example.com", username="other")
+    assert client.post("/api/dice/replay", headers=other, json=future).status_code == 404
+    assert client.post("/api/dice/bulk", headers=headers, json={
+        "campaign_id": campaign["id"], "seed": 1, "rolls": [{"expression": "d20"}]}).status_code == 400
+    print("OK")
+
+
+def test_dice_probability(client):
+    print("Testing dice success probabilities...")
+    headers = _register(client)
+    response = client.post("/api/dice/probability", headers=headers, json={"expression": "d20", "modifier": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["expression"] == "1d20" and body["mean"] == 10.5
+    assert body["success"]["easy"] == {"dc": 10, "probability": 0.65} and body.get("distribution") is None
+
+    body = client.post("/api/dice/probability", headers=headers, json={"expression": "d20adv", "distribution": True}).json()
+    assert body["distribution"]["values"] == list(range(1, 21))
+    assert abs(body["distribution"]["pmf"][-1] - 39 / 400) < 1e-12 and abs(body["distribution"]["cdf"][-1] - 1) < 1e-12
+
+    assert client.post("/api/dice/probability", headers=headers, json={"expression": "1000d6kh500"}).status_code == 400
+    # Few dice but many faces: the kept sums' range counts towards the work bound too.
+    for expression in ("40d1000kh39", "100d100kl99", "12d1000kh11"):
+        start = time.perf_counter()
+        response = client.post("/api/dice/probability", headers=headers, json={"expression": expression})
+        assert response.status_code == 400 and time.perf_counter() - start < 1, expression
+    assert client.post("/api/dice/probability", headers=headers, json={"expression": "2d6x"}).status_code == 400
+    print("OK")
+
+
+def test_ai_complete(client, monkeypatch):
+    print("Testing /ai/complete with the fake model...")
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    prompts = []
+
+    class RecordingModel(FakeModel):
+        def generate_content(self, prompt, stream=False):
+            prompts.append(prompt)
+            return super().generate_content(prompt, stream)
+
+    monkeypatch.setattr(ai_client, "model", RecordingModel(reply='The door opens.\n```json\n{"mood": "tense"}\n```'))
+    headers = _register(client)
+    campaign = client.post("/api/campaigns", json={"name": "Crypt"}, headers=headers).json()
+
+    response = client.post("/api/ai/complete", headers=headers, json={
+        "campaign_id": campaign["id"], "messages": [{"role": "user", "content": "I open the door."}]})
+    assert response.status_code == 200
+    assert response.json() == {"text": "The door opens.", "meta": {"mood": "tense"}}
+    assert int(response.headers["X-Prompt-Chars"]) == len(prompts[0])
+    assert float(response.headers["X-Prompt-Build-Ms"]) >= 0
+    assert prompts[0].endswith("**User:** I open the door.\n")
+    print("OK")
+
+
+def test_campaign_state(client, monkeypatch):
+    print("Testing campaign state from AI metadata...")
+    from server.core.ai_client import FakeModel, client as ai_client
+    from server.game_logic import rules
+
+    headers = _register(client)
+    campaign = client.post("/api/campaigns", json={"name": "Crypt"}, headers=headers).json()
+    state = client.get(f"/api/campaigns/{campaign['id']}/state", headers=headers).json()
+    assert state["version"] == 0 and state["state"]["hp"] == rules.STARTING_HP
+
+    for meta in ('{"location": "crypt", "hp_change": -4, "target": "player"}',
+                 '{"item_found": "silver key", "new_npc_introduced": "Morwen"}'):
+        monkeypatch.setattr(ai_client, "model", FakeModel(reply=f"Something happens.\n```json\n{meta}\n```"))
+        client.post("/api/ai/complete", headers=headers, json={
+            "campaign_id": campaign["id"], "messages": [{"role": "user", "content": f"I act {meta}."}]})
+
+    state = client.get(f"/api/campaigns/{campaign['id']}/state", headers=headers).json()
+    assert state["version"] == 4 and state["events"] == 2
+    assert state["state"]["hp"] == rules.STARTING_HP - 4 and state["state"]["location"] == "crypt"
+    assert state["state"]["inventory"] == {"silver key": 1} and "Morwen" in state["state"]["npcs"]
+    assert client.get(f"/api/campaigns/{'0' * 8}-0000-0000-0000-{'0' * 12}/state", headers=headers).status_code == 404
+    print("OK")
+
+
+def test_ai_context_from_journal(client, monkeypatch):
+    print("Testing server-side AI context from the journal...")
+    from server.core import config
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    prompts = []
+
+    class RecordingModel(FakeModel):
+        def generate_content(self, prompt, stream=False):
+            prompts.append(prompt)
+            return super().generate_content(prompt, stream)
+
+    monkeypatch.setattr(ai_client, "model", RecordingModel())
+    monkeypatch.setattr(config, "AI_CONTEXT_RECENT_TURNS", 4)
+    monkeypatch.setattr(config, "AI_SUMMARY_SEGMENT_ENTRIES", 10)
+    headers = _register(client)
+    campaign = client.post("/api/campaigns", json={"name": "Saga"}, headers=headers).json()
+    for i in range(60):
+        client.post(f"/api/campaigns/{campaign['id']}/journal", headers=headers, json={"message": {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Event {i} unfolds. " + "The story goes on and on. " * 10}})
+
+    response = client.post("/api/ai/complete", headers=headers, json={
+        "campaign_id": campaign["id"], "messages": [{"role": "user", "content": "I light a torch."}]})
+    assert response.status_code == 200
+    prompt = prompts[-1]
+    assert "## Story So Far\n" in prompt and "Player: Event 0 unfolds." in prompt
+    assert "Event 0 unfolds. The story" not in prompt and "Event 59 unfolds. The story" in prompt
+    assert prompt.endswith("**User:** I light a torch.\n")
+    assert int(response.headers["X-Context-Tokens"]) < int(response.headers["X-Context-Full-Tokens"])
+    assert float(response.headers["X-Context-Reduction"]) > 0.5
+
+    # The turn is recorded, so the next call sees it without the client resending it
+    journal = client.get(f"/api/campaigns/{campaign['id']}/journal", params={"tail": 2}, headers=headers).json()
+    assert [e["role"] for e in journal["entries"]] == ["user", "assistant"]
+    assert journal["entries"][0]["content"] == "I light a torch." and journal["entries"][1]["meta"]["mood"] == "tense"
+    client.post("/api/ai/complete", headers=headers, json={
+        "campaign_id": campaign["id"], "messages": [{"role": "user", "content": "I go down."}]})
+    assert "**User:** I light a torch.\n**Assistant:** The torchlight trembles" in prompts[-1]
+    print("OK")
+
+
+async def _stream_post(app, path, headers, body):
+    """Drives the ASGI app directly, timestamping each body chunk as it is sent."""
+    start = time.perf_counter()
+    chunks, requested = [], False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait() # The client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append((time.perf_counter() - start, message["body"]))
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+             "client": ("test", 1), "server": ("test", 80)}
+    await app(scope, receive, send)
+    return chunks
+
+
+def test_ai_stream(app, monkeypatch):
+    print("Testing /ai/stream (SSE) time-to-first-token...")
+    from server.core import serialization
+    from server.core.ai_client import FAKE_REPLY, FakeModel, client as ai_client
+    from server.api.ai import parse_ai_response
+
+    # ~18 chunks, 20 ms apart: the whole reply takes ~0.35 s, the first token ~0.02 s.
+    model = FakeModel(first_token_delay=0.02, chunk_delay=0.02, chunk_chars=16)
+    monkeypatch.setattr(ai_client, "model", model)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.post("/api/auth/register", json={"email": "s@example.com", "password": "pw", "username": "s"})
+            headers = {"X-User-Code": response.json()["user_code"], "Content-Type": "application/json"}
+            campaign = (await http.post("/api/campaigns", json={"name": "Crypt"}, headers=headers)).json()
+        body = serialization.dumps({"campaign_id": campaign["id"],
+                                    "messages": [{"role": "user", "content": "I open the door."}]})
+        return await _stream_post(app, "/api/ai/stream", headers, body)
+
+    chunks = asyncio.run(scenario())
+    events = []
+    for block in b"".join(body for _, body in chunks).decode().split("\n\n"):
+        if block:
+            event, data = block.split("\n")
+            events.append((event[len("event: "):], serialization.loads(data[len("data: "):])))
+
+    expected = parse_ai_response(FAKE_REPLY)
+    assert [name for name, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    assert events[-1] == ("done", {"text": expected.text, "meta": expected.meta})
+    assert "".join(data["text"] for _, data in events[:-1]) == expected.text
+    assert not any("```" in data["text"] for _, data in events[:-1])
+
+    first_token, total = chunks[0][0], chunks[-1][0]
+    print(f"time to first token {first_token * 1000:.0f} ms, full response {total * 1000:.0f} ms")
+    assert len(events) > 5 and first_token < total / 3
+    print("OK")
+
+
+def test_ai_calls_off_event_loop_and_shed(app, monkeypatch):
+    print("Testing that model calls don't block the event loop and are shed when saturated...")
+    from server.core import llm_dispatch
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    monkeypatch.setattr(ai_client, "model", FakeModel(first_token_delay=0.3))
+    monkeypatch.setattr(llm_dispatch, "dispatcher",
+                        llm_dispatch.LLMDispatcher(max_concurrency=1, max_per_user=1, queue_size=0))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            headers = []
+            for name in ("a", "b"):
+                response = await http.post("/api/auth/register",
+                                           json={"email": f"{name}@example.com", "password": "pw", "username": name})
+                headers.append({"X-User-Code": response.json()["user_code"]})
+            campaign = (await http.post("/api/campaigns", json={"name": "Crypt"}, headers=headers[0])).json()
+            other = (await http.post("/api/campaigns", json={"name": "Keep"}, headers=headers[1])).json()
+            body = {"messages": [{"role": "user", "content": "I open the door."}]}
+
+            slow = asyncio.ensure_future(http.post("/api/ai/complete", headers=headers[0],
+                                                   json={**body, "campaign_id": campaign["id"]}))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            assert (await http.get("/api/health")).status_code == 200
+            health = time.perf_counter() - start
+
+            shed = await http.post("/api/ai/complete", headers=headers[1], json={**body, "campaign_id": other["id"]})
+            queue = (await http.get("/api/ai/queue", headers=headers[1])).json()
+            return (await slow), health, shed, queue
+
+    slow, health, shed, queue = asyncio.run(scenario())
+    assert slow.status_code == 200
+    assert health < 0.15 # Answered while the 300 ms model call was in flight
+    assert shed.status_code == 503 and shed.headers["Retry-After"]
+    assert queue["running"] == 1 and queue["rejected_queue_full"] == 1
+    print("OK")
+
+
+def test_ai_turns_are_serialized(app, monkeypatch):
+    print("Testing that concurrent turns on one campaign don't interleave...")
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    class RecordingModel(FakeModel):
+        def __init__(self):
+            super().__init__(reply="The hall echoes.", first_token_delay=0.1)
+            self.prompts = []
+
+        def generate_content(self, prompt, stream=False):
+            self.prompts.append(prompt)
+            return super().generate_content(prompt, stream)
+
+    model = RecordingModel()
+    monkeypatch.setattr(ai_client, "model", model)
+    actions = ["I open the door.", "I light a torch.", "I call out."]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.post("/api/auth/register", json={"email": "t@example.com", "password": "pw", "username": "t"})
+            headers = {"X-User-Code": response.json()["user_code"]}
+            campaign_id = (await http.post("/api/campaigns", json={"name": "Hall"}, headers=headers)).json()["id"]
+
+            def body(action):
+                return {"campaign_id": campaign_id, "messages": [{"role": "user", "content": action}]}
+
+            await asyncio.gather(
+                http.post("/api/ai/complete", headers=headers, json=body(actions[0])),
+                http.post("/api/ai/stream", headers=headers, json=body(actions[1])),
+                http.post("/api/ai/complete", headers=headers, json=body(actions[2])),
+            )
+            return (await http.get(f"/api/campaigns/{campaign_id}/journal", headers=headers)).json()
+
+    journal = asyncio.run(scenario())
+    assert [e["role"] for e in journal["entries"]] == ["user", "assistant"] * 3
+    # Each prompt was built after the turns before it were recorded.
+    for i, prompt in enumerate(model.prompts):
+        earlier = [e["content"] for e in journal["entries"][:2 * i:2]]
+        assert all(action in prompt for action in earlier)
+    print("OK")
+
+
+def test_ai_complete_coalesces_duplicates(app, monkeypatch):
+    print("Testing single-flight coalescing and Idempotency-Key...")
+    from server.api import ai
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    model = FakeModel(first_token_delay=0.2)
+    monkeypatch.setattr(ai_client, "model", model)
+    before = ai.get_completion_stats()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.post("/api/auth/register", json={"email": "c@example.com", "password": "pw", "username": "c"})
+            headers = {"X-User-Code": response.json()["user_code"]}
+            campaign = (await http.post("/api/campaigns", json={"name": "Crypt"}, headers=headers)).json()
+            body = {"campaign_id": campaign["id"], "messages": [{"role": "user", "content": "I open the door."}]}
+
+            burst = await asyncio.gather(*(http.post("/api/ai/complete", headers=headers, json=body) for _ in range(5)))
+            retry = await http.post("/api/ai/complete", headers=headers, json=body)
+
+            keyed = {**headers, "Idempotency-Key": "turn-2"}
+            other = {**body, "messages": [{"role": "user", "content": "I go down."}]}
+            first = await http.post("/api/ai/complete", headers=keyed, json=other)
+            again = await http.post("/api/ai/complete", headers=keyed, json=other)
+            misused = await http.post("/api/ai/complete", headers=keyed, json=body)
+            journal = (await http.get(f"/api/campaigns/{campaign['id']}/journal", headers=headers)).json()
+            return burst, retry, first, again, misused, journal
+
+    burst, retry, first, again, misused, journal = asyncio.run(scenario())
+    assert all(r.status_code == 200 and r.json() == burst[0].json() for r in burst)
+    assert retry.status_code == 200
+    assert sorted(r.headers["X-AI-Call"] for r in burst) == ["coalesced"] * 4 + ["executed"]
+    assert retry.headers["X-AI-Call"] == "executed" # Finished: the same action again is a new turn
+    assert (first.headers["X-AI-Call"], again.headers["X-AI-Call"]) == ("executed", "replayed")
+    assert misused.status_code == 422
+    assert model.calls == 3 and len(journal["entries"]) == 6 # One recorded turn per model call
+
+    stats = ai.get_completion_stats()
+    assert stats["executed"] - before["executed"] == 3 and stats["saved"] - before["saved"] == 6
+    print("OK")
@@ -0,0 +1,125 @@
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import httpx
+from websockets.sync.client import connect
+
+from server.api.cluster import route_key
+from server.core import cluster, config
+from server.core.room_registry import RoomRegistry
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_cluster_ownership_and_routing(backend, monkeypatch):
+    print("Testing worker ownership and request routing keys...")
+    campaign_id = "0f8fad5b-d9cb-469f-a165-70867728950e"
+    assert route_key(f"/api/campaigns/{campaign_id.upper()}/journal") == campaign_id
+    assert route_key("/api/rooms/ab12/ws") == "AB12"
+    assert route_key("/api/rooms/public") is None and route_key("/api/rooms/join") is None
+    assert route_key("/api/rooms/join", b'{"room_code": "ab12"}') == "AB12"
+    assert route_key("/api/ai/stream", f'{{"campaign_id": "{campaign_id}"}}'.encode()) == campaign_id
+    assert route_key("/api/rooms", b'{"is_public": true}') is None
+    assert route_key("/api/dice/bulk", b"not json") is None
+    assert route_key("/api/campaigns") is None and route_key("/api/dice/roll") is None
+
+    monkeypatch.setattr(config, "WORKERS", 4)
+    owners = [cluster.owner(f"{i:04d}") for i in range(1000)]
+    assert set(owners) == {0, 1, 2, 3} and max(owners.count(w) for w in range(4)) < 300
+    assert cluster.owner(campaign_id) == cluster.owner(campaign_id) # Stable, unlike hash()
+
+    # A worker only creates, and only loads, rooms it owns.
+    monkeypatch.setattr(config, "WORKER_ID", 2)
+
+    async def scenario():
+        registry = RoomRegistry()
+        codes = [(await registry.create("host", None, is_public=True))["room_code"] for _ in range(10)]
+        assert all(cluster.owner(code) == 2 for code in codes)
+        monkeypatch.setattr(config, "WORKER_ID", 1)
+        assert await RoomRegistry().list_public() == []
+
+    asyncio.run(scenario())
+    print("OK")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_cluster_workers_share_rooms_and_campaigns(tmp_path):
+    print("Testing a two-worker cluster end to end...")
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "server.core.cluster", "--workers", "2", "--port", str(port),
+         "--internal-port", str(_free_port()), "--data-dir", str(tmp_path), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                if httpx.get(base + "/api/health").status_code == 200:
+                    break
+            except httpx.TransportError:
+                assert time.time() < deadline, "The cluster didn't start"
+                time.sleep(0.2)
+
+        # New connections each time, so requests land on both workers.
+        def call(method, path, **kwargs):
+            with httpx.Client(base_url=base) as client:
+                return client.request(method, path, **kwargs)
+
+        host = {"X-User-Code": call("POST", "/api/auth/register", json={
+            "email": "host@example.com", "password": "pw", "username": "host"}).json()["user_code"]}
+        guest = {"X-User-Code": call("POST", "/api/auth/register", json={
+            "email": "guest@example.com", "password": "pw", "username": "guest"}).json()["user_code"]}
+        campaigns = [call("POST", "/api/campaigns", json={"name": f"c{i}"}, headers=host).json()["id"] for i in range(4)]
+        rooms = []
+        for campaign_id in campaigns:
+            for i in range(3):
+                assert call("POST", f"/api/campaigns/{campaign_id}/journal", headers=host,
+                            json={"message": {"role": "user", "content": f"turn {i}"}}).status_code == 200
+            assert len(call("GET", f"/api/campaigns/{campaign_id}/journal", headers=host).json()["entries"]) == 3
+            room = call("POST", "/api/rooms", json={"is_public": True, "campaign_id": campaign_id}, headers=host).json()
+            rooms.append(room["room_code"])
+            assert call("POST", "/api/rooms/join", json={"room_code": room["room_code"].lower()},
+                        headers=guest).status_code == 200
+        for code in rooms:
+            for _ in range(3):
+                response = call("GET", f"/api/rooms/{code}")
+                assert response.json()["players"] == [host["X-User-Code"], guest["X-User-Code"]]
+                assert response.headers["x-worker"] == str(zlib.crc32(code.encode()) % 2) # Served by its owner
+        assert sorted(r["room_code"] for r in call("GET", "/api/rooms/public").json()) == sorted(rooms)
+        assert call("GET", "/internal/rooms/public").status_code == 404
+        exported = call("GET", "/api/metrics").text # Every worker's, whichever one answers
+        assert exported.count("# TYPE neuro_dnd_http_requests_total counter") == 1
+        assert 'worker="0"' in exported and 'worker="1"' in exported
+
+        # A profile update is seen by every worker's principal cache.
+        for _ in range(4):
+            call("GET", "/api/auth/me", headers=guest)
+        call("PUT", "/api/users/profile", json={"username": "renamed"}, headers=guest)
+        assert {call("GET", "/api/auth/me", headers=guest).json()["username"] for _ in range(6)} == {"renamed"}
+
+        # Room events reach WebSockets on either worker.
+        ws_url = f"ws://127.0.0.1:{port}/api/rooms/{rooms[0]}/ws?user_code="
+        with connect(ws_url + guest["X-User-Code"]) as first, connect(ws_url + host["X-User-Code"]) as second:
+            for ws in (first, second):
+                assert '"hello"' in ws.recv(timeout=10)
+            call("POST", "/api/dice/bulk", json={"rolls": [{"expression": "2d6"}], "campaign_id": campaigns[0]},
+                 headers=host)
+            for ws in (first, second):
+                while '"dice"' not in (message := ws.recv(timeout=10)):
+                    pass
+                assert '"roll":0' in message
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    print("OK")
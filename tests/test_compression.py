@@ -0,0 +1,87 @@
+import gzip
+import os
+
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from server.api import compression
+from server.api.compression import PrecompressedStaticFiles
+from server.core.config import ROOT_DIR
+
+
+def _register(client, email="player@example.com", username="player"):
+    response = client.post("/api/auth/register", json={"email": email, "password": "pw", "username": username})
+    assert response.status_code == 200
+    return {"X-User-Code": response.json()["user_code"]}
+
+
+def test_frontend_is_precompressed_and_cacheable(client):
+    print("Testing precompressed frontend assets, ETags and 304s...")
+    index = (ROOT_DIR / "frontend" / "index.html").read_bytes()
+    codings = ["br", "gzip"] if compression.brotli is not None else ["gzip"]
+    etags = set()
+    for coding in codings + ["identity"]:
+        response = client.get("/", headers={"Accept-Encoding": coding})
+        assert response.status_code == 200 and response.content == index
+        assert response.headers.get("content-encoding") == (None if coding == "identity" else coding)
+        assert response.headers["cache-control"] == "no-cache" and "Accept-Encoding" in response.headers["vary"]
+        if coding != "identity":
+            assert response.num_bytes_downloaded < len(index) / 3
+        etags.add(response.headers["etag"])
+
+        revalidated = client.get("/", headers={"Accept-Encoding": coding, "If-None-Match": response.headers["etag"]})
+        assert revalidated.status_code == 304 and revalidated.content == b""
+        assert revalidated.headers["etag"] == response.headers["etag"]
+    assert len(etags) == len(codings) + 1 # A strong ETag per representation
+
+    # The client's preference order doesn't matter, q=0 does.
+    assert client.get("/", headers={"Accept-Encoding": "gzip, br;q=0"}).headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in client.get("/", headers={"Accept-Encoding": "*;q=0"}).headers
+    stale = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": '"0123", "4567"'})
+    assert stale.status_code == 200
+
+    asset = client.get("/assets/logo.svg")
+    assert asset.headers["cache-control"].startswith("public, max-age=")
+    head = client.head("/", headers={"Accept-Encoding": "gzip"})
+    assert head.content == b"" and int(head.headers["content-length"]) < len(index)
+    assert client.get("/missing.js").status_code == 404
+    print("OK")
+
+
+def test_precompressed_files_follow_changes_on_disk(tmp_path, monkeypatch):
+    print("Testing that changed frontend files are recompressed...")
+    monkeypatch.setattr(compression, "brotli", None) # The gzip-only fallback
+    (tmp_path / "app.js").write_text("console.log('v1');\n" * 200)
+    (tmp_path / "image.png").write_bytes(os.urandom(2048))
+    static = PrecompressedStaticFiles(directory=tmp_path)
+    assert static.precompress() == 2
+    client = TestClient(Starlette(routes=[Mount("/", static)]))
+
+    first = client.get("/app.js", headers={"Accept-Encoding": "br, gzip"})
+    assert first.headers["content-encoding"] == "gzip" and first.text == "console.log('v1');\n" * 200
+    assert gzip.decompress(static._assets[str(tmp_path / "app.js")].variants["gzip"]) == first.content
+    assert "content-encoding" not in client.get("/image.png", headers={"Accept-Encoding": "gzip"}).headers
+
+    (tmp_path / "app.js").write_text("console.log('v2');\n" * 300)
+    second = client.get("/app.js", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200 and second.text == "console.log('v2');\n" * 300
+    assert second.headers["etag"] != first.headers["etag"]
+    print("OK")
+
+
+def test_large_api_responses_are_gzipped(client):
+    print("Testing streaming compression of large API responses...")
+    headers = _register(client)
+    campaign_id = client.post("/api/campaigns", json={"name": "Long"}, headers=headers).json()["id"]
+    for i in range(30):
+        client.post(f"/api/campaigns/{campaign_id}/journal", headers=headers,
+                    json={"message": {"role": "user", "content": f"The party searches room {i} for traps."}})
+
+    journal = client.get(f"/api/campaigns/{campaign_id}/journal", headers={**headers, "Accept-Encoding": "gzip"})
+    assert journal.headers["content-encoding"] == "gzip" and len(journal.json()["entries"]) == 30
+    assert journal.num_bytes_downloaded < len(journal.content) / 2
+    plain = client.get(f"/api/campaigns/{campaign_id}/journal", headers={**headers, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.json() == journal.json()
+    assert "content-encoding" not in client.get("/api/health", headers={"Accept-Encoding": "gzip"}).headers
+    print("OK")
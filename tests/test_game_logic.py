@@ -1,11 +1,17 @@
 import sys
 import os
+import itertools
+from collections import Counter
 from unittest.mock import MagicMock
 
+import numpy as np
+import pytest
+
 # Add the project root to the Python path to allow for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from server.game_logic import dice, engine
+from server.game_logic import dice, dice_notation, engine, probability, rng, rules, state
+from server.core import config
 from server.core.models import Message, CampaignMeta, UserSettings
 
 def test_dice_roll():
@@ -69,10 +75,158 @@ def test_engine_placeholder():
 
     print("OK")
 
+def test_engine_context_budget(monkeypatch):
+    print("Testing engine context budgeting...")
+    monkeypatch.setattr(config, "AI_CONTEXT_RECENT_TURNS", 6)
+    monkeypatch.setattr(config, "AI_CONTEXT_TOKEN_BUDGET", 200)
+    monkeypatch.setattr(config, "AI_CONTEXT_SUMMARY_TOKEN_BUDGET", 100)
+    journal = [Message(role="user" if i % 2 == 0 else "assistant",
+                       content=f"Turn {i} happens. " + "Words and more words. " * 8) for i in range(40)]
+    action = Message(role="user", content="I draw my sword.")
+    meta = CampaignMeta(name="Test", host_user_code="test_user")
+
+    result = engine.process_player_action(action, meta, journal, {"language": "en"},
+                                          journal_summaries=["DM: Long ago, a dragon fell."], summarized_chars=5000)
+
+    recent = result["messages"][:-1]
+    assert result["messages"][-1] == action
+    assert 0 < len(recent) <= 6 and recent == journal[-len(recent):]
+    assert sum(engine.estimate_tokens(m.content) + 4 for m in result["messages"]) <= 200
+    # Older turns are summarized; the oldest summaries fall out of the summary budget first
+    assert result["summary"].startswith("(Earlier events omitted.)")
+    assert "Turn 39" not in result["summary"] and f"Turn {39 - len(recent)} happens." in result["summary"]
+    assert engine.estimate_tokens(result["summary"]) <= 110
+    stats = result["stats"]
+    assert stats["recent_turns"] == len(recent) and stats["context_tokens"] < stats["full_tokens"] / 5
+    print("OK")
+
+def test_campaign_state_events():
+    print("Testing campaign state events...")
+    snapshot = state.empty_snapshot()
+    entries = [
+        {"role": "user", "content": "I search the crypt."},
+        {"role": "assistant", "content": "...", "meta": {
+            "location": "crypt", "item_found": "torch", "hp_change": -5, "target": "player"}},
+        {"role": "user", "content": "I talk to the figure."},
+        {"role": "assistant", "content": "...", "meta": {
+            "new_npc_introduced": "Morwen", "item_found": ["torch", "rope"], "status_effect": "poisoned"}},
+        {"role": "assistant", "content": "...", "meta": {"error": "failed_to_parse_json"}},
+        {"role": "assistant", "content": "...", "meta": {"hp_change": -50, "target": "goblin"}},
+        {"role": "assistant", "content": "...", "meta": {
+            "hp_change": "+3", "item_used": "rope", "status_removed": ["poisoned"], "new_npc_introduced": "Morwen"}},
+    ]
+    result = state.apply_entries(snapshot, entries)
+    assert result["version"] == 7 and result["events"] == 4
+    assert result["state"]["hp"] == rules.STARTING_HP - 2
+    assert result["state"]["inventory"] == {"torch": 2}
+    assert result["state"]["npcs"] == {"Morwen": {"introduced_seq": 3}}
+    assert result["state"]["location"] == "crypt" and result["state"]["status_effects"] == []
+    assert snapshot["state"] == state.initial_state() # The input snapshot is left alone
+
+    # Folding in two steps gives the same result as one
+    halfway = state.apply_entries(snapshot, entries[:3])
+    assert state.apply_entries(halfway, entries[3:]) == result
+
+    # HP stays within [0, max_hp]
+    healed = state.apply_entries(result, [{"role": "assistant", "content": "", "meta": {"hp_change": 100}}])
+    assert healed["state"]["hp"] == healed["state"]["max_hp"]
+    print("OK")
+
+def test_dice_notation_parse():
+    print("Testing dice notation parsing...")
+    cases = {
+        "8d6": "8d6", "d20": "1d20", "D20 adv + 5": "2d20kh1+5", "d20dis-1": "2d20kl1-1",
+        "4d6kh3": "4d6kh3", "4d6dl1": "4d6kh3", "2d6k1": "2d6kh1", "2d10!-1": "2d10!-1",
+        "d%": "1d100", "3+2d4-1d6": "2d4-1d6+3", "4d6kh4": "4d6",
+    }
+    for text, notation in cases.items():
+        assert dice_notation.parse(text).notation == notation, text
+    assert dice_notation.parse("4d6kh3") is dice_notation.parse("4d6kh3") # Cached
+
+    for bad in ("", "d1", "1001d6", "2d6adv", "d6kh2", "4d6kh1kl1", "2d6x", "5 5", "d6!!", "2d6 2d6"):
+        with pytest.raises(ValueError):
+            dice_notation.parse(bad)
+    print("OK")
+
+def test_dice_notation_roll():
+    print("Testing vectorized dice expression rolls...")
+    totals = dice_notation.roll(dice_notation.parse("8d6+2"), 20000)["totals"]
+    assert min(totals) >= 10 and max(totals) <= 50
+    assert abs(sum(totals) / len(totals) - 30) < 0.2
+
+    # Advantage beats disadvantage on average, and keeps one die of two
+    adv = dice_notation.roll(dice_notation.parse("d20adv"), 20000)["totals"]
+    dis = dice_notation.roll(dice_notation.parse("d20dis"), 20000)["totals"]
+    assert sum(adv) / len(adv) > 13 > 8 > sum(dis) / len(dis)
+
+    # Exploding dice can exceed their faces
+    assert max(dice_notation.roll(dice_notation.parse("d4!"), 5000)["totals"]) > 4
+
+    # Breakdowns add up, and a seed makes the batch reproducible
+    result = dice_notation.roll(dice_notation.parse("4d6kh3-1d4+1"), 50, np.random.default_rng(7), breakdown=True)
+    for total, roll in zip(result["totals"], result["rolls"]):
+        kept, penalty = roll["terms"]
+        assert sum(kept["kept"]) == 3 and kept["subtotal"] == sum(v for v, k in zip(kept["rolls"], kept["kept"]) if k)
+        assert min(kept["rolls"]) <= min(v for v, k in zip(kept["rolls"], kept["kept"]) if k)
+        assert total == roll["total"] == kept["subtotal"] - penalty["subtotal"] + 1
+    again = dice_notation.roll(dice_notation.parse("4d6kh3-1d4+1"), 50, np.random.default_rng(7), breakdown=True)
+    assert again == result
+    print("OK")
+
+def test_exact_distributions():
+    print("Testing exact dice distributions...")
+    def enumerate_totals(count, sides, keep=None, highest=True):
+        totals = Counter()
+        for faces in itertools.product(range(1, sides + 1), repeat=count):
+            ordered = sorted(faces, reverse=highest)
+            totals[sum(ordered[:keep] if keep else ordered)] += 1
+        return {total: n / sides ** count for total, n in totals.items()}
+
+    for notation, args in (("3d6", (3, 6)), ("4d6kh3", (4, 6, 3)), ("d20adv", (2, 20, 1)),
+                           ("d20dis", (2, 20, 1, False)), ("5d4dh2", (5, 4, 3, False))):
+        dist = probability.distribution(dice_notation.parse(notation))
+        expected = enumerate_totals(*args)
+        assert (dist.min, dist.max) == (min(expected), max(expected))
+        assert all(abs(dist.probability(total) - p) < 1e-12 for total, p in expected.items()), notation
+        assert abs(dist.cdf[-1] - 1) < 1e-12
+
+    # Negative terms, modifiers and exploding dice
+    dist = probability.distribution(dice_notation.parse("2d6-1d4+1"))
+    assert (dist.min, dist.max) == (-1, 12) and abs(dist.mean - 5.5) < 1e-12
+    assert abs(probability.distribution(dice_notation.parse("d6!")).mean - 4.2) < 1e-9
+
+    # Success against the DCs, as rules.check_success counts it
+    chances = probability.success_chances(probability.distribution(dice_notation.parse("d20")), modifier=5)
+    assert chances["medium"] == {"dc": 15, "probability": 0.55} and chances["trivial"]["probability"] == 1.0
+    assert chances["nearly_impossible"]["probability"] == 0.0
+
+    # Memoized
+    assert probability.distribution(dice_notation.parse("4d6kh3")) is probability.distribution(dice_notation.parse("4d6kh3"))
+    print("OK")
+
+def test_rng_streams():
+    print("Testing counter-based RNG streams...")
+    key = rng.new_key()
+    first = rng.generator(key, 7).integers(1, 21, 1000)
+    assert (rng.generator(key, 7).integers(1, 21, 1000) == first).all() # Reproducible without rolls 0-6
+    assert not (rng.generator(key, 8).integers(1, 21, 1000) == first).all()
+    assert not (rng.generator(rng.new_key(), 7).integers(1, 21, 1000) == first).all()
+
+    # Seeded d100s no longer share dice between neighbouring seeds
+    linked = sum(dice.roll_d100(seed)["ones"] == dice.roll_d100(seed + 1)["tens"] for seed in range(200))
+    assert linked < 60
+    assert dice.roll_d100(seed=5) == dice.roll_d100(seed=5)
+    print("OK")
+
 if __name__ == "__main__":
     print("--- Running Game Logic Smoke Tests ---")
     test_dice_roll()
     test_d100_roll()
     test_seeded_roll()
     test_engine_placeholder()
+    test_campaign_state_events()
+    test_dice_notation_parse()
+    test_dice_notation_roll()
+    test_exact_distributions()
+    test_rng_streams()
     print("--- All tests passed successfully! ---")
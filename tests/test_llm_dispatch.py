@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.core.llm_dispatch import LLMDispatcher, QueueFull, QueueTimeout, UserLimitReached
+
+
+class SlowBackend:
+    """A blocking fake model call that records how many calls overlap."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak_total = 0
+        self.peak_per_user = 0
+
+    def __call__(self, user_code: str) -> str:
+        with self.lock:
+            self.running[user_code] = self.running.get(user_code, 0) + 1
+            self.peak_total = max(self.peak_total, sum(self.running.values()))
+            self.peak_per_user = max(self.peak_per_user, self.running[user_code])
+        time.sleep(self.latency)
+        with self.lock:
+            self.running[user_code] -= 1
+        return user_code
+
+
+def test_dispatch_caps_concurrency():
+    print("Testing global and per-user concurrency caps...")
+    dispatcher = LLMDispatcher(max_concurrency=3, max_per_user=2, queue_size=100, queue_timeout=10)
+    backend = SlowBackend(latency=0.02)
+    users = ["hot"] * 4 + [f"user-{i}" for i in range(8)] # "hot" has 2 running and 2 waiting
+
+    async def scenario():
+        return await asyncio.gather(*(dispatcher.run(user, backend, user) for user in users))
+
+    assert asyncio.run(scenario()) == users
+    assert backend.peak_total == 3 and backend.peak_per_user == 2
+    stats = dispatcher.stats()
+    assert stats["running"] == 0 and stats["queue_depth"] == 0 and stats["admitted"] == 12
+    assert stats["queued"] > 0 and stats["wait_ms"]["max"] > 0
+    print("OK")
+
+
+def test_dispatch_sheds_load():
+    print("Testing queue bounds, per-user shedding and timeouts...")
+    dispatcher = LLMDispatcher(max_concurrency=1, max_per_user=1, queue_size=1, queue_timeout=0.05)
+
+    async def scenario():
+        held = await dispatcher.acquire("alice")
+        with pytest.raises(UserLimitReached):
+            # Alice's second call waits, her third is shed.
+            waiting = asyncio.ensure_future(dispatcher.acquire("alice"))
+            await asyncio.sleep(0)
+            await dispatcher.acquire("alice")
+        with pytest.raises(QueueFull):
+            await dispatcher.acquire("bob")
+        assert dispatcher.stats()["queue_depth"] == 1
+        with pytest.raises(QueueTimeout):
+            await waiting
+        assert dispatcher.stats()["queue_depth"] == 0
+
+        waiting = asyncio.ensure_future(dispatcher.acquire("bob"))
+        await asyncio.sleep(0)
+        held.release()
+        held.release() # Idempotent
+        (await waiting).release()
+
+    asyncio.run(scenario())
+    stats = dispatcher.stats()
+    assert stats["running"] == 0 and stats["timeouts"] == 1
+    assert stats["rejected_user_limit"] == 1 and stats["rejected_queue_full"] == 1
+    print("OK")
+
+
+def test_dispatch_timeout_after_grant_frees_slot(monkeypatch):
+    print("Testing a slot granted just as the wait times out...")
+    dispatcher = LLMDispatcher(max_concurrency=1, max_per_user=1, queue_size=1, queue_timeout=10)
+
+    async def granted_then_timed_out(future, timeout):
+        held.release() # Hands the slot to the waiter...
+        assert future.done()
+        raise asyncio.TimeoutError # ...but the timeout fires first
+
+    async def scenario():
+        nonlocal held
+        held = await dispatcher.acquire("alice")
+        monkeypatch.setattr(asyncio, "wait_for", granted_then_timed_out)
+        with pytest.raises(QueueTimeout):
+            await dispatcher.acquire("bob")
+        monkeypatch.undo()
+        (await dispatcher.acquire("carol")).release()
+
+    held = None
+    asyncio.run(scenario())
+    stats = dispatcher.stats()
+    assert stats["running"] == 0 and stats["queue_depth"] == 0 and stats["timeouts"] == 1
+    print("OK")
+
+
+def test_iterate_closes_abandoned_iterator():
+    print("Testing that an abandoned stream's iterator is closed...")
+    dispatcher = LLMDispatcher(max_concurrency=1, max_per_user=1, queue_size=1, queue_timeout=1)
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            for i in range(100):
+                time.sleep(0.02)
+                yield i
+        finally:
+            closed.set()
+
+    async def scenario():
+        stream = dispatcher.iterate(chunks())
+        assert await stream.__anext__() == 0
+        reading = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.005) # next() is now running on the pool
+        reading.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reading
+        assert closed.is_set()
+
+    asyncio.run(scenario())
+    print("OK")
@@ -0,0 +1,99 @@
+import re
+
+from server.core import metrics, storage
+
+
+def _register(client, email="player@example.com", username="player"):
+    response = client.post("/api/auth/register", json={"email": email, "password": "pw", "username": username})
+    assert response.status_code == 200
+    return {"X-User-Code": response.json()["user_code"]}
+
+
+def _samples(text):
+    """Parses the Prometheus text format into {'name{labels}': value}."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics_text_format(monkeypatch):
+    print("Testing counters, histograms and the Prometheus text format...")
+    monkeypatch.setattr(metrics, "_registry", [])
+    requests = metrics.Counter("test_requests_total", "Requests.", ("route",))
+    latency = metrics.Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    metrics.Collected("test_queue_depth", "Queue.", lambda: 3)
+
+    requests.inc(labels=('/a "quoted"\\path',))
+    requests.inc(2, labels=('/a "quoted"\\path',))
+    for value in (0.05, 0.1, 0.5, 7):
+        latency.observe(value)
+
+    text = metrics.render(metrics.snapshot())
+    assert "# TYPE test_requests_total counter\n" in text and "# TYPE test_latency_seconds histogram\n" in text
+    samples = _samples(text)
+    assert samples['test_requests_total{route="/a \\"quoted\\"\\\\path"}'] == 3
+    assert samples['test_latency_seconds_bucket{le="0.1"}'] == 2 # Cumulative, and le is inclusive
+    assert samples['test_latency_seconds_bucket{le="1"}'] == 3
+    assert samples['test_latency_seconds_bucket{le="+Inf"}'] == samples["test_latency_seconds_count"] == 4
+    assert samples["test_latency_seconds_sum"] == 7.65
+    assert samples["test_queue_depth"] == 3
+
+    # Workers' snapshots merge into one family per metric.
+    merged = metrics.render(metrics.with_labels(metrics.snapshot(), worker="0"),
+                            metrics.with_labels(metrics.snapshot(), worker="1"))
+    assert merged.count("# TYPE test_latency_seconds histogram") == 1
+    assert _samples(merged)['test_latency_seconds_count{worker="1"}'] == 4
+
+    monkeypatch.setattr(metrics.config, "METRICS_ENABLED", False)
+    requests.inc(labels=("/b",))
+    assert requests.value(("/b",)) == 0
+    print("OK")
+
+
+def test_metrics_endpoint(client, backend, monkeypatch):
+    print("Testing /api/metrics for requests, storage and model calls...")
+    from server.core.ai_client import FakeModel, client as ai_client
+
+    metrics.reset()
+    headers = _register(client)
+    campaign = client.post("/api/campaigns", json={"name": "Crypt"}, headers=headers).json()
+    for _ in range(3):
+        assert client.get(f"/api/campaigns/{campaign['id']}", headers=headers).status_code == 200
+    assert client.get("/api/campaigns/not-a-campaign", headers=headers).status_code in (400, 404)
+
+    monkeypatch.setattr(ai_client, "model", FakeModel(reply="The door opens."))
+    body = {"campaign_id": campaign["id"], "messages": [{"role": "user", "content": "I open the door."}]}
+    assert client.post("/api/ai/complete", headers=headers, json=body).status_code == 200
+
+    class BrokenModel(FakeModel):
+        def generate_content(self, prompt, stream=False):
+            raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(ai_client, "model", BrokenModel())
+    body["messages"][0]["content"] = "I open the other door."
+    assert client.post("/api/ai/complete", headers=headers, json=body).status_code == 503
+
+    response = client.get("/api/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+    route = f'method="GET",route="/api/campaigns/{{campaign_id}}"'
+    assert samples[f'neuro_dnd_http_requests_total{{{route},status="200"}}'] == 3
+    assert samples[f'neuro_dnd_http_request_duration_seconds_count{{{route}}}'] == 4
+    assert not any(campaign["id"] in name for name in samples) # Route templates, not paths
+    assert samples['neuro_dnd_http_requests_total{method="POST",route="/api/ai/complete",status="503"}'] == 1
+
+    if isinstance(backend, storage.JsonFileBackend):
+        assert samples["neuro_dnd_storage_json_write_seconds_count"] >= 2 # Profile and campaign metadata
+        assert samples["neuro_dnd_storage_json_write_bytes_total"] > 0
+        assert samples['neuro_dnd_storage_json_read_seconds_count{result="hit"}'] > 0
+    assert samples['neuro_dnd_storage_lock_wait_seconds_count{lock="key"}'] > 0
+
+    assert samples['neuro_dnd_llm_calls_total{mode="complete",outcome="ok"}'] == 1
+    assert samples['neuro_dnd_llm_calls_total{mode="complete",outcome="error"}'] == 1
+    assert samples['neuro_dnd_llm_response_chars_sum{mode="complete"}'] == len("The door opens.")
+    assert samples['neuro_dnd_llm_prompt_chars_count{mode="complete"}'] == 2
+    assert re.search(r'^neuro_dnd_llm_dispatch_total\{event="admitted"\} [1-9]', response.text, re.M)
+    print("OK")
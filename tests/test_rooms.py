@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from server.core import config, serialization, storage
+from server.core.room_hub import RoomHub
+from server.core.room_registry import RoomRegistry
+
+
+def _register(client, email="player@example.com", username="player"):
+    response = client.post("/api/auth/register", json={"email": email, "password": "pw", "username": username})
+    assert response.status_code == 200
+    return {"X-User-Code": response.json()["user_code"]}
+
+
+def test_room_registry_persistence_and_expiry(backend, monkeypatch):
+    print("Testing room registry indexes, persistence and idle expiry...")
+
+    async def scenario():
+        registry = RoomRegistry()
+        public = await registry.create("host-a", "Tavern", is_public=True)
+        private = await registry.create("host-b", None, is_public=False)
+        await registry.join(public["room_code"], "guest")
+        assert [r["room_code"] for r in await registry.list_public()] == [public["room_code"]]
+
+        # A fresh registry (e.g. after a restart) sees the same rooms.
+        reloaded = RoomRegistry()
+        room = await reloaded.get(public["room_code"])
+        assert room["players"] == ["host-a", "guest"]
+        assert (await reloaded.get(private["room_code"]))["name"] == f"Room {private['room_code']}"
+
+        # Only the idle room expires, and the expiry is persisted.
+        monkeypatch.setattr(config, "ROOM_IDLE_TTL_SECONDS", 60)
+        reloaded._last_active[private["room_code"]] = time.time() - 120
+        assert await reloaded.sweep() == 1
+        assert await reloaded.get(private["room_code"]) is None
+
+        await reloaded.snapshot()
+        assert [r["room_code"] for r in storage.get_backend().list_rooms()] == [public["room_code"]]
+
+    asyncio.run(scenario())
+    print("OK")
+
+
+def test_room_hub_fanout_eviction_and_resume(monkeypatch):
+    print("Testing room hub fan-out, slow-consumer eviction and resume...")
+    monkeypatch.setattr(config, "ROOM_HUB_SEND_QUEUE", 2)
+    monkeypatch.setattr(config, "ROOM_HUB_REPLAY_EVENTS", 3)
+
+    async def scenario():
+        hub = RoomHub()
+        assert hub.publish("ROOM", "journal", {}) is None # Nobody listening
+
+        fast, hello, backlog = hub.subscribe("ROOM", "a")
+        slow, _, _ = hub.subscribe("ROOM", "b")
+        assert hello["seq"] == 0 and not hello["resumed"] and backlog == []
+        assert hub.online("ROOM") == ["a", "b"]
+
+        for i in range(2):
+            hub.publish("ROOM", "journal", {"i": i})
+            assert serialization.loads(await fast.queue.get())["data"] == {"i": i}
+        # The third event overflows the slow subscriber's queue.
+        assert hub.publish("ROOM", "journal", {"i": 2}) == 3
+        assert slow.evicted.is_set() and not fast.evicted.is_set()
+        assert hub.online("ROOM") == ["a"]
+
+        # Resuming from seq 1 replays 2 and 3; seq 0 has left the backlog.
+        again, hello2, backlog = hub.subscribe("ROOM", "b", since_seq=1, epoch=hello["epoch"])
+        assert hello2["resumed"] and [serialization.loads(m)["seq"] for m in backlog] == [2, 3]
+        hub.publish("ROOM", "journal", {"i": 3})
+        _, hello3, backlog = hub.subscribe("ROOM", "b", since_seq=0, epoch=hello["epoch"])
+        assert not hello3["resumed"] and backlog == []
+        _, hello4, _ = hub.subscribe("ROOM", "b", since_seq=4, epoch="stale")
+        assert not hello4["resumed"]
+        assert hub.stats()["evicted"] == 1 and hub.stats()["resumed"] == 1 and hub.stats()["resyncs"] == 2
+
+        # Idle channels are dropped once the resume window has passed.
+        for subscriber in list(hub._channels["ROOM"].subscribers):
+            hub.unsubscribe("ROOM", subscriber)
+        assert hub.sweep() == 0
+        assert hub.sweep(now=time.monotonic() + config.ROOM_HUB_RESUME_WINDOW_SECONDS + 1) == 1
+
+    asyncio.run(scenario())
+    print("OK")
+
+
+def test_room_websocket_events(client):
+    print("Testing room WebSocket events, presence and resume...")
+    host = _register(client)
+    guest = _register(client, email="guest@example.com", username="guest")
+    campaign_id = client.post("/api/campaigns", json={"name": "Live"}, headers=host).json()["id"]
+    assert client.post("/api/rooms", json={"is_public": False, "campaign_id": "0" * 32},
+                       headers=host).status_code == 404
+    room_code = client.post("/api/rooms", json={"is_public": False, "campaign_id": campaign_id},
+                            headers=host).json()["room_code"]
+
+    with pytest.raises(WebSocketDisconnect) as refused:
+        with client.websocket_connect(f"/api/rooms/{room_code}/ws?user_code={guest['X-User-Code']}") as ws:
+            ws.receive_text()
+    assert refused.value.code == 4403
+    with pytest.raises(WebSocketDisconnect) as refused:
+        with client.websocket_connect(f"/api/rooms/{room_code}/ws") as ws:
+            ws.receive_text()
+    assert refused.value.code == 4401
+
+    token = client.post("/api/auth/session", headers=host).json()["session_token"]
+    with client.websocket_connect(f"/api/rooms/{room_code}/ws?token={token}") as host_ws:
+        hello = host_ws.receive_json()
+        assert hello["type"] == "hello" and hello["online"] == [host["X-User-Code"]]
+        assert host_ws.receive_json()["type"] == "join"
+
+        client.post("/api/rooms/join", json={"room_code": room_code}, headers=guest)
+        assert host_ws.receive_json()["type"] == "member_joined"
+        with client.websocket_connect(f"/api/rooms/{room_code}/ws?user_code={guest['X-User-Code']}") as guest_ws:
+            guest_hello = guest_ws.receive_json()
+            assert sorted(guest_hello["online"]) == sorted([host["X-User-Code"], guest["X-User-Code"]])
+            assert host_ws.receive_json()["data"] == {"user_code": guest["X-User-Code"]}
+            assert guest_ws.receive_json()["type"] == "join"
+
+            client.post(f"/api/campaigns/{campaign_id}/journal",
+                        json={"message": {"role": "user", "content": "I open the door"}}, headers=host)
+            client.post("/api/dice/bulk", json={"rolls": [{"expression": "d20"}], "campaign_id": campaign_id},
+                        headers=host)
+            for ws in (host_ws, guest_ws):
+                journal, dice = ws.receive_json(), ws.receive_json()
+                assert journal["type"] == "journal" and journal["data"]["entry"]["content"] == "I open the door"
+                assert dice["type"] == "dice" and dice["data"]["results"][0]["roll"] == 0
+            guest_ws.send_text("ping")
+            assert guest_ws.receive_text() == "pong"
+            last_seq = dice["seq"]
+
+        assert host_ws.receive_json()["type"] == "leave"
+        client.post(f"/api/campaigns/{campaign_id}/journal",
+                    json={"message": {"role": "user", "content": "while you were away"}}, headers=host)
+        host_ws.receive_json()
+
+        # The guest reconnects and gets what it missed.
+        resume = f"since_seq={last_seq}&epoch={guest_hello['epoch']}"
+        with client.websocket_connect(f"/api/rooms/{room_code}/ws?user_code={guest['X-User-Code']}&{resume}") as guest_ws:
+            assert guest_ws.receive_json()["resumed"]
+            assert [guest_ws.receive_json()["type"] for _ in range(3)] == ["leave", "journal", "join"]
+    print("OK")
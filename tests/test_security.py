@@ -0,0 +1,24 @@
+from server.core import security
+
+
+def test_session_token_roundtrip():
+    print("Testing session token signing...")
+    token = security.create_session_token("user-1")
+    assert security.verify_session_token(token) == "user-1"
+
+    user_code, expires_at, signature = token.split(".")
+    assert security.verify_session_token(f"user-2.{expires_at}.{signature}") is None
+    assert security.verify_session_token(f"{user_code}.{int(expires_at) + 60}.{signature}") is None
+    assert security.verify_session_token(security.create_session_token("user-1", ttl_seconds=-1)) is None
+    assert security.verify_session_token("garbage") is None
+    assert security.verify_session_token(f"{user_code}.{expires_at}.{signature[:-1]}é") is None
+    print("OK")
+
+
+def test_non_ascii_bearer_token_is_unauthorized(client):
+    print("Testing a bearer token with non-ASCII characters...")
+    expires_at = security.create_session_token("user-1").split(".")[1]
+    token = f"user-1.{expires_at}.sïgnature"
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}".encode("latin-1")})
+    assert response.status_code == 401
+    print("OK")
@@ -0,0 +1,24 @@
+import uuid
+from datetime import datetime
+
+from server.core import serialization
+
+
+def _roundtrip(monkeypatch, orjson):
+    monkeypatch.setattr(serialization, "orjson", orjson)
+    campaign_id = uuid.uuid4()
+    data = {"id": campaign_id, "created_at": datetime(2024, 1, 2, 3, 4, 5, 6), "name": "Сага", "tags": {"a"}}
+    encoded = serialization.dumps(data)
+    assert b"\n" not in encoded and b"  " not in encoded
+    assert b"\n" in serialization.dumps(data, pretty=True)
+    assert serialization.loads(encoded) == {
+        "id": str(campaign_id), "created_at": "2024-01-02T03:04:05.000006", "name": "Сага", "tags": ["a"],
+    }
+
+
+def test_serialization_backends(monkeypatch):
+    print("Testing JSON serialization (orjson and stdlib)...")
+    if serialization.orjson is not None:
+        _roundtrip(monkeypatch, serialization.orjson)
+    _roundtrip(monkeypatch, None)
+    print("OK")
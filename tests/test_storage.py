@@ -0,0 +1,378 @@
+import asyncio
+import sys
+import os
+import json
+
+# Add the project root to the Python path to allow for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from server.core import config, journal, storage
+from server.core.migrate import import_json_tree
+from server.core.storage_sqlite import SqliteBackend
+
+
+def _entry(i: int) -> dict:
+    return {"role": "user", "content": f"turn {i}", "timestamp": "2024-01-01T00:00:00"}
+
+
+def test_journal_append_and_read(tmp_path, monkeypatch):
+    print("Testing journal append/read across segments...")
+    monkeypatch.setattr(config, "JOURNAL_SEGMENT_ENTRIES", 3)
+    journal.create_journal(tmp_path)
+
+    for i in range(10):
+        journal.append_entries(tmp_path, [_entry(i)])
+
+    assert journal.entry_count(tmp_path) == 10
+    assert [e["content"] for e in journal.read_entries(tmp_path)] == [f"turn {i}" for i in range(10)]
+    assert [e["content"] for e in journal.read_entries(tmp_path, 2, 7)] == [f"turn {i}" for i in range(2, 7)]
+
+    # Garbage left by a crashed append is not visible and gets overwritten.
+    manifest = json.loads((journal.get_journal_dir(tmp_path) / "manifest.json").read_text())
+    with open(journal.get_journal_dir(tmp_path) / manifest["segments"][-1]["name"], "ab") as f:
+        f.write(b'{"role": "user", "cont')
+    journal.append_entries(tmp_path, [_entry(10)])
+    assert journal.read_entries(tmp_path, 9)[-1]["content"] == "turn 10"
+    print("OK")
+
+
+def test_journal_legacy_migration(tmp_path):
+    print("Testing migration of legacy journal.json...")
+    legacy = {"entries": [_entry(i) for i in range(5)]}
+    (tmp_path / "journal.json").write_text(json.dumps(legacy))
+
+    assert journal.journal_exists(tmp_path)
+    assert journal.read_entries(tmp_path) == legacy["entries"]
+    assert not (tmp_path / "journal.json").exists()
+
+    journal.append_entries(tmp_path, [_entry(5)])
+    assert journal.entry_count(tmp_path) == 6
+    print("OK")
+
+
+def test_journal_compaction(tmp_path, monkeypatch):
+    print("Testing journal compaction...")
+    monkeypatch.setattr(config, "JOURNAL_SEGMENT_ENTRIES", 2)
+    monkeypatch.setattr(config, "JOURNAL_COMPACTED_SEGMENT_ENTRIES", 100)
+    monkeypatch.setattr(config, "JOURNAL_COMPACTION_THRESHOLD", 3)
+    journal.create_journal(tmp_path)
+
+    manifest = None
+    for i in range(9):
+        manifest = journal.append_entries(tmp_path, [_entry(i)])
+    assert journal.needs_compaction(manifest)
+
+    journal.compact(tmp_path)
+    segment_files = list(journal.get_journal_dir(tmp_path).glob("seg_*.jsonl"))
+    assert len(segment_files) == 2  # one compacted + the active segment
+    assert [e["content"] for e in journal.read_entries(tmp_path)] == [f"turn {i}" for i in range(9)]
+
+    journal.append_entries(tmp_path, [_entry(9)])
+    assert journal.read_entries(tmp_path, 8) == [_entry(8), _entry(9)]
+    print("OK")
+
+
+def test_journal_compaction_settles(tmp_path, monkeypatch):
+    print("Testing that compaction stops once segments can't be merged further...")
+    monkeypatch.setattr(config, "JOURNAL_SEGMENT_ENTRIES", 2)
+    monkeypatch.setattr(config, "JOURNAL_COMPACTED_SEGMENT_ENTRIES", 5)
+    monkeypatch.setattr(config, "JOURNAL_COMPACTION_THRESHOLD", 3)
+    journal.create_journal(tmp_path)
+    for i in range(17):
+        manifest = journal.append_entries(tmp_path, [_entry(i)])
+    assert journal.needs_compaction(manifest)
+
+    # Pairs of 2-entry segments merge into 4-entry ones, which are still
+    # below the target but can't be merged with each other.
+    journal.compact(tmp_path)
+    manifest = journal.append_entries(tmp_path, [_entry(17)])
+    assert [s["count"] for s in manifest["segments"]] == [4, 4, 4, 4, 2]
+    assert not journal.needs_compaction(manifest)
+    manifest_file = journal.get_journal_dir(tmp_path) / "manifest.json"
+    before = manifest_file.stat().st_mtime_ns
+    journal.compact(tmp_path)
+    assert manifest_file.stat().st_mtime_ns == before
+    assert [e["content"] for e in journal.read_entries(tmp_path)] == [f"turn {i}" for i in range(18)]
+    print("OK")
+
+
+def test_read_json_cache(tmp_path):
+    print("Testing storage.read_json cache and invalidation...")
+    storage.clear_read_cache()
+    path = tmp_path / "doc.json"
+    storage.write_json(path, {"value": 1})
+
+    before = storage.get_read_cache_stats()
+    assert storage.read_json(path) == {"value": 1}
+    assert storage.read_json(path) == {"value": 1}
+    after = storage.get_read_cache_stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+    # Writes through storage invalidate the entry.
+    inode = path.stat().st_ino
+    storage.write_json(path, {"value": 2})
+    assert storage.read_json(path) == {"value": 2}
+    # ...and swap in a complete new file rather than rewriting in place.
+    assert path.stat().st_ino != inode and list(tmp_path.glob("*.tmp")) == []
+
+    # So do edits made behind our back (size change => new version).
+    path.write_text(json.dumps({"value": 300}))
+    assert storage.read_json(path) == {"value": 300}
+
+    path.unlink()
+    assert storage.read_json(path) is None
+    print("OK")
+
+
+def test_migrate_json_tree_to_sqlite(data_dir):
+    print("Testing JSON tree -> SQLite migration...")
+    source = storage.JsonFileBackend()
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    source.save_user_profile({"user_code": user_code, "email": "a@example.com", "username": "a"})
+    source.add_user_to_index("a@example.com", user_code, "a")
+    source.save_user_settings(user_code, {"theme": "light", "language": "ru"})
+    source.save_campaign_meta(user_code, {"id": campaign_id, "name": "Old", "created_at": "2024-01-01T00:00:00"})
+    # A legacy single-file journal, as written by older versions.
+    legacy_path = storage.get_campaign_dir(user_code, campaign_id) / "journal.json"
+    legacy_path.write_text(json.dumps({"entries": [_entry(i) for i in range(3)]}))
+    source.save_room({"room_code": "ABCD", "is_public": True, "players": [user_code]})
+    source.reserve_rolls(user_code, campaign_id, 4, "aa" * 16)
+
+    target = SqliteBackend(data_dir / "migrated.sqlite3")
+    counts = import_json_tree(source, target)
+    assert counts["users"] == 1 and counts["campaigns"] == 1 and counts["journal_entries"] == 3
+
+    assert target.find_user_code_by_email("a@example.com") == user_code
+    assert target.get_user_settings(user_code)["language"] == "ru"
+    assert target.list_campaign_metas(user_code)[0]["name"] == "Old"
+    assert target.read_journal(user_code, campaign_id, 1) == [_entry(1), _entry(2)]
+    assert target.append_journal_entry(user_code, campaign_id, _entry(3))["seq"] == 3
+    assert target.list_rooms()[0]["room_code"] == "ABCD"
+    assert target.get_rng_stream(user_code, campaign_id) == {"key": "aa" * 16, "counter": 4}
+
+    # Re-running the import is harmless.
+    import_json_tree(source, target)
+    assert len(target.read_journal(user_code, campaign_id)) == 3
+    print("OK")
+
+
+def test_sharded_user_index(data_dir):
+    print("Testing sharded email index and legacy index.json import...")
+    config.INDEX_FILE.write_text(json.dumps({
+        "users": {"old@example.com": {"user_code": "legacy-code", "username": "old"}},
+        "campaigns": {},
+    }))
+    backend = storage.JsonFileBackend()
+
+    assert backend.find_user_code_by_email("old@example.com") == "legacy-code"
+    assert backend.add_user_to_index("new@example.com", "new-code", "new")
+    assert not backend.add_user_to_index("new@example.com", "other-code", "thief")
+    assert backend.find_user_code_by_email("new@example.com") == "new-code"
+    assert backend.find_user_code_by_email("nobody@example.com") is None
+    assert dict(backend.iter_index()).keys() == {"old@example.com", "new@example.com"}
+    print("OK")
+
+
+def test_campaign_manifest(data_dir):
+    print("Testing per-user campaign manifest...")
+    backend = storage.JsonFileBackend()
+    user_code = "11111111-1111-1111-1111-111111111111"
+    ids = [f"00000000-0000-0000-0000-00000000000{i}" for i in range(4)]
+    # Campaigns written before the manifest existed
+    for i, campaign_id in enumerate(ids[:3]):
+        storage.write_json(storage.get_campaign_meta_file(user_code, campaign_id),
+                           {"id": campaign_id, "name": f"c{i}", "status": "active", "created_at": f"2024-01-0{i + 1}T00:00:00"})
+
+    assert sorted(m["name"] for m in backend.list_campaign_metas(user_code)) == ["c0", "c1", "c2"]
+    manifest_file = storage.get_campaigns_dir(user_code) / "manifest.json"
+    assert len(storage.read_json(manifest_file)["campaigns"]) == 3
+
+    backend.save_campaign_meta(user_code, {"id": ids[3], "name": "c3", "status": "archived", "created_at": "2024-01-04T00:00:00"})
+    assert backend.delete_campaign(user_code, ids[0])
+    assert sorted(storage.read_json(manifest_file)["campaigns"]) == ids[1:]
+
+    page, cursor = backend.query_campaign_metas(user_code, limit=2)
+    assert [m["name"] for m in page] == ["c3", "c2"]
+    page, cursor = backend.query_campaign_metas(user_code, cursor=cursor, limit=2)
+    assert [m["name"] for m in page] == ["c1"] and cursor is None
+    print("OK")
+
+
+def test_incremental_checkpoints(backend, monkeypatch):
+    print("Testing incremental checkpoints, retention and restore...")
+    from datetime import datetime, timedelta
+    from server.core import checkpoints
+
+    monkeypatch.setattr(config, "JOURNAL_SEGMENT_ENTRIES", 4) # Rollbacks cut through segments
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    backend.save_campaign_meta(user_code, {"id": campaign_id, "name": "Saga", "status": "active", "created_at": "2024-01-01T00:00:00"})
+    backend.create_journal(user_code, campaign_id)
+
+    day = datetime(2024, 3, 1)
+    for i in range(6):
+        for j in range(5):
+            backend.append_journal_entry(user_code, campaign_id, _entry(i * 5 + j))
+        checkpoints.create_checkpoint(backend, user_code, campaign_id, now=day + timedelta(hours=12 * i))
+    records = backend.list_checkpoints(user_code, campaign_id)
+    assert [(r["start"], r["seq"]) for r in records] == [(i * 5, i * 5 + 5) for i in range(6)]
+    # Nothing changed: the latest checkpoint is reused
+    assert checkpoints.create_checkpoint(backend, user_code, campaign_id)[0]["name"] == records[-1]["name"]
+
+    # Keep the last 2 plus the newest of each day; pruned ranges fold into the next survivor
+    monkeypatch.setattr(config, "CHECKPOINT_KEEP_LAST", 2)
+    pruned = checkpoints.apply_retention(backend, user_code, campaign_id, now=day + timedelta(days=3))
+    assert pruned == [records[0]["name"], records[2]["name"]]
+    records = backend.list_checkpoints(user_code, campaign_id)
+    assert [(r["start"], r["seq"]) for r in records] == [(0, 10), (10, 20), (20, 25), (25, 30)]
+    assert checkpoints.rebuild_journal(backend, user_code, campaign_id, records[:3]) == [_entry(i) for i in range(25)]
+
+    # Roll back: journal truncated, meta restored, later checkpoints dropped
+    backend.save_campaign_meta(user_code, {**backend.get_campaign_meta(user_code, campaign_id), "status": "archived"})
+    assert checkpoints.restore_checkpoint(backend, user_code, campaign_id, records[1]["name"])["seq"] == 20
+    assert backend.read_journal(user_code, campaign_id) == [_entry(i) for i in range(20)]
+    assert backend.get_campaign_meta(user_code, campaign_id)["status"] == "active"
+    assert [r["name"] for r in backend.list_checkpoints(user_code, campaign_id)] == [r["name"] for r in records[:2]]
+    assert backend.append_journal_entry(user_code, campaign_id, _entry(99))["seq"] == 20
+
+    # A lost journal is rebuilt from the chain
+    backend.truncate_journal(user_code, campaign_id, 0)
+    checkpoints.restore_checkpoint(backend, user_code, campaign_id, records[1]["name"])
+    assert backend.read_journal(user_code, campaign_id) == [_entry(i) for i in range(20)]
+    print("OK")
+
+
+def test_restore_waits_for_derived_updates(backend):
+    print("Testing that a restore waits for summary and state updates in flight...")
+    from server.core import checkpoints
+
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    backend.save_campaign_meta(user_code, {"id": campaign_id, "name": "Saga", "status": "active", "created_at": "2024-01-01T00:00:00"})
+    backend.create_journal(user_code, campaign_id)
+    for i in range(3):
+        backend.append_journal_entry(user_code, campaign_id, _entry(i))
+    name = checkpoints.create_checkpoint(backend, user_code, campaign_id)[0]["name"]
+    backend.append_journal_entry(user_code, campaign_id, _entry(3))
+
+    async def scenario():
+        for lock in ("summary", "state"):
+            async with storage.key_lock(f"{lock}:{campaign_id}"):
+                restore = asyncio.ensure_future(storage.arestore_checkpoint(user_code, campaign_id, name))
+                await asyncio.sleep(0.05)
+                assert not restore.done(), lock
+            assert (await restore)["seq"] == 3
+            backend.append_journal_entry(user_code, campaign_id, _entry(3))
+
+    asyncio.run(scenario())
+    assert backend.journal_length(user_code, campaign_id) == 4
+    print("OK")
+
+
+def test_rolling_journal_summaries(backend, monkeypatch):
+    print("Testing incremental journal summaries...")
+    from server.core import summaries
+
+    monkeypatch.setattr(config, "AI_SUMMARY_SEGMENT_ENTRIES", 4)
+    monkeypatch.setattr(config, "AI_CONTEXT_RECENT_TURNS", 3)
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    backend.save_campaign_meta(user_code, {"id": campaign_id, "name": "Saga", "status": "active", "created_at": "2024-01-01T00:00:00"})
+    backend.create_journal(user_code, campaign_id)
+    for i in range(13):
+        backend.append_journal_entry(user_code, campaign_id, _entry(i))
+
+    saves = []
+    save = backend.save_journal_summary
+    monkeypatch.setattr(backend, "save_journal_summary", lambda *args: saves.append(args) or save(*args))
+
+    # 13 entries, 3 kept verbatim: two whole segments are old enough
+    assert summaries.summarizable_length(13) == 8
+    summary = summaries.update_summary(backend, user_code, campaign_id, 8)
+    assert [(s["start"], s["stop"]) for s in summary["segments"]] == [(0, 4), (4, 8)]
+    assert summary["segments"][0]["text"] == "\n".join(f"Player: turn {i}" for i in range(4))
+    assert summaries.update_summary(backend, user_code, campaign_id, 8) == summary and len(saves) == 1
+
+    # Only the new segment is summarized
+    for i in range(13, 17):
+        backend.append_journal_entry(user_code, campaign_id, _entry(i))
+    monkeypatch.setattr(summaries, "summarize_entries", lambda entries: f"{len(entries)} new")
+    grown = summaries.update_summary(backend, user_code, campaign_id, summaries.summarizable_length(17))
+    assert grown["segments"][:2] == summary["segments"] and grown["segments"][2]["text"] == "4 new"
+
+    # Rolling the journal back drops the summaries it invalidates
+    backend.truncate_journal(user_code, campaign_id, 6)
+    assert summaries.covered(backend.get_journal_summary(user_code, campaign_id)) == 4
+    backend.replace_journal(user_code, campaign_id, [_entry(0)])
+    assert summaries.covered(backend.get_journal_summary(user_code, campaign_id)) == 0
+    print("OK")
+
+
+def test_campaign_state_snapshots(backend, monkeypatch):
+    print("Testing incremental campaign state snapshots...")
+    from server.game_logic import state
+
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    backend.save_campaign_meta(user_code, {"id": campaign_id, "name": "Saga", "status": "active", "created_at": "2024-01-01T00:00:00"})
+    backend.create_journal(user_code, campaign_id)
+
+    def turn(i):
+        backend.append_journal_entry(user_code, campaign_id, _entry(i))
+        backend.append_journal_entry(user_code, campaign_id, {
+            "role": "assistant", "content": f"reply {i}", "meta": {"item_found": f"coin {i}"}})
+
+    for i in range(10):
+        turn(i)
+    snapshot = state.update_state(backend, user_code, campaign_id)
+    assert snapshot["version"] == 20 and snapshot["events"] == 10 and len(snapshot["state"]["inventory"]) == 10
+    assert backend.get_campaign_state(user_code, campaign_id) == snapshot
+
+    # Only the tail after the snapshot is read
+    reads = []
+    read = backend.read_journal
+    monkeypatch.setattr(backend, "read_journal", lambda *args: reads.append(args[2:]) or read(*args))
+    assert state.update_state(backend, user_code, campaign_id) == snapshot and reads == []
+    turn(10)
+    assert state.update_state(backend, user_code, campaign_id)["events"] == 11 and reads == [(20, 22)]
+
+    # Rolling the journal back resets the snapshot, which is then rebuilt
+    backend.truncate_journal(user_code, campaign_id, 6)
+    assert backend.get_campaign_state(user_code, campaign_id) in (None, state.empty_snapshot())
+    rebuilt = state.update_state(backend, user_code, campaign_id)
+    assert rebuilt["version"] == 6 and sorted(rebuilt["state"]["inventory"]) == ["coin 0", "coin 1", "coin 2"]
+    backend.replace_journal(user_code, campaign_id, [_entry(0)])
+    assert state.update_state(backend, user_code, campaign_id)["state"] == state.initial_state()
+    print("OK")
+
+
+def test_rng_stream_counters(backend):
+    print("Testing RNG stream roll reservations...")
+    user_code = "11111111-1111-1111-1111-111111111111"
+    campaign_id = "22222222-2222-2222-2222-222222222222"
+    assert backend.reserve_rolls(user_code, campaign_id, 1, "aa" * 16) is None # No such campaign
+    backend.save_campaign_meta(user_code, {"id": campaign_id, "name": "Saga", "status": "active", "created_at": "2024-01-01T00:00:00"})
+    backend.create_journal(user_code, campaign_id)
+    assert backend.get_rng_stream(user_code, campaign_id) is None
+
+    assert backend.reserve_rolls(user_code, campaign_id, 3, "aa" * 16) == {"key": "aa" * 16, "first": 0}
+    # The key is created once; later reservations continue the count
+    assert backend.reserve_rolls(user_code, campaign_id, 2, "bb" * 16) == {"key": "aa" * 16, "first": 3}
+    backend.truncate_journal(user_code, campaign_id, 0)
+    assert backend.get_rng_stream(user_code, campaign_id) == {"key": "aa" * 16, "counter": 5}
+    assert backend.reserve_rolls("33333333-3333-3333-3333-333333333333", campaign_id, 1, "cc" * 16) is None
+    print("OK")
+
+
+def test_use_data_dir_moves_sqlite_path(data_dir, monkeypatch):
+    print("Testing that use_data_dir repoints SQLITE_PATH...")
+    monkeypatch.delenv("SQLITE_PATH", raising=False)
+    config.use_data_dir(data_dir / "other")
+    assert config.SQLITE_PATH == data_dir / "other" / "neuro_dnd.sqlite3"
+
+    monkeypatch.setenv("SQLITE_PATH", str(data_dir / "chosen.sqlite3"))
+    config.use_data_dir(data_dir / "third")
+    assert config.SQLITE_PATH == data_dir / "other" / "neuro_dnd.sqlite3" # Set in the environment: left alone
+    print("OK")